@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Micro-benchmark of the per-sample overhead of ADCDifferentialPi.read_voltage.
+A fake SMBus that always returns a completed conversion is used, so only the
+Python decode path is measured (no I2C or conversion time). The legacy
+if/elif decode ladder is reproduced below as the "before" reference and is
+compared with the precomputed decode profile used by the driver. Both read
+the same virtual clock, which keeps the driver's conversion deadline wait
+from sleeping; its bookkeeping (a clock read and the sample counter, as the
+legacy read takes one clock reading for its timeout) is included in the
+"after" cost, as are the plausibility check and the dispatch of the retry
+and oversampling paths. Each path is timed in alternating rounds and the
+median speed-up is reported with its range over the rounds. On the Pi both
+are dominated by the I2C transaction.
+
+Run using: python3 BenchmarkADCDecode.py
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import itertools
+import time
+
+from mMCP3424 import ADCDifferentialPi
+
+
+class cFakeSMBus:
+    # minimal SMBus stand-in that returns a ready, negative conversion result
+    def write_byte(self, address, value):
+        pass
+
+    def read_i2c_block_data(self, address, cmd, length):
+        return [0x81, 0x23, 0x45, 0x00][:length]
+
+
+class cFakeClock:
+    # virtual clock that advances one second per reading, so every
+    # conversion is already due and the deadline wait never sleeps
+    def __init__(self):
+        self.monotonic = itertools.count(0.0, 1.0).__next__
+
+    def sleep(self, seconds):
+        pass
+
+
+class cLegacyADC:
+    # reference copy of the original read_raw/read_voltage decode ladder
+    def __init__(self, bus, bitrate, pga, lsb, clock=time):
+        self.bus = bus
+        self.clock = clock
+        self.bitrate = bitrate
+        self.pga = pga
+        self.lsb = lsb
+        self.conf = 0x9C
+        self.address = 0x68
+        self.channel = 1
+        self.conversionmode = 1
+        self.signbit = False
+
+    def setchannel(self, channel):
+        if channel < 5:
+            if channel != self.channel:
+                self.channel = channel
+
+    def read_voltage(self, channel):
+        raw = self.read_raw(channel)
+        if self.signbit:
+            voltage = (raw * (self.lsb / self.pga)) - (2.048 /
+                                                       (self.pga * 2))
+        else:
+            voltage = (raw * (self.lsb / self.pga))
+        return float(voltage)
+
+    def read_raw(self, channel):
+        high = 0
+        low = 0
+        mid = 0
+        cmdbyte = 0
+        self.setchannel(channel)
+        if channel > 0 and channel < 5:
+            config = self.conf
+            address = self.address
+        else:
+            raise ValueError('read_raw: channel out of range')
+        if self.conversionmode == 0:
+            config = config | (1 << 7)
+            self.bus.write_byte(address, config)
+            config = config & ~(1 << 7)
+        if self.bitrate == 18:
+            seconds_per_sample = 0.26666
+        elif self.bitrate == 16:
+            seconds_per_sample = 0.06666
+        elif self.bitrate == 14:
+            seconds_per_sample = 0.01666
+        elif self.bitrate == 12:
+            seconds_per_sample = 0.00416
+        timeout_time = self.clock.monotonic() + (10 * seconds_per_sample)
+        while True:
+            adcreading = self.bus.read_i2c_block_data(address, config, 4)
+            if self.bitrate == 18:
+                high = adcreading[0]
+                mid = adcreading[1]
+                low = adcreading[2]
+                cmdbyte = adcreading[3]
+            else:
+                high = adcreading[0]
+                mid = adcreading[1]
+                cmdbyte = adcreading[2]
+            if (cmdbyte & (1 << 7)) == 0:
+                break
+            elif self.clock.monotonic() > timeout_time:
+                raise TimeoutError('conversion timed out')
+        self.signbit = False
+        raw = 0
+        if self.bitrate == 18:
+            raw = ((high & 0x03) << 16) | (mid << 8) | low
+            self.signbit = bool(raw & (1 << 17))
+            raw = raw & ~(1 << 17)
+        elif self.bitrate == 16:
+            raw = (high << 8) | mid
+            self.signbit = bool(raw & (1 << 15))
+            raw = raw & ~(1 << 15)
+        elif self.bitrate == 14:
+            raw = ((high & 0b00111111) << 8) | mid
+            self.signbit = bool(raw & (1 << 13))
+            raw = raw & ~(1 << 13)
+        elif self.bitrate == 12:
+            raw = ((high & 0x0f) << 8) | mid
+            self.signbit = bool(raw & (1 << 11))
+            raw = raw & ~(1 << 11)
+        return raw
+
+
+def samplesPerSecond(func, samples, repeat=3):
+    # best of several runs to suppress scheduler noise
+    best = float('inf')
+    for r in range(repeat):
+        tStart = time.perf_counter()
+        for i in range(samples):
+            func()
+        best = min(best, time.perf_counter() - tStart)
+    return samples / best
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(samples=20000, rounds=25):
+    bus = cFakeSMBus()
+    lsbTable = {12: 0.0005, 14: 0.000125, 16: 0.00003125, 18: 0.0000078125}
+    print("Median of %i interleaved rounds of %i reads" % (rounds, samples))
+    print("Bitrate  Before [S/s]  After [S/s]  Speed-up  (min - max)")
+    for bitrate in (12, 14, 16, 18):
+        adc = ADCDifferentialPi(0x68, bitrate, bus=bus, clock=cFakeClock())
+        adc.set_pga(1)
+        legacy = cLegacyADC(bus, bitrate, 0.5, lsbTable[bitrate],
+                            clock=cFakeClock())
+        # both paths must decode to the same voltage
+        assert abs(adc.read_voltage(1) - legacy.read_voltage(1)) < 1e-12
+        # alternate the two paths so that clock frequency changes and other
+        # load affect both alike; a single pair of runs varies by +-20%
+        before = []
+        after = []
+        for r in range(rounds):
+            before.append(samplesPerSecond(lambda: legacy.read_voltage(1),
+                                           samples))
+            after.append(samplesPerSecond(lambda: adc.read_voltage(1),
+                                          samples))
+        ratios = [a / b for a, b in zip(after, before)]
+        print("%7i  %12.0f  %11.0f  %7.2fx  (%.2f - %.2f)" % (
+            bitrate, median(before), median(after), median(ratios),
+            min(ratios), max(ratios)))
+
+if __name__ == "__main__":
+    main()
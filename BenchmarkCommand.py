@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Round-trip latency of the remote command channel (mCommand.py) against a
+local instance. A cCommandServer runs on the loopback interface with a
+control loop thread that applies the pending commands at loopFrequency,
+as LoadControl.py does; a cCommandClient sends PING and SET commands and
+the round-trip times of the RECEIVED acknowledgement (network and receive
+thread only) and of the APPLIED acknowledgement (up to one control period
+more) are reported. The commands are sent one at a time at random points
+of the control period, so the queue of the server never overflows. A
+fraction of the datagrams can be dropped by the server to measure the
+cost of the retransmissions.
+
+Run using: python3 BenchmarkCommand.py [commands] [loss]
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import random
+import sys
+import threading
+import time
+
+from mCommand import cCommandServer, cCommandClient, PING, APPLIED
+from mScheduler import cLatencyHistogram
+
+
+class cLossyCommandServer(cCommandServer):
+    # drops a fraction of the received datagrams, as a lossy network would
+    def __init__(self, key, port, loss):
+        cCommandServer.__init__(self, key, port, host="127.0.0.1")
+        self.loss = loss
+        self.lost = 0
+        self.__handle = self._cCommandServer__handle
+        self._cCommandServer__handle = self.__lossy
+
+    def __lossy(self, datagram, address):
+        if random.random() < self.loss:
+            self.lost += 1
+            return
+        self.__handle(datagram, address)
+
+
+def controlLoop(server, frequency, running, setpoints):
+    # applies the pending commands once per control period
+    period = 1.0 / frequency
+    tNext = time.monotonic()
+    while running.is_set():
+        for command in server.pending():
+            if command.code != PING:
+                setpoints[command.parameter] = command.value
+            server.applied(command)
+        tNext += period
+        time.sleep(max(0.0, tNext - time.monotonic()))
+
+
+def printHistogram(name, histogram):
+    print("%-28s %6i %9.3f %9.3f %9.3f %9.3f" % (
+        name, histogram.count, histogram.percentile(50) / 1e3,
+        histogram.percentile(99) / 1e3, histogram.max / 1e3,
+        histogram.total / max(histogram.count, 1) / 1e3))
+
+
+def main(commands=1000, loss=0.0, loopFrequency=60, port=20102,
+         key="benchmark"):
+    server = cLossyCommandServer(key, port, loss)
+    server.start()
+    running = threading.Event()
+    running.set()
+    setpoints = {}
+    loop = threading.Thread(target=controlLoop,
+                            args=(server, loopFrequency, running, setpoints))
+    loop.daemon = True
+    loop.start()
+    client = cCommandClient(key, "127.0.0.1", port, timeout=0.05, retries=20)
+    print("%i commands, %.0f Hz control loop, %.1f%% datagram loss" %
+          (commands, loopFrequency, loss * 100))
+    results = []
+    try:
+        for waitApplied in (False, True):
+            received = cLatencyHistogram()
+            applied = cLatencyHistogram()
+            for i in range(commands):
+                if i % 2:
+                    ack = client.set("targetLoad", 50 + i % 20, waitApplied)
+                else:
+                    ack = client.send(PING, waitApplied=waitApplied)
+                received.record(ack.received * 1e6)
+                if waitApplied:  # otherwise only a late ack that raced in
+                    if ack.status != APPLIED:
+                        raise RuntimeError("command %i not applied" %
+                                           ack.sequence)
+                    applied.record(ack.applied * 1e6)
+                time.sleep(random.random() / loopFrequency)
+            results.append((waitApplied, received, applied))
+    finally:
+        running.clear()
+        loop.join()
+        client.close()
+        server.close()
+    print("%-28s %6s %9s %9s %9s %9s" % ("Round trip (ms)", "Count", "p50",
+                                         "p99", "max", "mean"))
+    for waitApplied, received, applied in results:
+        mode = "wait applied" if waitApplied else "received only"
+        printHistogram("RECEIVED, " + mode, received)
+        if waitApplied:
+            printHistogram("APPLIED, " + mode, applied)
+    print("Retransmissions: %i, datagrams dropped: %i, replays: %i, "
+          "rejected: %i, overflows: %i" % (
+              client.retransmissions, server.lost, server.replays,
+              server.rejected, server.overflows))
+    print("Control period: %.3f ms (APPLIED waits for the next tick: about "
+          "half of it on average)" % (1e3 / loopFrequency))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.0)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Benchmark of the load signal filters (mFilter.py). For every filter the
+cost per sample is measured for pure Python per-sample updates and for
+numpy batches of increasing size, as drained from the ADC ring buffer.
+The accuracy of the load gradient is compared on a synthetic 14 bit
+load ramp with noise: the original two-point difference over 2 seconds
+against the Savitzky-Golay derivative.
+
+Run using: python3 BenchmarkFilter.py
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import time
+
+import numpy
+
+from mFilter import cMovingAverage, cExponential, cMedian, cSavitzkyGolay, \
+    cFilterChain
+
+rate = 60.0                 # 14 bit sample rate (SPS)
+lsb = 0.000125 * 100        # 14 bit resolution in kg (100 kg/V)
+
+
+def makeFilters():
+    return [("Moving average (15)", cMovingAverage(15)),
+            ("Exponential (0.1)", cExponential(0.1)),
+            ("Median (5)", cMedian(5)),
+            ("Savitzky-Golay slope (31)", cSavitzkyGolay(31, 2, 1, 1 / rate)),
+            ("Median (5) + exponential", cFilterChain(cMedian(5),
+                                                      cExponential(0.1)))]
+
+
+def usPerSample(func, samples, repeat=5):
+    # best of several runs to suppress scheduler noise
+    best = float('inf')
+    for r in range(repeat):
+        tStart = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - tStart)
+    return best / samples * 1e6
+
+
+def synthetic(samples, seed=1):
+    # 10 kg/s load ramp with noise and spikes, quantised to 14 bit
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(samples) / rate
+    load = 10.0 * t + rng.normal(0.0, 0.05, samples)
+    load[rng.integers(0, samples, samples // 200)] += 20.0  # bus glitches
+    return t, numpy.round(load / lsb) * lsb
+
+
+def main(samples=8192):
+    t, load = synthetic(samples)
+    batches = (1, 16, 256, samples)
+    print("Cost per sample [us]")
+    print("%-26s %8s" % ("Filter", "update") +
+          "".join(["  batch %-5i" % n for n in batches]))
+    for name, f in makeFilters():
+        def perSample():
+            f.reset()
+            for x in load.tolist():
+                f.update(x)
+        costs = [usPerSample(perSample, samples)]
+        for n in batches:
+            def batch():
+                f.reset()
+                for i in range(0, samples, n):
+                    f.process(load[i:i + n])
+            costs.append(usPerSample(batch, samples))
+        print("%-26s %8.2f" % (name, costs[0]) +
+              "".join(["  %11.2f" % c for c in costs[1:]]))
+
+    # gradient accuracy against the true 10 kg/s
+    lag = int(2 * rate)
+    twoPoint = (load[lag:] - load[:-lag]) / 2.0
+    slope = cFilterChain(cMedian(5), cSavitzkyGolay(31, 2, 1, 1 / rate))
+    sg = slope.process(load)[lag:]
+    print("")
+    print("Load gradient error (true 10 kg/s)   RMS [kg/s]   Max [kg/s]")
+    for name, g in (("Two-point difference over 2 s", twoPoint),
+                    ("Median + Savitzky-Golay (0.5 s)", sg)):
+        error = g - 10.0
+        print("%-36s %10.3f   %10.3f" % (name, numpy.sqrt(numpy.mean(
+            error * error)), numpy.max(numpy.abs(error))))
+
+
+if __name__ == "__main__":
+    main()
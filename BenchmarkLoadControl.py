@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Benchmark of the load tracking of the cyclic load test on the simulated
+actuator/load cell (mSimulator.py). The original 2-second gain heuristic
+and the PID controller (mPID.py, without feed-forward) run the same test
+on a virtual clock, so an hour of testing takes seconds. For every loading
+stroke the rise time (10% to 90% of the target load) and the overshoot
+above the target are reported, along with the number of cycles per hour.
+
+Run using: python3 BenchmarkLoadControl.py
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+
+from mMCP3424 import ADCDifferentialPi
+from mMotorDriver import cMotorDriver as md
+from mLoadCycle import cLoadCycleController, LOADING, HOLD_MAX, HOLD_MIN
+from mPID import cPID
+from mScheduler import cLoopScheduler
+from mSimulator import cSimRig
+
+calibrationFactor = 100  # load cell calibration (kg/V)
+targetLoad = 70          # target load (kg)
+minimumLoad = 2          # minimum load (kg)
+holdTime = 10            # hold at either end (sec)
+startSpeed = 9           # PWM% at the start of a stroke
+
+
+def runTest(pid, duration=3600.0, loopFrequency=60):
+    """
+    run the cyclic test for duration (simulated) seconds; returns the list
+    of (rise time, overshoot %) per loading stroke and the cycles per hour
+    """
+    rig = cSimRig(speedup=None)  # virtual clock: runs as fast as possible
+    clock = rig.clock
+    adc = ADCDifferentialPi(0x68, 14, bus=rig.bus, clock=clock)
+    adc.set_pga(1)
+    motor = md(gpio=rig.gpio)
+    controller = cLoadCycleController(motor, targetLoad, minimumLoad,
+                                      holdTime, startSpeed, pid=pid)
+    scheduler = cLoopScheduler(loopFrequency, clock)
+    strokes = []
+    cycles = 0
+    state = None
+    tLow = tHigh = None
+    peak = 0.0
+    scheduler.start()
+    controller.start(clock.monotonic())
+    while clock.monotonic() < duration:
+        scheduler.wait()
+        try:
+            load = adc.read_voltage(1) * calibrationFactor
+        except (IOError, TimeoutError):
+            load = None
+        now = clock.monotonic()
+        newState = controller.step(now, load)
+        trueLoad = rig.plant.load()
+        if newState == LOADING and state != LOADING:
+            tLow = tHigh = None
+            peak = 0.0
+        if newState in (LOADING, HOLD_MAX):
+            if tLow is None and trueLoad >= 0.1 * targetLoad:
+                tLow = now
+            if tHigh is None and trueLoad >= 0.9 * targetLoad:
+                tHigh = now
+            peak = max(peak, trueLoad)
+        if state == HOLD_MAX and newState != HOLD_MAX and tLow is not None \
+                and tHigh is not None:
+            strokes.append((tHigh - tLow,
+                            max(0.0, peak - targetLoad) / targetLoad * 100))
+        if newState == HOLD_MIN and state != HOLD_MIN:
+            cycles += 1
+        state = newState
+    return strokes, cycles * 3600.0 / duration
+
+
+def report(name, strokes, cyclesPerHour):
+    rise = [r for r, o in strokes]
+    overshoot = [o for r, o in strokes]
+    print("%-22s %6.2f s  %6.2f s  %6.2f %%  %6.2f %%  %6.1f" % (
+        name, sum(rise) / len(rise), max(rise),
+        sum(overshoot) / len(overshoot), max(overshoot), cyclesPerHour))
+
+
+def main(duration=3600.0):
+    print("Simulated cyclic load test: %i kg target, %i s holds, %i s" %
+          (targetLoad, holdTime, duration))
+    print("%-22s %8s  %8s  %8s  %8s  %6s" % (
+        "Controller", "Rise", "Rise max", "Overshoot", "Ovs. max", "Cyc/h"))
+    report("Heuristic (2 s gain)", *runTest(None, duration))
+    pid = cPID(kp=1.5, ki=0.1, kd=0.05, outputMin=0.0, outputMax=40.0,
+               bias=startSpeed)
+    report("PID", *runTest(pid, duration))
+
+
+if __name__ == "__main__":
+    main()
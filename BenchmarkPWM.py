@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Micro-benchmark of the cost of cMotorDriver.setSpeed for each PWM backend.
+The sysfs backend (mPWM.cSysfsPWM) runs against a fake /sys/class/pwm tree
+in a temporary directory, so the benchmark runs on any computer; on the
+Raspberry Pi the real sysfs attributes are slightly more expensive to
+write than a regular file. An open/write/close per update is included as
+the reference for keeping the duty_cycle file open. RPi.GPIO software PWM
+is measured when RPi.GPIO is available, otherwise the simulated GPIO
+(mSimulator.cSimGPIO) shows the Python call overhead only.
+
+Run using: python3 BenchmarkPWM.py
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import os
+import shutil
+import tempfile
+import time
+
+from mMotorDriver import cMotorDriver as md
+from mPWM import cSysfsPWM
+from mSimulator import cSimGPIO
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+
+
+class cOpenPerWritePWM(cSysfsPWM):
+    # reference: opens, writes and closes duty_cycle on every update
+    def ChangeDutyCycle(self, dutyCycle):
+        with open(os.path.join(self.path, "duty_cycle"), "w") as f:
+            f.write(str(int(self.period * dutyCycle / 100)))
+        self.dutyCycle = dutyCycle
+
+
+def makeSysfsTree(root, chip=0, channel=0):
+    # pwmchipN with an exported pwmM channel, as created by the kernel
+    path = os.path.join(root, "pwmchip%i" % chip)
+    os.makedirs(os.path.join(path, "pwm%i" % channel))
+    for name, value in (("export", ""), ("unexport", ""), ("npwm", "2")):
+        with open(os.path.join(path, name), "w") as f:
+            f.write(value)
+    for name in ("period", "duty_cycle", "enable"):
+        with open(os.path.join(path, "pwm%i" % channel, name), "w") as f:
+            f.write("0")
+
+
+def callsPerSecond(func, calls, repeat=15):
+    # best of several runs to suppress scheduler noise; the duty cycle
+    # changes on every call so the driver never skips the write
+    best = float('inf')
+    for r in range(repeat):
+        tStart = time.perf_counter()
+        for i in range(calls):
+            func(i % 100)
+        best = min(best, time.perf_counter() - tStart)
+    return calls / best
+
+
+def main(calls=20000, frequency=20000):
+    root = tempfile.mkdtemp(prefix="fakesysfs")
+    try:
+        makeSysfsTree(root)
+        backends = []
+        if GPIO is not None:
+            backends.append(("RPi.GPIO software PWM", md()))
+        else:
+            backends.append(("Simulated software PWM", md(gpio=cSimGPIO())))
+        backends.append(("sysfs, open per write", md(
+            gpio=cSimGPIO(), pwm=cOpenPerWritePWM(root=root),
+            frequency=frequency)))
+        pwm = cSysfsPWM(root=root)
+        backends.append(("sysfs hardware PWM", md(
+            gpio=cSimGPIO(), pwm=pwm, frequency=frequency)))
+
+        print("Backend                  Carrier [Hz]  setSpeed [us]  "
+              "Calls/s")
+        for name, motor in backends:
+            rate = callsPerSecond(motor.setSpeed, calls)
+            print("%-23s  %12i  %13.2f  %7.0f" % (name, motor.frequency,
+                                                  1e6 / rate, rate))
+        # the duty cycle written to the fake tree matches the request
+        pwm.ChangeDutyCycle(25)
+        with open(os.path.join(pwm.path, "duty_cycle")) as f:
+            assert int(f.read()) == pwm.period // 4
+        with open(os.path.join(pwm.path, "period")) as f:
+            assert int(f.read()) == int(round(1e9 / frequency))
+    finally:
+        shutil.rmtree(root)
+        if GPIO is not None:
+            GPIO.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Loop jitter of the control loop with the recording, status display,
+telemetry and a live plot running as threads of the control process
+(competing for its GIL) and as separate processes fed through the shared
+memory ring buffer (mSharedRing.py), as LoadControl.py does with
+useProcesses. The control loop runs the load cycle on the simulated rig
+in real time, with the ADC sampled by its background thread; the same
+consumers run in both modes. The live plot stands in for the UI work:
+it sorts the last plotWindow loads for every batch of records, holding
+the GIL for the whole sort. The split only pays off with a spare core
+for the consumers (e.g. the 4 cores of a Raspberry Pi 3/4); on a single
+core the processes still share the CPU with the control loop.
+
+Run using: python3 BenchmarkProcesses.py [duration] [plotWindow]
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import os
+import sys
+import tempfile
+import threading
+
+from mADCStream import ADCStream
+from mCalibration import cCalibrationCurve, cChannelCalibration
+from mDashboard import cDashboard
+from mFilter import cMedian, cExponential, cFilterChain
+from mLoadCycle import cLoadCycleController
+from mMCP3424 import ADCDifferentialPi
+from mMotorDriver import cMotorDriver
+from mPID import cPID
+from mRecorder import cRecorder
+from mScheduler import cLoopScheduler
+from mSharedRing import cSharedRingBuffer, cConsumerProcess
+from mSimulator import cSimRig
+from mTelemetry import cTelemetryPublisher
+
+FIELDS = ("time", "raw", "load", "speed", "state")
+
+
+class cRecordHandler:
+    def __init__(self, path):
+        self.recorder = cRecorder(path)
+
+    def __call__(self, records):
+        for t, raw, load, speed, state in records:
+            self.recorder.append(t, int(raw), load, speed, 1, 0)
+
+    def close(self):
+        self.recorder.close()
+
+
+class cTelemetryHandler:
+    def __init__(self, port):
+        self.telemetry = cTelemetryPublisher("127.0.0.1", port)
+
+    def __call__(self, records):
+        for t, raw, load, speed, state in records:
+            self.telemetry.publish(t, load, speed, int(state))
+        self.telemetry.flush()
+
+    def close(self):
+        self.telemetry.close()
+
+
+class cDisplayHandler:
+    def __init__(self):
+        self.out = open(os.devnull, "w")
+        self.dashboard = cDashboard("Benchmark", [
+            ("Time", "time", "%.1f sec"), ("Load", "load", "%.3f kg"),
+            ("Speed", "speed", "%.1f %%")], rate=20, out=self.out)
+        self.dashboard.start()
+
+    def __call__(self, records):
+        t, raw, load, speed, state = records[-1]
+        self.dashboard.update(time=t, load=load, speed=speed)
+
+    def close(self):
+        self.dashboard.stop()
+        self.out.close()
+
+
+class cPlotHandler:
+    # stand-in for a live plot of the last window loads (a full window
+    # from the start), redrawn for every batch
+    def __init__(self, window):
+        self.history = collections.deque([0.0] * window, maxlen=window)
+
+    def __call__(self, records):
+        self.history.extend(record[2] for record in records)
+        ordered = sorted(self.history)
+        self.summary = (ordered[0], ordered[len(ordered) // 2], ordered[-1],
+                        sum(ordered) / len(ordered))
+
+
+class cConsumerThread:
+    # a consumer as a thread of the control process, fed through a deque
+    def __init__(self, factory, args=(), interval=0.02):
+        self.queue = collections.deque(maxlen=4096)
+        self.push = self.queue.append
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run,
+                                       args=(factory, args, interval))
+        self.thread.daemon = True
+
+    def __run(self, factory, args, interval):
+        handler = factory(*args)
+        queue = self.queue
+        while True:
+            stopping = self.stopped.is_set()
+            batch = []
+            while queue:
+                batch.append(queue.popleft())
+            if batch:
+                handler(batch)
+            elif stopping:
+                break
+            else:
+                self.stopped.wait(interval)
+        if hasattr(handler, "close"):
+            handler.close()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def runLoop(split, duration, plotWindow, frequency, root):
+    rig = cSimRig(speedup=1.0)  # real time
+    clock = rig.clock
+    consumers = [(cRecordHandler, (os.path.join(root, "split%i.rec" % split),)),
+                 (cTelemetryHandler, (20199,)),
+                 (cDisplayHandler, ()),
+                 (cPlotHandler, (plotWindow,))]
+    ring = None
+    if split:
+        ring = cSharedRingBuffer(FIELDS, 4096)
+        workers = [cConsumerProcess(ring, factory, args)
+                   for factory, args in consumers]
+        publish = ring.push
+    else:
+        workers = [cConsumerThread(factory, args)
+                   for factory, args in consumers]
+        pushes = [worker.push for worker in workers]
+
+        def publish(record):
+            for push in pushes:
+                push(record)
+    for worker in workers:  # processes start before the threads below
+        worker.start()
+
+    adc = ADCDifferentialPi(0x68, 14, bus=rig.bus, clock=clock)
+    adc.set_pga(1)
+    calibration = cChannelCalibration(cCalibrationCurve.linear(100),
+                                      adc.get_output_profile())
+    loadFilter = cFilterChain(cMedian(5), cExponential(0.3))
+    stream = ADCStream(adc, 1, counts=True)
+    motor = cMotorDriver(gpio=rig.gpio)
+    controller = cLoadCycleController(motor, 70, pid=cPID(
+        1.5, 0.1, 0.05, outputMin=0, outputMax=40, bias=9))
+    scheduler = cLoopScheduler(frequency, clock)
+    stream.start()
+    tStart = clock.monotonic()
+    scheduler.start()
+    controller.start(clock.time())
+    load = None
+    try:
+        while clock.monotonic() - tStart < duration:
+            scheduler.wait()
+            now = clock.time()
+            times, counts = stream.drain_arrays()
+            for count in counts:
+                load = loadFilter.update(calibration.convert(count))
+            state = controller.step(now, load if counts else None)
+            if counts:
+                publish((now, counts[-1], controller.load,
+                         controller.currentSpeed if motor.enabled else 0,
+                         state))
+    finally:
+        motor.setEnable(enabled=0)
+        stream.stop()
+        for worker in workers:
+            worker.stop()
+        if ring is not None:
+            ring.close()
+    return scheduler.stats()
+
+
+def main(duration=20.0, plotWindow=20000, frequency=60):
+    root = tempfile.mkdtemp(prefix="fbpbench")
+    print("%.0f s per mode, %i Hz control loop, live plot of %i samples, "
+          "%i CPU cores" % (duration, frequency, plotWindow, os.cpu_count()))
+    results = []
+    try:
+        for split in (False, True):
+            results.append((split, runLoop(split, duration, plotWindow,
+                                           frequency, root)))
+    finally:
+        for name in os.listdir(root):
+            os.remove(os.path.join(root, name))
+        os.rmdir(root)
+    print("%-24s %7s %5s  %-23s %-23s" % (
+        "Consumers", "Ticks", "Over", "Latency p50/p99/max ms",
+        "Work p50/p99/max ms"))
+    for split, s in results:
+        print("%-24s %7i %5i  %6.2f/%6.2f/%8.2f  %6.2f/%6.2f/%8.2f" % (
+            "processes (shared ring)" if split else "threads (one process)",
+            s.iterations, s.overruns, s.latency_p50 * 1e3,
+            s.latency_p99 * 1e3, s.latency_max * 1e3, s.work_p50 * 1e3,
+            s.work_p99 * 1e3, s.work_max * 1e3))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 20.0,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Reaction latency of the load limit watchdog (mWatchdog.py) against the
+load check of a 60 Hz control loop (filtered load compared with the
+limit), on the simulated rig in real time. In the overload trials the
+actuator is driven into the load cell at a constant speed until the
+protection disables the driver; the reaction latency runs from the sample
+that triggered the cut (for the control loop the first raw sample at or
+above the limit, so the lag of its load filter is included) until the
+driver is disabled and the peak is the highest load reached once the
+actuator has coasted to rest. In the dead bus trials every I2C
+transaction fails while the actuator moves; the latency runs from the
+sample timeout until the cut. Every trial runs with the CPU idle and with
+a thread competing for the GIL (standing in for the recording and display
+work).
+
+Run using: python3 BenchmarkWatchdog.py [trials]
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import sys
+import threading
+
+from mADCStream import ADCStream
+from mCalibration import cCalibrationCurve, cChannelCalibration
+from mFilter import cMedian, cExponential, cFilterChain
+from mMCP3424 import ADCDifferentialPi
+from mMotorDriver import cMotorDriver
+from mScheduler import cLoopScheduler
+from mSimulator import cSimRig
+from mWatchdog import cLoadWatchdog
+
+LIMIT = 50.0        # hard load limit (kg)
+SPEED = 30          # PWM% of the overload trials (about 27 kg/s)
+TIMEOUT = 0.3       # sample timeout (sec)
+
+
+def busy(stopped):
+    # pure Python work competing for the GIL
+    while not stopped.is_set():
+        sum(range(10000))
+
+
+def loopGuard(stream, convert, motor, clock, frequency=60, limit=10.0):
+    # the load and stale checks of a control loop; returns the reaction (sec)
+    scheduler = cLoopScheduler(frequency, clock)
+    loadFilter = cFilterChain(cMedian(5), cExponential(0.3))
+    tEnd = clock.monotonic() + limit
+    tOver = None  # time of the first raw sample at or above LIMIT
+    scheduler.start()
+    while clock.monotonic() < tEnd:
+        scheduler.wait()
+        times, counts = stream.drain_arrays()
+        for t, count in zip(times, counts):
+            load = convert(count)
+            if tOver is None and load >= LIMIT:
+                tOver = t  # the filtered load crosses the limit later
+            if loadFilter.update(load) >= LIMIT:
+                motor.setEnable(0)
+                return clock.monotonic() - tOver
+        if not stream.is_valid(TIMEOUT):
+            motor.setEnable(0)
+            return clock.monotonic() - (stream.latest()[1] + TIMEOUT)
+    return None
+
+
+def runTrial(protection, scenario, loaded):
+    rig = cSimRig(speedup=1.0)  # real time
+    clock = rig.clock
+    plant = rig.plant
+    adc = ADCDifferentialPi(0x68, 14, bus=rig.bus, clock=clock)
+    adc.set_pga(1)
+    adc.set_retry_policy(0)
+    calibration = cChannelCalibration(cCalibrationCurve.linear(100),
+                                      adc.get_output_profile())
+    zero = plant.zeroVoltage * plant.calibrationFactor
+    convert = lambda count: calibration.lookup(count) - zero
+    stream = ADCStream(adc, 1, counts=True)
+    motor = cMotorDriver(gpio=rig.gpio)
+    stopped = threading.Event()
+    worker = threading.Thread(target=busy, args=(stopped,))
+    worker.daemon = True
+    if scenario == "overload":
+        plant.position = plant.contact - 0.5  # just before contact
+    stream.start()
+    clock.sleep(0.2)
+    if loaded:
+        worker.start()
+    motor.apply(1, SPEED if scenario == "overload" else 10, 1)
+    if scenario == "dead bus":
+        clock.sleep(0.5)
+        rig.bus.errorRate = 1.0
+    try:
+        if protection is None:
+            reaction = loopGuard(stream, convert, motor, clock)
+        else:
+            watchdog = cLoadWatchdog(motor, stream.latest, convert, LIMIT,
+                                     protection, sampleTimeout=TIMEOUT,
+                                     clock=clock)
+            watchdog.start()
+            tEnd = clock.monotonic() + 10.0
+            while watchdog.tripped is None and clock.monotonic() < tEnd:
+                clock.sleep(0.01)
+            watchdog.stop()
+            reaction = watchdog.reaction
+        clock.sleep(0.5)  # coast to rest
+        peak = plant.load()
+    finally:
+        motor.setEnable(0)
+        stopped.set()
+        stream.stop()
+    return reaction, peak
+
+
+def main(trials=5):
+    print("Limit %g kg, %i%% PWM into the load cell (overload) and failing "
+          "I2C reads (dead bus), sample timeout %g s, %i trials"
+          % (LIMIT, SPEED, TIMEOUT, trials))
+    print("%-28s %-9s %-5s  %-22s %s" % (
+        "Protection", "Scenario", "GIL", "Reaction p50/max ms",
+        "Peak load max kg"))
+    protections = [("control loop check (60 Hz)", None),
+                   ("watchdog, no extrapolation", 0.0),
+                   ("watchdog, 0.2 s horizon", 0.2)]
+    for scenario in ("overload", "dead bus"):
+        for name, protection in protections:
+            if scenario == "dead bus" and protection == 0.0:
+                continue  # the horizon plays no part without samples
+            for loaded in (False, True):
+                results = [runTrial(protection, scenario, loaded)
+                           for trial in range(trials)]
+                reactions = sorted(r for r, peak in results if r is not None)
+                if not reactions:
+                    print("%-28s %-9s %-5s  no trip" % (
+                        name, scenario, "busy" if loaded else "idle"))
+                    continue
+                print("%-28s %-9s %-5s  %8.2f / %8.2f      %s" % (
+                    name, scenario, "busy" if loaded else "idle",
+                    reactions[len(reactions) // 2] * 1e3,
+                    reactions[-1] * 1e3,
+                    "%.2f" % max(peak for r, peak in results)
+                    if scenario == "overload" else "-"))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
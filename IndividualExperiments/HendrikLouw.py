@@ -2,74 +2,10 @@
 # -*- coding: utf-8 -*-
 #
 #  motorTest.py jvv
+#  The test is defined in HendrikLouw.json and run by TimeControl.py (see mProfile.py)
 
-from mMotorDriver import cMotorDriver as md
-from time import sleep
-import Adafruit_ADS1x15 as Ada
-from mTCA9548A import cTCA9548A
-
-print("starting")
-motor = md()  # Pins should be 27=DIR, 18=PWM, 22=SLP
-motor.setEnable(enabled=1)
-
-motor.setSpeed(8)
-
-#motor.setBackward()
-#sleep(1)
-
-for cycle in range(30000):
-    motor.setForward()
-    print("Forward")
-    sleep(4)
-    print("Cycle no " + str(cycle + 1))
-    motor.setBackward()
-    print("Backward")
-    sleep(3.75)
-    #motor.setBackward() # Retract pile
-    #print("Retract")
-    #sleep(5)  # For 30 seconds extend the actuator
-
-
-print("End of test")
-#sleep(1800)
-motor.setEnable(enabled=0)
-exit()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-"""
-for i in range(0):
-    motor.setBackward()
-    print("Backward")
-    sleep(5)
-    motor.setForward()
-    print("Forward")
-    sleep(5)
-
-motor.setBackward()
-for i in range(100):
-    motor.setSpeed(speed=i)
-    sleep(0.1)
-    print(i)
-sleep(1)
-motor.toggleDirection()
-for i in range(100,50,-1):
-    motor.setSpeed(speed=i)
-    sleep(0.1)
-    print(i)
-sleep(2)
-""" 
+import os
+from TimeControl import main
 
+main(os.path.join(os.path.dirname(os.path.abspath(__file__)), "HendrikLouw.json"))
 print("Finshed script")
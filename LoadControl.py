@@ -3,34 +3,132 @@
 
 """
 Fly-by-Pi Controller
-	
+
 Demonstration on the use of the load control functionality.
 The load is obtained by the centrifuge's DAQ system, sent
-through the MCP3424 ADC. The feedback frequency is approximately
-63 Hz using this method, yielding an update rate of 15 ms.
+through the MCP3424 ADC. The filtered load drives a fixed-rate load
+cycle (mLoadCycle.py) or a test profile (mProfile.py), while a watchdog
+thread (mWatchdog.py) enforces the hard loadLimit. See the user
+variables below for the asyncio, multiprocess and remote command modes.
 
-Run using: sudo python3 LoadControl.py
+Run using: sudo python3 LoadControl.py [profile.json]
+Simulate using: python3 LoadControl.py [profile.json] --sim  (10x real time)
 Modified by Andre Broekman 2020/05/13
 Open Source License: Creative Commons Attribution-ShareAlike
 """
 
 from __future__ import absolute_import, division, print_function, \
                                                     unicode_literals
-import time, os
+import time, sys, signal, math, collections, multiprocessing, functools
 from mMotorDriver import cMotorDriver as md
+from mPWM import cSysfsPWM
+from mRecorder import cRecorder
+from mDashboard import cDashboard
+from mScheduler import cLoopScheduler
+from mLoadCycle import cLoadCycleController, STATE_NAMES
+from mPID import cPID
+from mRamp import cRampGenerator
+from mProfile import loadProfile, cProfileRunner, OP_NAMES
+from mFilter import cMedian, cExponential, cSavitzkyGolay, cFilterChain
+from mTelemetry import cTelemetryPublisher
+from mRuntime import cRuntime
+from mSharedRing import cSharedRingBuffer, cConsumerProcess
+from mCommand import cCommandServer
+from mControlTasks import LoadLoop, cAsyncStream, addTasks, applyCommands, emergencyStop
+from mWatchdog import cLoadWatchdog
+from mCalibration import cCalibrationCurve, cChannelCalibration, loadCalibration
 
 try:
     from mMCP3424 import ADCDifferentialPi
+    from mADCStream import ADCStream
 except ImportError:
     print("Failed to import ADCDifferentialPi from python system path")
 
+# Status display of the control loop
+DASHBOARD_FIELDS = [
+    ("Time", "time", "%.1f sec"),
+    ("Feedback frequency", "frequency", "%i Hz"),
+    ("Total readings", "reads", "%i"),
+    ("Cyclic count", "cycle", "%i"),
+    ("Failed readings (%)", "failed", "%.1f"),
+    ("Bus errors/timeouts/implausible", "errors", "%i / %i / %i"),
+    ("Control state", "state", "%s"),
+    ("Load cell [kg]", "load", "%.3f"),
+    ("Current motor speed [%]", "speed", "%.1f"),
+    ("Motor status", "status", "%s"),
+    ("Load gradient [kg/s]", "gradient", "%.3f"),
+    ("Loop latency p50/p99/max", "latency", "%.2f / %.2f / %.2f ms"),
+    ("Loop work p50/p99/max", "work", "%.2f / %.2f / %.2f ms"),
+    ("Loop overruns", "overruns", "%i")]
+
+# Control cycle record passed to the consumer processes (useProcesses); loop timing in ms, NaN before the first second
+RECORD_FIELDS = ("time", "raw", "load", "speed", "direction", "cycle", "fail", "state", "elapsed", "reads",
+                 "conversions", "failures", "busErrors", "timeouts", "implausible", "gradient",
+                 "latencyP50", "latencyP99", "latencyMax", "workP50", "workP99", "workMax", "overruns")
+
+
+class cRecordWriter:  # recording process: every control cycle to the recording file
+    def __init__(self, path):
+        self.recorder = cRecorder(path)
+
+    def __call__(self, records):
+        for r in records:
+            self.recorder.append(r.time, int(r.raw), r.load, r.speed, int(r.direction), int(r.cycle), int(r.fail))
+
+    def close(self):
+        self.recorder.close()
+
+
+class cTelemetryForwarder:  # telemetry process: every control cycle to the control room
+    def __init__(self, host, port):
+        self.telemetry = cTelemetryPublisher(host, port)
+
+    def __call__(self, records):
+        for r in records:
+            self.telemetry.publish(r.time, r.load, r.speed, int(r.state))
+        self.telemetry.flush()
+
+    def close(self):
+        self.telemetry.close()
+
 
-def main(): # Start of the main program
+class cDashboardView:  # display process: the newest control cycle and the messages of the control process
+    def __init__(self, stateNames, events):
+        self.stateNames = stateNames
+        self.events = events
+        self.dashboard = cDashboard("Fly-by-Pi Load Control", DASHBOARD_FIELDS, rate=5)
+        self.status = ""
+        self.dashboard.start()
+
+    def __call__(self, records):
+        while not self.events.empty():
+            self.status = self.events.get()
+            self.dashboard.log(self.status)
+        r = records[-1]
+        timing = not math.isnan(r.latencyP50)
+        self.dashboard.update(time=r.elapsed, frequency=r.reads / r.elapsed, reads=r.reads, cycle=int(r.cycle),
+                              failed=(r.failures / max(r.failures + r.conversions, 1)) * 100,
+                              errors=(r.busErrors, r.timeouts, r.implausible),
+                              state=self.stateNames[int(r.state)], load=r.load, speed=r.speed, status=self.status,
+                              gradient=r.gradient,
+                              latency=timing and (r.latencyP50, r.latencyP99, r.latencyMax) or None,
+                              work=timing and (r.workP50, r.workP99, r.workMax) or None,
+                              overruns=r.overruns if timing else None)
+
+    def close(self):
+        self.dashboard.stop()
+
+
+def main(bus=None, gpio=None, clock=time, duration=None, profileFile=None): # Start of the main program
+    # bus/gpio/clock select the hardware backends (default: the Raspberry Pi)
+    # duration limits the run time (sec) of the main control loop
+    # profileFile runs a test profile (mProfile.py) instead of the built-in load cycle
     print("Fly-by-Pi Load Control Demonstration")
-	time.sleep(1)
-	print("Setting system variables")
+    clock.sleep(1)
+    print("Setting system variables")
     ###### USER VARIABLES ######
     calibrationFactor = 100 # calibration factor (kg/V)
+    calibrationFile = None  # multipoint calibration file of channel 1 (mCalibration.py); None uses calibrationFactor
     targetLoad  = 70 # target load (kg); THE LOAD IS ZEROED AT THE START OF THE SCRIPT
     minimumLoad = 2  # load (kg) where the motor should reverse directions / accepted as the contact load
     holdTime    = 10 # number of seconds that the motor is turned off when either targetLoad or minimumLoad is reached
@@ -39,151 +137,243 @@ def main(): # Start of the main program
     # For 50kg set starting speed at 7%
     # For 60kg set starting speed at 9%
     # For 70kg set starting speed at 10%
+    recordFile  = "LoadControl_%Y%m%d_%H%M%S.rec" # every control cycle is recorded to this file (see mRecorder.py)
+    adcBitRate    = 14  # ADC resolution per conversion: 12 (240 SPS), 14 (60 SPS), 16 (15 SPS) or 18 (3.75 SPS)
+    oversampling  = (1, "average")  # (ratio, "average" or "cic") decimation in the driver
+                                    # e.g. 12 bit with (4, "average") gives 60 SPS at 13 bit
+    loopFrequency = 60  # control loop rate (Hz); matches the ADC output rate (60 SPS at 14 bit)
+    loopPriority  = None  # SCHED_FIFO real-time priority (1-99, requires sudo) or None
+    loopCpu       = None  # CPU core to pin the control loop to or None
+    usePID        = True  # PID/feed-forward loading stroke (mPID.py); False uses the original 2 s gain steps
+    pidGains      = (1.5, 0.1, 0.05)  # kp (%/kg), ki (%/kg/s), kd (%.s/kg)
+    maxSpeed      = 40    # upper PWM% limit of the PID output
+    pwmHardware   = False # True drives GPIO18 from the hardware PWM channel (mPWM.py, requires dtoverlay=pwm)
+    pwmFrequency  = 300   # PWM carrier frequency (Hz); e.g. 20000 with the hardware PWM
+    rampAcceleration = 50 # PWM slew rate limit (%/s, mRamp.py) to avoid current/load spikes; None for instant changes
+    medianWindow  = 5     # median filter length (samples) that rejects load spikes (mFilter.py); 1 disables it
+    smoothing     = 0.3   # exponential smoothing factor of the load (0-1]; 1 disables it
+    gradientWindow = 31   # Savitzky-Golay window (samples) of the load gradient
+    plausibleVoltage = (-0.1, 2.0)  # ADC readings outside this range (V) or clipped are rejected as implausible
+    readRetries   = 2     # retries of a failed I2C transaction or conversion timeout, with exponential backoff
+    staleTimeout  = 0.5   # stop the test if no valid reading arrives for this long (sec)
+    telemetryHost = None  # control room computer receiving live data over UDP (mTelemetry.py) or None
+    telemetryPort = 20001 # UDP port of the telemetry receiver (UDPdemo/UDPserver.py)
+    commandKey    = None  # shared secret enabling remote commands over UDP (mCommand.py, UDPdemo/UDPcommand.py) or None
+    commandPort   = 20002 # UDP port of the command server
+    useAsyncio    = False # run acquisition, control, telemetry and logging as asyncio tasks (mControlTasks.py)
+    useProcesses  = False # run recording, display and telemetry in their own processes (mSharedRing.py)
+    loadLimit     = 90    # hard load limit (kg, zeroed like targetLoad); keep it above targetLoad and the profile loads
+    limitHorizon  = 0.2   # the watchdog stops the motor if the load this far ahead (sec) would reach loadLimit
+    watchdogTimeout = 0.3 # the watchdog stops the motor if no sample arrives or the loop stalls this long (sec)
+    watchdogRate  = 200   # watchdog polling rate (Hz); it runs at loopPriority + 1 when loopPriority is set
 
     ###### SYSTEM VARIABLES ##### DO NOT MODIFY
+    if useAsyncio and useProcesses:
+        raise ValueError("useAsyncio and useProcesses cannot be combined")
     cRead = 0 # ADC read counter
     cFail = 0 # ADC read fail counter
-	zeroLoad = 0 # The zero/bias load that is subtracted from the reading
-    cycleCount = 1 # load cycle counter
-    tStart = time.time() # script start time
-	direction = 1 # starting direction should be to push forward; 1=forward and 0=backward
+    tStart = clock.time() # script start time
     readingLoad = 0 # current load on the load cell (kg); init variable
-    currentSpeed = startSpeed # Set the current speed (that can be altered by the gain function) equal to user set start speed
-	### Gain control variables
-    tPrior = time.time() # prior time
-    bReadPrior = True    # sets the flag when we need to update the prior loading variables
-    loadPrior = 0 # the previous load from some time in the past
+    loopStats = None   # loop timing statistics
     ### MCP3424 ADC
     print("Creating ADC instance...")
-    adc = ADCDifferentialPi(0x68, 12) # Initialzie the ADC object
+    adc = ADCDifferentialPi(0x68, 12, bus=bus, clock=clock) # Initialzie the ADC object
     adc.set_pga(1)  # PGA gain selection: 1 = 1x +-2.048V
-    adc.set_bit_rate(14)  # Set the bit-rate: 14 bit (60SPS max)
+    adc.set_bit_rate(adcBitRate)  # Set the bit-rate: 14 bit (60SPS max)
+    adc.set_oversampling(*oversampling)  # decimate several fast conversions into one sample
+    decimation = adc.get_oversampling()
+    print("ADC: %.1f effective bits at %.1f SPS" % (decimation.effective_bits, decimation.output_rate))
+    adc.set_plausible_range(*plausibleVoltage)  # raise ImplausibleValue for clipped/out of range readings
+    adc.set_retry_policy(readRetries)  # retry bus errors and timeouts inside the driver
+    # Raw count to kg lookup table; kill -USR1 <pid> re-zeroes the load cell in flight (actuator unloaded)
+    if calibrationFile is None:
+        calibration = cChannelCalibration(cCalibrationCurve.linear(calibrationFactor), adc.get_output_profile())
+    else:
+        calibration = loadCalibration(calibrationFile, adc.get_output_profile())[1]
+    stream = ADCStream(adc, 1, counts=True)  # background acquisition of channel 1 (raw counts)
+    # Filtering stage between the ADC stream and the controller, applied to every sample
+    loadFilter = cFilterChain(cMedian(medianWindow), cExponential(smoothing))
+    gradient = cSavitzkyGolay(gradientWindow, order=2, derivative=1,
+                              dt=adc.get_output_profile().seconds_per_sample)  # load rate (kg/s)
     # Motor controller
     print("Create motor controller instance...")
-    motor = md()  # Pins should be 27=DIR, 18=PWM, 22=SLP
-
-	print("Initiating control sequence")
-    print("Retract the motor")
-    motor.setBackward()
-    motor.setSpeed(startSpeed)
-    motor.setEnable(enabled=1)
-    time.sleep(0.5)
-    for i in range(4):
-        print("Retracting" + ".."*(i+1))
-        time.sleep(1)
-    motor.setSpeed(startSpeed)
-    motor.setEnable(enabled=0)
-    time.sleep(1)
-
-    # Calculate the zero/bias load; subtract from all readings
-    print("Calculate the zero load on the load cell")
-    cRead = 0
-    zeroLoad = 0
-    for kk in range(100): # take the average of 100 readings
-        try:
-            time.sleep(0.010)
-            reading = adc.read_voltage(1)
-            readingLoad = reading * calibrationFactor
-            cRead += 1
-            zeroLoad += readingLoad 
-        except:
-            time.sleep(0.005)
-            cFail += 1
-    zeroLoad /= cRead # True zero load as measured in-flight
-    print("Zero load = " + str(round(zeroLoad,3)) + " [kg]")
-    
-	print("Enter main control loop for load control")
-    time.sleep(1)
-    readingLoad = 0  # reset the reading
-	
-    while True: # start the main loop that continues indefinitely
-		# First record a new, calibrated reading and then execute/apply the logic control
-        cRead += 1  # take a new reading
-        # try reading read from adc channels and print data to screen periodically
-        try:
-            time.sleep(0.001) # Bus stabilization
-            reading = adc.read_voltage(1) # read channel 1's Voltage
-            readingLoad = reading * calibrationFactor - zeroLoad # Zeroed, calibrated reading in kg
-            time.sleep(0.001) # Bus stabilization
-            if bReadPrior: # If we need to update the gain variables
-                loadPrior = readingLoad
-                bReadPrior = False
-        except:
-            cFail += 1
-            time.sleep(0.005)  # sleep 10 ms in event of bus error
-
-        # Logic control
-        statusMotor = "404"
-        if ((direction == 1) and (readingLoad < targetLoad)):
-            motor.setForward()
-            motor.setEnable(enabled=1)
-            statusMotor = "Go forward. Target load (max) not reached"
-            # Update the gain in power is the threshold is exceeded
-            if ((tPrior + 2) < time.time()): # check if we need to add power every 2 seconds
-                tPrior = time.time() # update time flag
-                # Only allow gain if:
- 				#   the gradient is small
-				#   actuator contact is established
-				#   current load is far enough away from the target load
-                if  (((readingLoad - loadPrior) < 1) and (readingLoad > minimumLoad) and (readingLoad < targetLoad - 5)):
-                    if readingLoad < 50:  # smaller than 50 kg
-                        currentSpeed += 1
-                        statusMotor += "; 1% GAIN added"
-                    else:  # larger than 50 kg; require greater increments
-                        currentSpeed += 2
-                        statusMotor += "; 2% GAIN added"
-                    motor.setSpeed(currentSpeed)
-                    bReadPrior = True  # update the prior load variable during next read cycle
-                else:
-                    print("Cannot add power gain right now")
-        elif ((direction == 1) and (readingLoad > targetLoad)): # reached the target load
-            motor.setEnable(enabled=0) # stop the motor
-            time.sleep(0.010)
-            print("Stop going forward. Target load (max) reached")
-            print("Motor speed % = " + str(currentSpeed))
-            time.sleep(holdTime)  # wait for a certain period of time
-            statusMotor = "Set motor backward"
-            print(statusMotor)
-            direction = 0  # set working direction to retract the actuator
-            motor.setBackward()  # set the motor direction to retract/reverse
-            motor.setSpeed(startSpeed)  # set the retract speed the same as the start speed
-            currentSpeed = startSpeed
-            motor.setEnable(enabled=1) # Enable power to the motor
-        elif ((direction == 0) and (readingLoad > minimumLoad)): # continue retracting the motor
-            motorStatus = "Go backward. Target load (min) not reached"
-            motor.setEnable(enabled=1)
-            motor.setBackward()
-        elif ((direction == 0) and (readingLoad <= minimumLoad)):  # reached minimum of the unload curve
-            motor.setEnable(enabled=0) # Turn off the motor
-            print("Stop going backward. Target load (min) reached")
-            time.sleep(holdTime)  # wait a certain period of time
-            statusMotor = "Set motor forward"
-            print(statusMotor)
-			# Reset the neccesary control variables for the next load curve
-            direction = 1 # set the actuator direction to go forward
-            motor.setSpeed(startSpeed) # reset the speed of the motor controller
-            currentSpeed = startSpeed  # reset the variable that controls the current motor speed
-            loadPrior = readingLoad    # set the loadPrior to the latest load reading
-            tPrior = time.time() + 2   # ensures that the gain will not take place for another few seconds
-            motor.setForward()         # set the motor direction to go forward
-            motor.setEnable(enabled=1) # enable power for the motor
-            cycleCount += 1 # number of load cycles the program has run
-        else:
-            print("Warning! Invalid control logic!")
-
-
-        if ((cRead % 10) == 0): # Only print new data to screen periodically
-            os.system('clear')  # clear the console
-            print("Time                    : " + str(round(time.time() - tStart, 1)) + " sec")
-            print("Feedback frequency      : " + str(int(1/((time.time() - tStart) / cRead))) + " Hz")
-            print("Total readings          : " + str(cRead))
-            print("Cyclic count            : " + str(cycleCount))
-            print("Failed readings (%)     : " + str(round(((cFail/cRead)*100),1)))
-            print("Load cell [kg]          : " + str(round(readingLoad,3)))
-            print("Current motor speed [%] : " + str(currentSpeed))
-            print("Motor status            : " + statusMotor)
-            print("Load gradient [kg/s]    : " + str(round((readingLoad - loadPrior)/2, 3)))
+    # Pins should be 27=DIR, 18=PWM, 22=SLP
+    motor = md(gpio=gpio, pwm=cSysfsPWM() if pwmHardware else None, frequency=pwmFrequency)
+    # Recording, status display and loop timing
+    recordPath = time.strftime(recordFile, time.localtime(clock.time()))
+    print("Recording to " + recordPath)
+    if useProcesses:  # recording, display and telemetry are fed from a shared memory ring buffer
+        ring = cSharedRingBuffer(RECORD_FIELDS, 4096)
+        events = multiprocessing.Queue()  # messages for the display process
+        messages = collections.deque()  # passed on by the control loop; safe to append in the signal handler
+        notify = messages.append
+    else:
+        ring = None
+        recorder = cRecorder(recordPath)
+        # Live data and status display, sent and redrawn by their own threads
+        telemetry = cTelemetryPublisher(telemetryHost, telemetryPort, clock=clock) if telemetryHost else None
+        dashboard = cDashboard("Fly-by-Pi Load Control", DASHBOARD_FIELDS, rate=5)
+        notify = dashboard.log
+    scheduler = cLoopScheduler(loopFrequency, clock, loopPriority, loopCpu)  # fixed-rate control period
+    # Cyclic load controller: retract, zero the load cell, then load/hold/unload/hold
+    pid = cPID(*pidGains, outputMin=0, outputMax=maxSpeed, bias=startSpeed) if usePID else None
+    ramp = cRampGenerator(motor, rampAcceleration, clock=clock) if rampAcceleration else None
+    if profileFile is None:
+        controller = cLoadCycleController(motor, targetLoad, minimumLoad, holdTime, startSpeed,
+                                          onEvent=notify, pid=pid, ramp=ramp)
+    else:  # the profile's precompiled step table drives the motor instead
+        table = loadProfile(profileFile)
+        if table.needsDisplacement:
+            raise ValueError(profileFile + " needs displacement feedback, which this rig does not measure")
+        print("Profile: " + table.name)
+        pid = pid or cPID(*pidGains, outputMin=0, outputMax=maxSpeed, bias=startSpeed)  # for "pid" load segments
+        controller = cProfileRunner(table, motor, pid=pid, ramp=ramp, onEvent=notify)
+    if useAsyncio:  # acquisition, control, telemetry and logging run as concurrent tasks (mControlTasks.py)
+        runtime = cRuntime(clock)
+        source = cAsyncStream(runtime, adc, 1)  # ADC counts; when full the acquisition waits (backpressure)
+    else:
+        source = stream
+    # Load limit watchdog: checks every sample in its own thread, whatever the control loop is doing
+    watchdog = cLoadWatchdog(motor, source.latest,
+                             lambda count: calibration.lookup(count) - controller.zeroLoad, loadLimit, limitHorizon,
+                             sampleTimeout=watchdogTimeout, loopTimeout=watchdogTimeout, rate=watchdogRate, ramp=ramp,
+                             priority=min(loopPriority + 1, 99) if loopPriority else None, cpu=loopCpu, clock=clock)
+    if ring is not None:  # start the consumers before any thread of this process
+        stateNames = STATE_NAMES if profileFile is None else [step.label or OP_NAMES[step.op] for step in table.steps]
+        consumers = [cConsumerProcess(ring, cRecordWriter, (recordPath,), name="recorder"),
+                     cConsumerProcess(ring, cDashboardView, (stateNames, events), name="dashboard")]
+        if telemetryHost:
+            consumers.append(cConsumerProcess(ring, cTelemetryForwarder, (telemetryHost, telemetryPort),
+                                              name="telemetry"))
+        for consumer in consumers:
+            consumer.start()
+
+    print("Initiating control sequence")
+    if not useAsyncio:
+        stream.start()  # start sampling the ADC in the background
+    if ramp is not None:
+        ramp.start()  # speed changes are ramped by their own thread
+    if ring is None:
+        dashboard.start()
+        if telemetry is not None and not useAsyncio:
+            telemetry.start()  # sent by its own thread
+    commandServer = cCommandServer(commandKey, commandPort, onStop=functools.partial(emergencyStop, motor, ramp)) \
+        if commandKey else None  # a STOP disables the motor at once, from the thread of the server
+    if commandServer is not None:
+        commandServer.start()  # receives and acknowledges commands in its own thread
+    watchdog.start()  # the motor is locked out on a trip
+    tLoop = clock.time()  # start time of the main control loop
+    scheduler.start()
+    controller.start(tLoop)
+
+    def rezero(signum, frame):  # re-zero over the next readings; the zero load of the controller is kept
+        calibration.startZero(100, reference=controller.zeroLoad)
+        notify("Re-zeroing the load cell")
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, rezero)
+
+    if useAsyncio:
+        loop = LoadLoop(clock, adc, motor, controller, watchdog, calibration, loadFilter, gradient, notify)
+        commands = addTasks(runtime, loop, source, recorder, dashboard, telemetry, commandServer,
+                            (maxSpeed, loadLimit), loopFrequency, staleTimeout, tStart)
+        if hasattr(signal, "SIGUSR1"):  # queue the re-zero for the control task instead
+            signal.signal(signal.SIGUSR1, lambda signum, frame: runtime.post(commands, lambda: rezero(None, None)))
+        runtime.run(duration)
+    else:
+        while (duration is None) or (clock.time() - tLoop < duration): # start the main loop that continues indefinitely
+            if (scheduler.wait() % loopFrequency) == 0:  # update the loop timing statistics every second
+                loopStats = scheduler.stats()
+            now = clock.time()
+            watchdog.kick()
+            if watchdog.tripped is not None:
+                notify("Watchdog: %s: stopping the test" % watchdog.tripped)
+                break  # the motor is locked out
+            if commandServer is not None and not applyCommands(commandServer.pending(), commandServer, controller, now,
+                                                               notify, maxSpeed, loadLimit):
+                break  # remote emergency stop; the motor is already disabled
+            # First take the new readings since the last tick; none if no new conversion is available yet
+            times, counts = stream.drain_arrays()  # never blocks on the I2C bus
+            if not stream.is_valid(staleTimeout) and now - tLoop > staleTimeout:
+                notify("No valid ADC reading for %.2f sec (%s): stopping the test" % (staleTimeout, stream.last_error))
+                break  # the load is unknown; the motor is stopped below
+            if not counts:
+                if controller.step(now) is None:  # timed states still advance without a new reading
+                    break  # the profile has finished
+                continue
+            cRead += len(counts)  # new readings are available
+            for count in counts:  # filter every sample, even if the loop fell behind
+                load = loadFilter.update(calibration.convert(count))  # calibrated, filtered reading in kg
+                gradient.update(load)
+            bFail = stream.failures != cFail  # a conversion failed since the last reading
+            cFail = stream.failures
+
+            # Logic control; never sleeps, the hold periods end on a deadline
+            state = controller.step(now, load)  # state (load cycle) or step index (profile)
+            if state is None:
+                break  # the profile has finished
+            readingLoad = controller.load  # Zeroed, calibrated reading in kg
+            tElapsed = now - tStart
+            if ring is not None:  # recorded, displayed and sent by the consumer processes
+                while messages:
+                    events.put(messages.popleft())
+                timing = loopStats or (math.nan,) * 9
+                ring.push((now, counts[-1], readingLoad, controller.currentSpeed if motor.enabled else 0,
+                           motor.direction, controller.cycleCount, bFail, state, tElapsed, cRead, stream.reads, cFail,
+                           stream.bus_errors, stream.timeouts, stream.implausible, gradient.value,
+                           timing[3] * 1e3, timing[4] * 1e3, timing[5] * 1e3, timing[6] * 1e3, timing[7] * 1e3,
+                           timing[8] * 1e3, timing[1]))
+                continue
+            recorder.append(now, int(counts[-1]), readingLoad,
+                            controller.currentSpeed if motor.enabled else 0, motor.direction,
+                            controller.cycleCount, bFail)
+            if telemetry is not None:  # never blocks on the network
+                telemetry.publish(now, readingLoad, controller.currentSpeed if motor.enabled else 0, state)
+
+            # Publish the state to the status display; never blocks on the terminal
+            dashboard.update(time=tElapsed, frequency=cRead / tElapsed, reads=cRead, cycle=controller.cycleCount,
+                             failed=(cFail / (cFail + stream.reads)) * 100,
+                             errors=(stream.bus_errors, stream.timeouts, stream.implausible),
+                             state=controller.stateName(), load=readingLoad, speed=controller.currentSpeed,
+                             status=controller.status, gradient=gradient.value,
+                             latency=loopStats and (loopStats.latency_p50 * 1e3, loopStats.latency_p99 * 1e3,
+                                                    loopStats.latency_max * 1e3),
+                             work=loopStats and (loopStats.work_p50 * 1e3, loopStats.work_p99 * 1e3,
+                                                 loopStats.work_max * 1e3),
+                             overruns=loopStats and loopStats.overruns)
+
+    if ramp is not None:
+        ramp.stop()
+    motor.setEnable(enabled=0)  # stop the motor first
+    watchdog.stop()
+    stream.stop()
+    if commandServer is not None:
+        commandServer.close()
+    if ring is not None:  # the consumers handle the remaining records before they exit
+        while messages:
+            events.put(messages.popleft())
+        for consumer in consumers:
+            consumer.stop()
+        ring.close()
+    else:
+        dashboard.stop()
+        if telemetry is not None:
+            telemetry.close()
+        recorder.close()
+    if useAsyncio:
+        print(runtime.report())  # per-task latency and queue statistics
+    checks = watchdog.stats()
+    print("Watchdog: %i samples checked, detection latency p50/p99/max %.2f / %.2f / %.2f ms, peak load %s%s" % (
+        checks.samples, checks.detection_p50 * 1e3, checks.detection_p99 * 1e3, checks.detection_max * 1e3,
+        "-" if checks.peak is None else "%.2f kg" % checks.peak,
+        "" if checks.tripped is None else ", tripped after %.2f ms: %s" % (checks.reaction * 1e3, checks.tripped)))
 
 
 if __name__ == "__main__":
-    main()
+    args = [arg for arg in sys.argv[1:] if arg != "--sim"]
+    profileFile = args[0] if args else None
+    if "--sim" in sys.argv:  # run against the simulated actuator and load cell
+        from mSimulator import cSimRig
+        rig = cSimRig(speedup=10)
+        main(rig.bus, rig.gpio, rig.clock, profileFile=profileFile)
+    else:
+        main(profileFile=profileFile)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fly-by-Pi Controller
+
+Demonstration of load control of several actuators from one control loop
+(mCoordinator.py). Every actuator/load cell pair (axis) has its own motor
+driver pins (mMotorDriver.PIN_MAPS), MCP3424 (at 0x68, 0x69, ...; channel
+1) and test: the profile file given for it (see mProfile.py) or the
+built-in load cycle with its own target load. The load cells are read and
+the motor pins are written in one batch per tick, so the axes stay in
+phase; every axis is recorded to its own file and the per-axis loop timing
+is printed at the end.
+
+Run using: sudo python3 MultiLoadControl.py [profile.json ...]
+Simulate using: python3 MultiLoadControl.py [profile.json ...] --sim   (runs 10x faster than real time)
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import time, sys
+from mMotorDriver import cMotorDriver as md, PIN_MAPS
+from mRecorder import cRecorder
+from mDashboard import cDashboard
+from mLoadCycle import cLoadCycleController
+from mPID import cPID
+from mProfile import loadProfile, cProfileRunner
+from mFilter import cMedian, cExponential, cFilterChain
+from mCalibration import cCalibrationCurve, cChannelCalibration
+from mCoordinator import cCoordinator
+
+try:
+    from mMCP3424 import ADCDifferentialPi
+except ImportError:
+    print("Failed to import ADCDifferentialPi from python system path")
+
+
+def main(profileFiles=(), axes=2, bus=None, gpio=None, clock=time, duration=None):
+    # profileFiles holds a test profile per axis; without one an axis runs the built-in load cycle
+    # bus/gpio/clock select the hardware backends (default: the Raspberry Pi)
+    # duration limits the run time (sec) of the control loop
+    print("Fly-by-Pi Multi-Axis Load Control Demonstration")
+    ###### USER VARIABLES ######
+    calibrationFactors = (100, 100, 100)  # calibration factor of each load cell (kg/V)
+    targetLoads  = (70, 50, 30)  # target load (kg) of the built-in load cycle of each axis
+    minimumLoad  = 2     # load (kg) where the motor reverses / accepted as the contact load
+    holdTime     = 10    # hold at either end of the load cycle (sec)
+    startSpeed   = 9     # PWM% at the start of a stroke
+    recordFile   = "MultiLoadControl_%Y%m%d_%H%M%S_{axis}.rec"  # every axis is recorded to its own file (mRecorder.py)
+    adcBitRate   = 14    # 14 bit: 60 SPS per MCP3424
+    loopFrequency = 50   # control loop rate (Hz); at most the ADC sample rate
+    loopPriority = None  # SCHED_FIFO real-time priority (1-99, requires sudo) or None
+    loopCpu      = None  # CPU core to pin the control loop to or None
+    pidGains     = (1.5, 0.1, 0.05)  # kp (%/kg), ki (%/kg/s), kd (%.s/kg)
+    maxSpeed     = 40    # upper PWM% limit of the PID output
+    rampAcceleration = 50  # PWM slew rate limit (%/s); None for instant changes
+    staleTimeout = 0.5   # stop an axis if no valid reading arrives for this long (sec)
+
+    axes = max(axes, len(profileFiles))
+    if axes > len(PIN_MAPS):
+        raise ValueError("at most %i axes are supported" % len(PIN_MAPS))
+    dashboard = cDashboard("Fly-by-Pi Multi-Axis Load Control", [("Time", "time", "%.1f sec")] + [
+        ("Axis A%i state / load / speed" % (i + 1), "a%i" % (i + 1), "%s / %.2f kg / %.1f %%") for i in range(axes)] + [
+        ("Loop latency p50/p99/max", "latency", "%.2f / %.2f / %.2f ms"),
+        ("Loop overruns", "overruns", "%i")], rate=5)
+    coordinator = cCoordinator(loopFrequency, clock, loopPriority, loopCpu, staleTimeout, onEvent=dashboard.log)
+    tStart = time.localtime(clock.time())
+    recorders = []
+    for i in range(axes):
+        name = "A%i" % (i + 1)
+        adc = ADCDifferentialPi(0x68 + i, adcBitRate, bus=bus, clock=clock)  # one MCP3424 per axis: converts in parallel
+        adc.set_pga(1)
+        calibration = cChannelCalibration(cCalibrationCurve.linear(calibrationFactors[i]), adc.get_output_profile())
+        motor = md(gpio=gpio, pins=PIN_MAPS[i])
+        axis = coordinator.axis(name, motor, adc, 1, calibration, cFilterChain(cMedian(5), cExponential(0.3)),
+                                rampAcceleration)
+        pid = cPID(*pidGains, outputMin=0, outputMax=maxSpeed, bias=startSpeed)
+        log = lambda message, name=name: dashboard.log(name + ": " + message)
+        if i < len(profileFiles):  # the profile of the axis
+            table = loadProfile(profileFiles[i])
+            if table.needsDisplacement:
+                raise ValueError(profileFiles[i] + " needs displacement feedback, which this rig does not measure")
+            print("%s profile: %s" % (name, table.name))
+            axis.controller = cProfileRunner(table, axis.motor, pid=pid, ramp=axis.ramp, onEvent=log)
+        else:
+            axis.controller = cLoadCycleController(axis.motor, targetLoads[i], minimumLoad, holdTime, startSpeed,
+                                                   onEvent=log, pid=pid, ramp=axis.ramp)
+        recorders.append(cRecorder(time.strftime(recordFile, tStart).format(axis=name)))
+        print("Recording %s to %s" % (name, recorders[-1].path))
+
+    loopStats = [None]  # loop timing statistics, updated every second
+    reads = [0] * axes  # readings of every axis up to its last recorded row
+    failures = [0] * axes  # failed readings of every axis up to its last recorded row
+
+    def record(tick):  # after every tick: record the axes with a new reading and update the display
+        now = clock.time()
+        values = {}
+        for i, (axis, recorder) in enumerate(zip(coordinator.axes, recorders)):
+            controller = axis.controller
+            speed = controller.currentSpeed if axis.driver.enabled else 0
+            if axis.reads != reads[i]:  # a new reading; fail flags a failed reading since the last row
+                recorder.append(now, int(round(axis.volts / axis.adc.get_decode_profile().scale)), controller.load,
+                                speed, axis.driver.direction, controller.cycleCount, axis.failures != failures[i])
+                reads[i] = axis.reads
+                failures[i] = axis.failures
+            values[axis.name.lower()] = ("FINISHED" if axis.finished else controller.stateName(), controller.load, speed)
+        if tick % loopFrequency == 0:  # update the loop timing statistics every second
+            loopStats[0] = coordinator.scheduler.stats()
+        loop = loopStats[0]
+        dashboard.update(time=coordinator.scheduler.iterations / loopFrequency,
+                         latency=loop and (loop.latency_p50 * 1e3, loop.latency_p99 * 1e3, loop.latency_max * 1e3),
+                         overruns=loop and loop.overruns, **values)
+
+    print("Initiating control sequence")
+    dashboard.start()
+    try:
+        coordinator.run(duration, record)  # the motors are stopped when it returns
+    finally:
+        dashboard.stop()
+        for recorder in recorders:
+            recorder.close()
+    print(coordinator.report())  # per-axis loop timing
+
+
+if __name__ == "__main__":
+    profileFiles = [arg for arg in sys.argv[1:] if arg != "--sim"]
+    if "--sim" in sys.argv:  # run against simulated actuators and load cells
+        from mSimulator import cSimRig
+        rig = cSimRig(speedup=10, axes=max(2, len(profileFiles)))
+        main(profileFiles, len(rig.plants), rig.bus, rig.gpio, rig.clock)
+    else:
+        main(profileFiles)
@@ -1,35 +1,50 @@
 #!/usr/bin/env python
 """
 Fly-by-Pi Controller
-	
+
 Code based on source code provided by:
 ABElectronics ADC Differential Pi 8-Channel ADC demo
 https://github.com/abelectronicsuk/ABElectronics_Python_Libraries
 
 Initialize and test the ADC continniously to establish prevelance
-of read errors due to interference and data corruption.
+of read errors due to interference and data corruption. The ADC is
+sampled as fast as conversions complete by a background ADCStream.
+
+With --sweep every combination of bitrate, PGA, channel, delay between
+reads, conversion mode and oversampling ratio (averaged in the driver) is
+read for a fixed duration. Throughput, read
+latency percentiles, bus failure, timeout and implausible value rates,
+the retries of the driver and noise (standard
+deviation of the readings; apply a constant input) are written to a JSON
+report. --compare flags the regressions against an earlier report.
 
 Run using: sudo python3 StressTestADC.py
+Simulate using: python3 StressTestADC.py --sim   (1% simulated bus errors)
+Sweep using: sudo python3 StressTestADC.py --sweep [--duration 2] [--report adc.json]
+             [--compare baseline.json] [--bitrates 12,14,16,18] [--pga 1,2,4,8]
+             [--channels 1] [--delays 0,0.01] [--modes 1,0] [--oversampling 1,4,16] [--sim]
 Modified by Andre Broekman 2020/05/13
 Open Source License: Creative Commons Attribution-ShareAlike
 """
 
 from __future__ import absolute_import, division, print_function, \
                                                     unicode_literals
-import time, os
+import argparse, itertools, json, math, platform, sys, time
 
 
 try:
-    from mMCP3424 import ADCDifferentialPi
+    from mMCP3424 import ADCDifferentialPi, ConversionTimeout, ImplausibleValue
+    from mADCStream import ADCStream
+    from mDashboard import cDashboard
+    from mScheduler import cLatencyHistogram
 except ImportError:
     print("Failed to import ADCDifferentialPi from python system path")
-	exit(1)
+    exit(1)
 
 
-def main():
-    cRead = 0  # total read count
-    cFail = 0  # failed read count
-    adc = ADCDifferentialPi(0x68, 12) # adc instance
+def main(bus=None, clock=time, duration=None):
+    # bus/clock select the hardware backends, duration limits the test (sec)
+    adc = ADCDifferentialPi(0x68, 12, bus=bus, clock=clock) # adc instance
 
     """
     PGA gain selection 
@@ -49,24 +64,169 @@ def main():
     """
     adc.set_bit_rate(14)  # set the bit-rate to 60 SPS
 
-    tStart = time.time()  # start time of test
-    while True:
-        cRead += 1  # increment read counter
-        try:  # try reading data from adc channels and print data to screen periodically
-            reading = adc.read_voltage(1) # read input Voltage on C1
-        except:  # broad exception capture for reading corruption
-            cFail += 1
-            time.sleep(0.005)    # sleep 5 ms in event of bus error
-        time.sleep(0.010)        # sleep 10 ms after every reading cycle
-        if ((cRead % 100) == 0): # only print new data to screen periodically
-            os.system('clear')   # clear the console
-            print("Time:    " + str(round(time.time() - tStart, 1)) + " [sec]")
-            print("Freq:    " + str(int(1/((time.time() - tStart) / cRead))) + " [Hz]")
-            print("Count:   " + str(cRead))
-            print("Fail:    " + str(cFail))
-            print("Fail(%): " + str(round(((cFail/cRead)*100), 2)))
-            print("C1: %04f [V]" % reading)
+    stream = ADCStream(adc, 1)  # background acquisition of channel 1
+    dashboard = cDashboard("Fly-by-Pi ADC Stress Test", [  # redrawn by its own thread
+        ("Time", "time", "%.1f [sec]"),
+        ("Freq", "frequency", "%i [Hz]"),
+        ("Count", "reads", "%i"),
+        ("Fail", "failures", "%i"),
+        ("Fail(%)", "failed", "%.2f"),
+        ("Bus/T/O/Impl", "errors", "%i / %i / %i"),
+        ("Retries", "retries", "%i"),
+        ("Polls", "polls", "%.2f [reads/sample]"),
+        ("C1", "voltage", "%04f [V]")], rate=2)
+    stream.start()
+    dashboard.start()
+    tStart = clock.time()  # start time of test
+    while (duration is None) or (clock.time() - tStart < duration):
+        clock.sleep(0.1)  # publish new data to the display periodically
+        cRead = stream.reads + stream.failures  # total read count
+        cFail = stream.failures  # failed read count
+        sample = stream.latest()
+        if cRead == 0 or sample is None:
+            continue
+        dashboard.update(time=clock.time() - tStart, frequency=stream.sample_rate(), reads=cRead,
+                         failures=cFail, failed=(cFail / cRead) * 100,
+                         errors=(stream.bus_errors, stream.timeouts, stream.implausible),
+                         retries=adc.get_error_stats().retries,
+                         polls=adc.get_poll_stats().polls_per_sample, voltage=sample[2])
+    dashboard.stop()
+    stream.stop()
+
+
+def runConfig(adc, clock, bitrate, pga, channel, delay, mode, duration, ratio=1):
+    # read one configuration for duration seconds; returns its metrics
+    adc.set_conversion_mode(mode)
+    adc.set_pga(pga)
+    adc.set_bit_rate(bitrate)
+    adc.set_oversampling(ratio)
+    adc.reset_poll_stats()
+    adc.reset_error_stats()
+    latency = cLatencyHistogram()  # time per successful read (us)
+    reads = failures = timeouts = implausible = 0
+    total = totalSquares = 0.0
+    tStart = clock.monotonic()
+    tEnd = tStart + duration
+    now = tStart
+    while now < tEnd:
+        try:
+            voltage = adc.read_voltage(channel)
+        except ConversionTimeout:
+            timeouts += 1
+        except ImplausibleValue:
+            implausible += 1
+        except (IOError, OSError):  # BusError after the retries
+            failures += 1
+        else:
+            reads += 1
+            total += voltage
+            totalSquares += voltage * voltage
+            latency.record((clock.monotonic() - now) * 1e6)
+        if delay:
+            clock.sleep(delay)
+        now = clock.monotonic()
+    attempts = reads + failures + timeouts + implausible
+    mean = total / reads if reads else 0.0
+    variance = totalSquares / reads - mean * mean if reads > 1 else 0.0
+    oversampling = adc.get_oversampling()
+    return {"bitrate": bitrate, "pga": pga, "channel": channel, "delay": delay, "mode": mode,
+            "oversampling": ratio, "effective_bits": oversampling.effective_bits,
+            "duration": now - tStart, "reads": reads, "throughput": reads / (now - tStart),
+            "latency_p50": latency.percentile(50) / 1e3, "latency_p99": latency.percentile(99) / 1e3,
+            "latency_max": latency.max / 1e3,  # ms
+            "failure_rate": failures / attempts if attempts else 0.0,
+            "timeout_rate": timeouts / attempts if attempts else 0.0,
+            "implausible_rate": implausible / attempts if attempts else 0.0,
+            "retries": adc.get_error_stats().retries,
+            "mean": mean, "noise": math.sqrt(max(0.0, variance)),  # V
+            "polls_per_sample": adc.get_poll_stats().polls_per_sample}
+
+
+def sweep(adc, clock, bitrates=(12, 14, 16, 18), pgas=(1, 2, 4, 8), channels=(1,),
+          delays=(0.0, 0.01), modes=(1, 0), duration=2.0, ratios=(1,), out=sys.stdout):
+    # run every combination of the settings; returns the report (dict)
+    results = []
+    out.write("Bitrate PGA Ch  Delay Mode  OSR  Rate[S/s]  p50[ms]  p99[ms]  Fail[%]  T/O[%]  Impl[%]  Noise[uV]\n")
+    for bitrate, pga, channel, delay, mode, ratio in itertools.product(bitrates, pgas, channels, delays,
+                                                                      modes, ratios):
+        r = runConfig(adc, clock, bitrate, pga, channel, delay, mode, duration, ratio)
+        results.append(r)
+        out.write("%7i %3i %2i %6.3f %4i %4i %10.1f %8.2f %8.2f %8.2f %7.2f %8.2f %10.1f\n" % (
+            bitrate, pga, channel, delay, mode, ratio, r["throughput"], r["latency_p50"], r["latency_p99"],
+            r["failure_rate"] * 100, r["timeout_rate"] * 100, r["implausible_rate"] * 100, r["noise"] * 1e6))
+        out.flush()
+    return {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "platform": platform.platform(),
+            "address": adc.get_address(), "duration": duration, "results": results}
+
+
+# regression limits: relative change for throughput/latency/noise, absolute for rates
+TOLERANCES = {"throughput": 0.10, "latency_p99": 0.25, "noise": 0.25,
+              "failure_rate": 0.005, "timeout_rate": 0.005, "implausible_rate": 0.005}
+
+
+def compareReports(baseline, report, tolerances=TOLERANCES):
+    # returns a list of regression messages of report against baseline
+    def key(r):
+        return (r["bitrate"], r["pga"], r["channel"], r["delay"], r["mode"], r.get("oversampling", 1))
+    reference = dict((key(r), r) for r in baseline["results"])
+    regressions = []
+    for r in report["results"]:
+        b = reference.get(key(r))
+        if b is None:
+            continue
+        name = "bitrate %i pga %i ch %i delay %g mode %i osr %i" % key(r)
+        if r["throughput"] < b["throughput"] * (1 - tolerances["throughput"]):
+            regressions.append("%s: throughput %.1f -> %.1f S/s" % (name, b["throughput"], r["throughput"]))
+        for metric in ("latency_p99", "noise"):
+            if r[metric] > b[metric] * (1 + tolerances[metric]) and r[metric] - b[metric] > 1e-9:
+                regressions.append("%s: %s %.6g -> %.6g" % (name, metric, b[metric], r[metric]))
+        for metric in ("failure_rate", "timeout_rate", "implausible_rate"):
+            if r.get(metric, 0.0) > b.get(metric, 0.0) + tolerances[metric]:
+                regressions.append("%s: %s %.2f%% -> %.2f%%" % (name, metric, b.get(metric, 0.0) * 100, r[metric] * 100))
+    return regressions
+
+
+def parseList(text, kind=int):
+    return [kind(item) for item in text.split(",") if item]
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="MCP3424 ADC stress test and benchmark sweep")
+    parser.add_argument("--sim", action="store_true", help="use the simulated MCP3424")
+    parser.add_argument("--sweep", action="store_true", help="run the parameter sweep")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per configuration")
+    parser.add_argument("--bitrates", type=parseList, default=[12, 14, 16, 18])
+    parser.add_argument("--pga", type=parseList, default=[1, 2, 4, 8])
+    parser.add_argument("--channels", type=parseList, default=[1])
+    parser.add_argument("--delays", type=lambda text: parseList(text, float), default=[0.0, 0.01])
+    parser.add_argument("--modes", type=parseList, default=[1, 0], help="1 = continuous, 0 = one-shot")
+    parser.add_argument("--oversampling", type=parseList, default=[1], help="decimation ratios (averaging)")
+    parser.add_argument("--report", default="StressTestADC_%Y%m%d_%H%M%S.json", help="sweep report file")
+    parser.add_argument("--compare", help="earlier report to check for regressions")
+    args = parser.parse_args()
+    if args.sweep:
+        if args.sim:  # virtual clock: the sweep runs as fast as the simulation allows
+            from mSimulator import cSimRig
+            rig = cSimRig(speedup=None, errorRate=0.01)
+            bus, clock = rig.bus, rig.clock
+        else:
+            bus, clock = None, time
+        report = sweep(ADCDifferentialPi(0x68, 12, bus=bus, clock=clock), clock, args.bitrates, args.pga,
+                       args.channels, args.delays, args.modes, args.duration, args.oversampling)
+        path = time.strftime(args.report)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        print("Report written to " + path)
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compareReports(json.load(f), report)
+            for message in regressions:
+                print("REGRESSION " + message)
+            print("%i regression(s) against %s" % (len(regressions), args.compare))
+            sys.exit(1 if regressions else 0)
+    elif args.sim:  # run against the simulated MCP3424
+        from mSimulator import cSimRig
+        rig = cSimRig(speedup=10, errorRate=0.01)
+        main(rig.bus, rig.clock)
+    else:
+        main()
@@ -5,33 +5,70 @@
 Fly-by-Pi Controller
 
 Demonstration on the use of simple time-based cyclic control
-for controlling an actuator. The speed (duty-cycle) of the
-motor is defined followed by a number of load-unload cycles.
+for controlling an actuator. The test is defined by a profile
+file (see mProfile.py); the default profile sets the speed
+(duty-cycle) of the motor followed by a number of load-unload
+cycles. With useRamp the speed and direction changes are ramped
+(mRamp.py) to avoid current and load spikes at the reversals; this
+shortens the travel of every timed segment, so it is off to
+reproduce the original test.
 
-Run using: sudo python3 TimeControl.py
+Run using: sudo python3 TimeControl.py [profile.json]
+Simulate using: python3 TimeControl.py [profile.json] --sim
 Modified by Andre Broekman 2020/05/13
 Open Source License: Creative Commons Attribution-ShareAlike
 """
 
+import os, sys, time
 from mMotorDriver import cMotorDriver as md
-from time import sleep
-
-print("Fly-by-Pi Time Control Demonstration")
-motor = md()  # pin connections should be 27=DIR, 18=PWM, 22=SLP
-motor.setEnable(enabled=0)  # disable the motor driver
-motor.setSpeed(20)  # set the duty-cycle to 20%
-motor.setForward()  # set starting configuration to push
-motor.setEnable(enabled=1)  # enble the motor driver
-
-for cycle in range(1000):  # for a certain number of cycles
-    print("Cycle no: " + str(cycle + 1))
-	motor.setBackward()  # set the motor to retract
-    print("Retracting")
-    sleep(2)  # retract the actuator for 2 seconds
-    motor.setForward()  # set the motor to extend
-    print("Extending")
-    sleep(2)  # extend the actuator for 2 seconds
-    
-motor.setEnable(enabled=0)  # disable the motor driver
-exit(0)
-print("End of the demonstration")
+from mProfile import loadProfile, cProfileRunner
+from mRamp import cRampGenerator
+from mScheduler import cLoopScheduler
+
+defaultProfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles", "TimeControl.json")
+
+
+def main(profileFile=defaultProfile, gpio=None, clock=time, duration=None, useRamp=False):
+    # gpio/clock select the hardware backends (default: the Raspberry Pi)
+    # duration limits the run time (sec) of the test
+    # useRamp ramps the speed changes at 100%/s with a 0.1 s dwell at the reversals
+    print("Fly-by-Pi Time Control Demonstration")
+    table = loadProfile(profileFile)  # precompiled step table of the test
+    if table.needsLoad or table.needsDisplacement:
+        raise ValueError(profileFile + " needs load/displacement feedback; run it with LoadControl.py")
+    print("Profile: " + table.name)
+    motor = md(gpio=gpio)  # pin connections should be 27=DIR, 18=PWM, 22=SLP
+    motor.setEnable(enabled=0)  # disable the motor driver
+    ramp = None
+    if useRamp:
+        ramp = cRampGenerator(motor, acceleration=100, reversalDelay=0.1, clock=clock)  # ramp speed changes at 100%/s
+        ramp.start()  # the ramp runs on its own thread and never blocks the loop below
+    runner = cProfileRunner(table, motor, ramp=ramp,
+                            onEvent=lambda message: print("Cycle no: " + str(runner.cycleCount) + "  " + message))
+    scheduler = cLoopScheduler(100, clock)  # 100 Hz is ample for time-based segments
+
+    tStart = clock.monotonic()
+    scheduler.start()
+    runner.start(tStart)
+    for tick in scheduler:
+        now = clock.monotonic()
+        if (runner.step(now) is None) or ((duration is not None) and (now - tStart >= duration)):
+            break
+
+    if ramp is not None:
+        ramp.setTarget(0, enabled=0)  # ramp down and disable the motor driver
+        ramp.wait(timeout=5)
+        ramp.stop()
+    motor.setEnable(enabled=0)  # disable the motor driver
+    print("End of the demonstration")
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--sim"]
+    profileFile = args[0] if args else defaultProfile
+    if "--sim" in sys.argv:  # run against the simulated actuator
+        from mSimulator import cSimRig
+        rig = cSimRig(speedup=10)
+        main(profileFile, rig.gpio, rig.clock)
+    else:
+        main(profileFile)
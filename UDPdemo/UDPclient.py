@@ -1,15 +1,37 @@
-import socket
-
-msgFromClient = "Hello UDP Server"
-bytesToSend = str.encode(msgFromClient)
-serverAddressPort = ("127.0.0.1", 20001)
-bufferSize = 1024
-
-# Create a UDP socket at client side
-UDPClientSocket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-# Send to server using created UDP socket
-while True:
-    UDPClientSocket.sendto(bytesToSend, serverAddressPort)
-msgFromServer = UDPClientSocket.recvfrom(bufferSize)
-msg = "Message from Server {}".format(msgFromServer[0])
-print(msg)
\ No newline at end of file
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Telemetry publisher demonstration: sends a synthetic load cycle at the
+control loop rate to UDPserver.py, the way LoadControl.py streams its
+live data (see mTelemetry.py).
+
+Run using: python3 UDPclient.py [host] [port]
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import math, sys, time
+from mTelemetry import cTelemetryPublisher
+
+serverAddress = sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1"
+serverPort = int(sys.argv[2]) if len(sys.argv) > 2 else 20001
+loopFrequency = 60  # samples per second, as the control loop
+
+publisher = cTelemetryPublisher(serverAddress, serverPort)
+publisher.start()
+print("Sending telemetry to %s:%i, Ctrl+C to stop" % (serverAddress, serverPort))
+tStart = time.time()
+tNext = tStart
+try:
+    while True:
+        now = time.time()
+        load = 35 - 35 * math.cos(now - tStart)  # 0 to 70 kg load cycle
+        publisher.publish(now - tStart, load, 9 + load / 5, 2)
+        tNext += 1.0 / loopFrequency
+        time.sleep(max(0.0, tNext - time.time()))
+except KeyboardInterrupt:
+    pass
+publisher.close()
+print("Sent %i samples in %i datagrams (%i dropped)" % (publisher.published, publisher.sent, publisher.dropped))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Remote command demonstration: sends one command to the command server of
+LoadControl.py (commandKey set, see mCommand.py) and prints the
+acknowledgements with their round-trip times. The key must match
+commandKey of LoadControl.py.
+
+Run using: python3 UDPcommand.py host key ping|pause|resume|stop
+           python3 UDPcommand.py host key set targetLoad|holdTime|startSpeed|minimumLoad value
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import sys
+from mCommand import cCommandClient, COMMAND_NAMES, STATUS_NAMES, SET
+
+if len(sys.argv) < 4:
+    print(__doc__)
+    sys.exit(1)
+serverAddress, key, command = sys.argv[1], sys.argv[2], sys.argv[3].upper()
+serverPort = 20002  # commandPort of LoadControl.py
+
+client = cCommandClient(key, serverAddress, serverPort)
+try:
+    if command == COMMAND_NAMES[SET]:
+        ack = client.set(sys.argv[4], float(sys.argv[5]))
+    else:
+        ack = client.send(COMMAND_NAMES.index(command))
+except TimeoutError as err:
+    print(err)
+    sys.exit(1)
+finally:
+    client.close()
+print("%s %i: %s (received %.2f ms%s, %i retransmissions)" % (
+    command, ack.sequence, STATUS_NAMES[ack.status], ack.received * 1e3,
+    "" if ack.applied is None else ", applied %.2f ms" % (ack.applied * 1e3),
+    client.retransmissions))
@@ -1,27 +1,40 @@
-import socket
-
-localIP = "127.0.0.1"
-localPort = 20001
-bufferSize = 1024
-msgFromServer = "Hello UDP Client"
-bytesToSend = str.encode(msgFromServer)
-
-# Create a datagram socket
-UDPServerSocket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-
-# Bind to address and ip
-UDPServerSocket.bind((localIP, localPort))
-
-print("UDP server up and listening")
-# Listen for incoming datagrams
-
-while (True):
-    bytesAddressPair = UDPServerSocket.recvfrom(bufferSize)
-    message = bytesAddressPair[0]
-    address = bytesAddressPair[1]
-    clientMsg = "Message from Client:{}".format(message)
-    clientIP = "Client IP Address:{}".format(address)
-    print(clientMsg)
-    print(clientIP)
-    # Sending a reply to client
-    UDPServerSocket.sendto(bytesToSend, address)
\ No newline at end of file
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Telemetry receiver for the control room. Listens for the live data sent
+by LoadControl.py (telemetryHost set to the address of this computer) or
+UDPclient.py and prints the samples with the receive rate and the lost
+datagrams and samples (see mTelemetry.py).
+
+Run using: python3 UDPserver.py [port]
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import sys, time
+from mTelemetry import cTelemetryReceiver
+
+localIP = ""  # all interfaces
+localPort = int(sys.argv[1]) if len(sys.argv) > 1 else 20001
+
+receiver = cTelemetryReceiver(localPort, localIP)
+print("UDP telemetry receiver listening on port %i" % localPort)
+tReport = time.time()
+count = 0
+try:
+    while True:
+        samples = receiver.receive(timeout=1.0)
+        count += len(samples)
+        now = time.time()
+        if now - tReport >= 1.0 and samples:  # one line per second
+            latest = samples[-1]
+            print("t=%.2f s  load=%.3f kg  speed=%.1f %%  state=%i  rate=%.0f Hz  lost datagrams=%i samples=%i  late=%i" % (
+                latest.time, latest.load, latest.speed, latest.state, count / (now - tReport),
+                receiver.lostDatagrams, receiver.lostSamples, receiver.late))
+            tReport = now
+            count = 0
+except KeyboardInterrupt:
+    pass
+receiver.close()
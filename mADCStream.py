@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Background acquisition for the MCP3424 ADC. A dedicated thread reads one
+channel of an ADCDifferentialPi in continuous conversion mode, with the
+driver sleeping until each conversion is due instead of polling the I2C bus,
+and pushes timestamped voltages into a lock-free ring buffer. The control
+loop takes the latest sample or drains a batch without ever blocking on I2C.
+With counts=True the signed raw counts are streamed instead of volts, e.g.
+for a lookup table calibration (mCalibration.py).
+
+Failed reads are counted by kind (bus errors, timeouts, implausible
+values) and never enter the buffer. After consecutive failures the thread
+backs off following the retry policy of the driver instead of hammering
+the bus. is_valid() tells the control loop whether the newest sample is
+recent enough to act on.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import threading
+
+from mRingBuffer import cRingBuffer
+from mMCP3424 import ConversionTimeout, ImplausibleValue
+
+
+class ADCStream:
+    """
+    Stream samples from one channel of an ADCDifferentialPi
+    """
+
+    def __init__(self, adc, channel=1, capacity=1024, counts=False):
+        self.adc = adc
+        self.channel = channel
+        self.counts = counts  # stream raw counts instead of volts
+        self.buffer = cRingBuffer(capacity)
+        self.reads = 0      # successful conversions
+        self.failures = 0   # failed conversions (all kinds)
+        self.bus_errors = 0   # reads failed on the i2c bus after retries
+        self.timeouts = 0     # conversions that timed out
+        self.implausible = 0  # conversions rejected as implausible
+        self.consecutive_failures = 0  # failed reads since the last sample
+        self.last_error = None  # most recent read error
+        self.__clock = adc.get_clock()
+        self.__thread = None
+        self.__running = False
+        self.__tStart = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __run(self):
+        # acquisition thread: the driver sleeps until each conversion is due
+        read = self.adc.read_count if self.counts else self.adc.read_voltage
+        channel = self.channel
+        push = self.buffer.push
+        monotonic = self.__clock.monotonic
+        sleep = self.__clock.sleep
+        while self.__running:
+            try:
+                value = read(channel)
+            except ImplausibleValue as err:
+                # the bus is fine: take the next conversion straight away
+                self.implausible += 1
+                self.__failed(err)
+                continue
+            except ConversionTimeout as err:
+                self.timeouts += 1
+                self.__failed(err)
+            except (IOError, OSError) as err:
+                self.bus_errors += 1
+                self.__failed(err)
+            else:
+                push(monotonic(), value)
+                self.reads += 1
+                self.consecutive_failures = 0
+                continue
+            # the driver already retried: back off before the next attempt
+            policy = self.adc.get_retry_policy()
+            sleep(min(policy.backoff * policy.factor **
+                      min(self.consecutive_failures, 32), policy.max_backoff))
+
+    def __failed(self, err):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = err
+
+    def start(self):
+        """
+        start the acquisition thread (continuous conversion mode)
+        """
+        if self.__running:
+            return
+        self.adc.set_conversion_mode(1)
+        self.__running = True
+        self.__tStart = self.__clock.monotonic()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name="ADCStream")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        stop the acquisition thread and wait for it to finish
+        """
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def is_running(self):
+        """
+        returns True while the acquisition thread is active
+        """
+        return self.__running
+
+    def latest(self):
+        """
+        returns the newest sample as (sequence, time, value) or None; the
+        value is a voltage, or the signed raw count with counts=True
+        """
+        return self.buffer.latest()
+
+    def is_valid(self, max_age):
+        """
+        returns True if the newest sample is at most max_age seconds old;
+        False before the first sample or while reads keep failing
+        """
+        sample = self.buffer.latest()
+        return (sample is not None and
+                self.__clock.monotonic() - sample[1] <= max_age)
+
+    def drain(self, max_items=None):
+        """
+        returns a list of (time, value) samples not yet drained (volts,
+        or raw counts with counts=True)
+        """
+        return self.buffer.drain(max_items)
+
+    def drain_arrays(self, max_items=None):
+        """
+        returns the samples not yet drained as (times, values) arrays
+        """
+        return self.buffer.drainArrays(max_items)
+
+    def sample_rate(self):
+        """
+        returns the average acquisition rate since start in samples/sec
+        """
+        elapsed = self.__clock.monotonic() - self.__tStart
+        if elapsed <= 0:
+            return 0.0
+        return self.reads / elapsed
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Calibration of ADC channels to engineering units (e.g. kg). A channel is
+calibrated with a curve through measured (volts, value) points:
+    polynomial  least squares polynomial of the given degree
+    piecewise   linear interpolation between the points (extrapolated
+                linearly beyond the first and last point)
+For a given bitrate and PGA the curve is evaluated once for every raw
+count (including the resolution gained by oversampling) into a lookup
+table, so converting a reading (ADCStream with counts=True, or
+ADCDifferentialPi.read_count) costs one array index:
+
+    value = table[count] * gain - offset
+
+gain and offset hold the temperature compensation (zero drift in
+units/degC, span drift in 1/degC relative to the reference temperature)
+and the zero. startZero() re-zeroes the channel in flight: the next
+readings passed through convert() are averaged and the zero is updated
+without stopping the control loop.
+
+Calibrations are stored per channel in a JSON file:
+    {"channels": {"1": {"units": "kg", "kind": "piecewise",
+                        "points": [[0.02, 0.0], [0.37, 35.0], [0.72, 70.0]],
+                        "temperatureZero": 0.0, "temperatureSpan": 0.0,
+                        "referenceTemperature": 20.0}}}
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import bisect
+import json
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # only required by convertArray
+
+
+class cCalibrationCurve:
+    def __init__(self, points, kind="polynomial", degree=1):
+        points = sorted((float(v), float(y)) for v, y in points)
+        if kind not in ("polynomial", "piecewise"):
+            raise ValueError("cCalibrationCurve: unknown kind %r" % kind)
+        if len(points) < (degree + 1 if kind == "polynomial" else 2):
+            raise ValueError("cCalibrationCurve: not enough points")
+        self.points = points
+        self.kind = kind
+        self.degree = degree
+        self.coefficients = self.__fit() if kind == "polynomial" else None
+        self.__volts = [v for v, y in points]
+
+    @classmethod
+    def linear(cls, factor, offset=0.0):
+        """
+        returns the curve value = factor * volts + offset
+        """
+        return cls([(0.0, offset), (1.0, factor + offset)])
+
+    def __fit(self):
+        # least squares polynomial through the points (normal equations)
+        n = self.degree + 1
+        matrix = [[sum(v ** (i + j) for v, y in self.points)
+                   for j in range(n)] +
+                  [sum(y * v ** i for v, y in self.points)]
+                  for i in range(n)]
+        for col in range(n):  # Gauss-Jordan elimination with pivoting
+            pivot = max(range(col, n), key=lambda row: abs(matrix[row][col]))
+            matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+            if matrix[col][col] == 0:
+                raise ValueError("cCalibrationCurve: points do not define "
+                                 "a degree %i polynomial" % self.degree)
+            for row in range(n):
+                if row != col:
+                    factor = matrix[row][col] / matrix[col][col]
+                    matrix[row] = [a - factor * b for a, b in
+                                   zip(matrix[row], matrix[col])]
+        return [matrix[i][n] / matrix[i][i] for i in range(n)]
+
+    def evaluate(self, volts):
+        if self.coefficients is not None:
+            value = 0.0
+            for c in reversed(self.coefficients):  # Horner's method
+                value = value * volts + c
+            return value
+        points = self.points
+        i = min(max(bisect.bisect_right(self.__volts, volts), 1),
+                len(points) - 1)
+        (v0, y0), (v1, y1) = points[i - 1], points[i]
+        return y0 + (y1 - y0) * (volts - v0) / (v1 - v0)
+
+    def residuals(self):
+        """
+        returns the fit error (value - reference) at every point
+        """
+        return [self.evaluate(v) - y for v, y in self.points]
+
+
+class cChannelCalibration:
+    """
+    lookup table calibration of one channel for the DecodeProfile (bitrate
+    and PGA) of the ADC samples, e.g. adc.get_output_profile()
+    """
+
+    def __init__(self, curve, profile, units="kg", temperatureZero=0.0,
+                 temperatureSpan=0.0, referenceTemperature=20.0):
+        self.curve = curve
+        self.units = units
+        self.temperatureZero = temperatureZero  # zero drift (units/degC)
+        self.temperatureSpan = temperatureSpan  # span drift (1/degC)
+        self.referenceTemperature = referenceTemperature  # (degC)
+        self.temperature = referenceTemperature
+        self.zero = 0.0          # value subtracted from every reading
+        self.build(profile)
+
+    def build(self, profile):
+        """
+        evaluate the curve for every count of the profile (rebuild after
+        changing the bitrate or PGA of the ADC)
+        """
+        self.profile = profile
+        self.base = profile.sign_mask  # table index of count 0
+        scale = profile.scale
+        evaluate = self.curve.evaluate
+        self.table = array('d', [evaluate((i - self.base) * scale)
+                                 for i in range(2 * self.base)])
+        self.__array = None
+        self.__zeroSum = 0.0
+        self.__zeroCount = 0
+        self.__zeroRemaining = 0
+        self.__zeroReference = 0.0
+        self.setTemperature(self.temperature)
+
+    def setTemperature(self, temperature):
+        """
+        apply the temperature compensation for the temperature (degC)
+        """
+        self.temperature = temperature
+        delta = temperature - self.referenceTemperature
+        self.gain = 1.0 / (1.0 + self.temperatureSpan * delta)
+        self.offset = self.zero + self.temperatureZero * delta * self.gain
+
+    def startZero(self, samples=100, reference=0.0):
+        """
+        re-zero in flight: the next samples readings passed through
+        convert() are averaged and the zero is set so that they read
+        reference. Never blocks.
+        """
+        self.__zeroSum = 0.0
+        self.__zeroCount = 0
+        self.__zeroReference = reference
+        self.__zeroRemaining = max(1, int(samples))
+
+    def zeroing(self):  # True while a re-zero is in progress
+        return self.__zeroRemaining > 0
+
+    def __accumulate(self, value):
+        self.__zeroSum += value + self.zero
+        self.__zeroCount += 1
+        self.__zeroRemaining -= 1
+        if self.__zeroRemaining == 0:
+            self.zero = (self.__zeroSum / self.__zeroCount -
+                         self.__zeroReference)
+            self.setTemperature(self.temperature)
+
+    def convert(self, count):
+        """
+        returns the calibrated, zeroed value of a raw count
+        """
+        value = self.table[int(count) + self.base] * self.gain - self.offset
+        if self.__zeroRemaining:
+            self.__accumulate(value)
+        return value
+
+    def lookup(self, count):
+        """
+        as convert() without taking part in a re-zero, for a second reader
+        of the samples (e.g. the load limit watchdog, mWatchdog.py)
+        """
+        return self.table[int(count) + self.base] * self.gain - self.offset
+
+    def convertVolts(self, volts):
+        """
+        as convert() for a voltage (e.g. ADCDifferentialPi.read_voltage)
+        """
+        return self.convert(round(volts / self.profile.scale))
+
+    def convertArray(self, counts):
+        """
+        returns a numpy array of the calibrated values of a batch of counts
+        """
+        if numpy is None:
+            raise ImportError("numpy not found")
+        if self.__zeroRemaining:  # rare: feed the re-zero sample by sample
+            return numpy.array([self.convert(c) for c in counts])
+        if self.__array is None:
+            self.__array = numpy.frombuffer(self.table, dtype=float)
+        index = numpy.asarray(counts).astype(int) + self.base
+        return self.__array[index] * self.gain - self.offset
+
+    def settings(self):
+        """
+        returns the channel settings as stored in a calibration file
+        """
+        curve = self.curve
+        settings = {"units": self.units, "kind": curve.kind,
+                    "points": [list(p) for p in curve.points],
+                    "temperatureZero": self.temperatureZero,
+                    "temperatureSpan": self.temperatureSpan,
+                    "referenceTemperature": self.referenceTemperature}
+        if curve.kind == "polynomial":
+            settings["degree"] = curve.degree
+        return settings
+
+
+def loadCalibration(path, profile):
+    """
+    returns {channel: cChannelCalibration} from a calibration file for the
+    DecodeProfile of the ADC
+    """
+    with open(path) as f:
+        channels = json.load(f)["channels"]
+    calibration = {}
+    for channel, settings in channels.items():
+        curve = cCalibrationCurve(settings["points"],
+                                  settings.get("kind", "polynomial"),
+                                  settings.get("degree", 1))
+        calibration[int(channel)] = cChannelCalibration(
+            curve, profile, settings.get("units", ""),
+            settings.get("temperatureZero", 0.0),
+            settings.get("temperatureSpan", 0.0),
+            settings.get("referenceTemperature", 20.0))
+    return calibration
+
+
+def saveCalibration(path, calibration):
+    """
+    writes {channel: cChannelCalibration} to a calibration file
+    """
+    with open(path, "w") as f:
+        json.dump({"channels": dict((str(channel), c.settings()) for
+                                    channel, c in calibration.items())},
+                  f, indent=4)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Remote commands over UDP: setpoint changes, pause/resume and emergency
+stop from the control room while a test runs. cCommandServer receives the
+commands in its own thread and queues them; the control loop takes them
+with pending() at its next tick, applies them and reports the result with
+applied(). Every datagram is authenticated with an HMAC-SHA256 (truncated
+to 16 bytes) over a shared key; datagrams with a bad code are ignored
+without a reply.
+
+Every command carries the session (random per client) and a sequence
+number that increases with every new command. The server acknowledges a
+command twice: RECEIVED as soon as it is queued (low latency, no waiting
+for the control loop) and APPLIED or REJECTED once the control loop has
+handled it. A retransmitted command (same sequence) is acknowledged again
+with its latest status but never applied twice; older sequence numbers
+and commands older than maxAge seconds (replays) are dropped; a session
+silent for maxAge seconds is forgotten. An emergency stop also calls
+onStop straight from the receive thread, so the motor stops without
+waiting for the control loop, and is queued even when the queue is full.
+
+Wire format (little endian), followed by the 16 byte HMAC:
+    command  magic b'FBPC', version (u8), code (u8), parameter (u8),
+             flags (u8), session (u32), sequence (u32), value (f8),
+             time (f8, sender clock time)
+    ack      magic b'FBPA', version (u8), status (u8), reserved (u16),
+             session (u32), sequence (u32)
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import hashlib
+import hmac
+import random
+import socket
+import struct
+import threading
+import time
+
+VERSION = 1
+COMMAND = struct.Struct('<4sBBBBIIdd')
+ACK = struct.Struct('<4sBBHII')
+MAC_SIZE = 16
+
+# command codes
+PING, SET, PAUSE, RESUME, STOP = range(5)
+COMMAND_NAMES = ("PING", "SET", "PAUSE", "RESUME", "STOP")
+# setpoints that SET can change (the parameter byte is the index)
+PARAMETERS = ("targetLoad", "holdTime", "startSpeed", "minimumLoad")
+# acknowledgement status
+RECEIVED, APPLIED, REJECTED = range(3)
+STATUS_NAMES = ("RECEIVED", "APPLIED", "REJECTED")
+
+# A command received by the server
+Command = collections.namedtuple('Command', [
+    'code', 'parameter', 'value', 'session', 'sequence', 'address',
+    'received'])
+
+# The reply to cCommandClient.send: final status and round-trip times (sec)
+# of the RECEIVED and APPLIED/REJECTED acknowledgements (None if not seen)
+Ack = collections.namedtuple('Ack', ['sequence', 'status', 'received',
+                                     'applied'])
+
+
+def _key(key):
+    return key.encode('utf-8') if not isinstance(key, bytes) else key
+
+
+def _sign(key, data):
+    return hmac.new(key, data, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def _verify(key, datagram, size):
+    # returns the payload of an authentic datagram of size bytes, or None
+    if len(datagram) != size + MAC_SIZE:
+        return None
+    payload = datagram[:size]
+    if not hmac.compare_digest(_sign(key, payload), datagram[size:]):
+        return None
+    return payload
+
+
+class cCommandServer:
+    def __init__(self, key, port=20002, host="", maxAge=30.0, onStop=None,
+                 capacity=64, clock=time):
+        self.key = _key(key)
+        self.maxAge = maxAge    # accepted command age (sec); None = any
+        self.onStop = onStop    # called at once on an emergency stop
+        self.clock = clock
+        self.received = 0       # authentic commands received
+        self.rejected = 0       # datagrams failing authentication/format
+        self.replays = 0        # old, repeated or expired commands
+        self.overflows = 0      # commands dropped because the queue was full
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.__queue = collections.deque()
+        self.__capacity = capacity
+        self.__sessions = {}    # session: [last sequence, its status, time]
+        self.__tPrune = clock.time()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __ack(self, session, sequence, status, address):
+        payload = ACK.pack(b'FBPA', VERSION, status, 0, session, sequence)
+        try:
+            self.socket.sendto(payload + _sign(self.key, payload), address)
+        except (IOError, OSError):
+            pass  # the client retransmits
+
+    def __handle(self, datagram, address):
+        payload = _verify(self.key, datagram, COMMAND.size)
+        if payload is None:
+            self.rejected += 1
+            return
+        magic, version, code, parameter, flags, session, sequence, value, \
+            sent = COMMAND.unpack(payload)
+        if magic != b'FBPC' or version != VERSION or code >= len(COMMAND_NAMES):
+            self.rejected += 1
+            return
+        if self.maxAge is not None and \
+                abs(self.clock.time() - sent) > self.maxAge:
+            self.replays += 1
+            return
+        now = self.clock.time()
+        with self.__lock:
+            if self.maxAge is not None and now - self.__tPrune > 1.0:
+                self.__prune(now)
+            last = self.__sessions.get(session)
+            if last is not None and sequence <= last[0]:
+                if sequence == last[0]:  # retransmission: repeat the ack
+                    last[2] = now
+                    self.__ack(session, sequence, last[1], address)
+                else:
+                    self.replays += 1
+                return
+            if code != STOP and len(self.__queue) >= self.__capacity:
+                self.overflows += 1
+                return  # no ack: the client retransmits
+            self.__sessions[session] = [sequence, RECEIVED, now]
+            self.received += 1
+            command = Command(code, parameter, value, session, sequence,
+                              address, self.clock.monotonic())
+            self.__queue.append(command)
+        if code == STOP and self.onStop is not None:
+            self.onStop()  # do not wait for the control loop
+        self.__ack(session, sequence, RECEIVED, address)
+
+    def __prune(self, now):
+        # forget sessions silent for maxAge: their replays are too old anyway
+        self.__tPrune = now
+        for session in [session for session, last in self.__sessions.items()
+                        if now - last[2] > self.maxAge]:
+            del self.__sessions[session]
+
+    def __run(self):
+        self.socket.settimeout(0.2)
+        while self.__running:
+            try:
+                datagram, address = self.socket.recvfrom(512)
+            except socket.timeout:
+                continue
+            except (IOError, OSError):
+                if not self.__running:
+                    break
+                continue
+            self.__handle(datagram, address)
+
+    def start(self):
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run,
+                                         name="cCommandServer")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def pending(self):
+        """
+        returns the queued commands (oldest first); called by the control
+        loop at every tick, never blocks
+        """
+        commands = []
+        queue = self.__queue
+        while queue:
+            commands.append(queue.popleft())
+        return commands
+
+    def applied(self, command, ok=True):
+        """
+        report that the control loop applied (or rejected) a command
+        """
+        status = APPLIED if ok else REJECTED
+        with self.__lock:
+            last = self.__sessions.get(command.session)
+            if last is not None and last[0] == command.sequence:
+                last[1] = status
+        self.__ack(command.session, command.sequence, status,
+                   command.address)
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self):
+        self.stop()
+        self.socket.close()
+
+
+class cCommandClient:
+    """
+    send commands to a cCommandServer, retransmitting until acknowledged
+    """
+
+    def __init__(self, key, host="127.0.0.1", port=20002, timeout=0.2,
+                 retries=5):
+        self.key = _key(key)
+        self.address = (host, port)
+        self.timeout = timeout  # wait for an acknowledgement (sec)
+        self.retries = retries  # retransmissions before giving up
+        self.session = random.getrandbits(32)
+        self.sequence = 0
+        self.retransmissions = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __receive(self, sequence, deadline):
+        # returns the status of the next ack of sequence, or None on timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.socket.settimeout(remaining)
+            try:
+                datagram = self.socket.recv(512)
+            except socket.timeout:
+                return None
+            payload = _verify(self.key, datagram, ACK.size)
+            if payload is None:
+                continue
+            magic, version, status, reserved, session, acked = \
+                ACK.unpack(payload)
+            if magic == b'FBPA' and session == self.session and \
+                    acked == sequence:
+                return status
+
+    def send(self, code, parameter=0, value=0.0, waitApplied=True):
+        """
+        send a command; returns an Ack, or raises TimeoutError if the
+        server never acknowledged it. With waitApplied the call also waits
+        for the control loop to apply it.
+        """
+        self.sequence += 1
+        sequence = self.sequence
+        payload = COMMAND.pack(b'FBPC', VERSION, code, parameter, 0,
+                               self.session, sequence, value, time.time())
+        datagram = payload + _sign(self.key, payload)
+        tStart = time.monotonic()
+        received = applied = None
+        status = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retransmissions += 1
+            self.socket.sendto(datagram, self.address)
+            deadline = time.monotonic() + self.timeout
+            while True:
+                reply = self.__receive(sequence, deadline)
+                if reply is None:
+                    break  # retransmit
+                now = time.monotonic() - tStart
+                if received is None:
+                    received = now
+                status = reply
+                if reply != RECEIVED:
+                    applied = now
+                    return Ack(sequence, status, received, applied)
+                if not waitApplied:
+                    return Ack(sequence, status, received, applied)
+                deadline = time.monotonic() + self.timeout
+        if status is None:
+            raise TimeoutError("cCommandClient: %s %i not acknowledged" %
+                               (COMMAND_NAMES[code], sequence))
+        return Ack(sequence, status, received, applied)
+
+    def set(self, name, value, waitApplied=True):
+        """
+        change a setpoint, e.g. set("targetLoad", 60)
+        """
+        return self.send(SET, PARAMETERS.index(name), value, waitApplied)
+
+    def close(self):
+        self.socket.close()
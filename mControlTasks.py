@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Building blocks of the load control script (LoadControl.py) outside its
+main loop: the handling of remote commands (mCommand.py), used by every
+control mode, and the acquisition, command intake, control, logging and
+telemetry tasks that replace the main loop with useAsyncio (mRuntime.py).
+The tasks are coroutine functions that get everything they share passed
+in:
+
+    runtime = cRuntime(clock)
+    stream = cAsyncStream(runtime, adc)
+    loop = LoadLoop(clock, adc, motor, controller, watchdog, calibration,
+                    loadFilter, gradient, dashboard.log)
+    commands = addTasks(runtime, loop, stream, recorder, dashboard)
+    runtime.run(duration)
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+from collections import namedtuple
+
+from mLoadCycle import cLoadCycleController
+from mCommand import PING, SET, PAUSE, RESUME, STOP, PARAMETERS, \
+    COMMAND_NAMES
+
+# The objects of the control loop used by its tasks; notify(message) shows
+# a status message
+LoadLoop = namedtuple('LoadLoop', ['clock', 'adc', 'motor', 'controller',
+                                   'watchdog', 'calibration', 'loadFilter',
+                                   'gradient', 'notify'])
+
+
+def emergencyStop(motor, ramp):
+    """
+    disables the motor on a remote STOP; called by the command server
+    thread before the control loop sees the command
+    """
+    motor.lockOut()  # stays disabled if a control tick re-applies the motor
+    if ramp is not None:
+        ramp.brake()
+
+
+def setpointValid(controller, name, value, maxSpeed, loadLimit):
+    """
+    returns True if a remote setpoint keeps the load cycle within the
+    speed and load limits of the script
+    """
+    if name == "startSpeed":
+        return 0 <= value <= maxSpeed
+    if name == "targetLoad":
+        return controller.minimumLoad < value < loadLimit
+    if name == "minimumLoad":
+        return 0 <= value < controller.targetLoad
+    return value >= 0  # holdTime
+
+
+def applyCommands(commands, server, controller, now, notify, maxSpeed,
+                  loadLimit):
+    """
+    applies the received remote commands to the controller and
+    acknowledges them to the server; returns False on a STOP
+    """
+    running = True
+    for command in commands:
+        ok = True
+        known = command.parameter < len(PARAMETERS)
+        if command.code == SET:  # a profile defines its own setpoints
+            ok = (isinstance(controller, cLoadCycleController) and known and
+                  setpointValid(controller, PARAMETERS[command.parameter],
+                                command.value, maxSpeed, loadLimit))
+            if ok:
+                setattr(controller, PARAMETERS[command.parameter],
+                        command.value)
+        elif command.code == PAUSE:
+            controller.pause(now)
+        elif command.code == RESUME:
+            controller.resume(now)
+        elif command.code == STOP:
+            running = False
+        if command.code == SET:
+            notify("Remote %s %s = %g%s" % (
+                COMMAND_NAMES[SET],
+                PARAMETERS[command.parameter] if known else "?",
+                command.value, "" if ok else " rejected"))
+        elif command.code != PING:
+            notify("Remote " + COMMAND_NAMES[command.code])
+        server.applied(command, ok)
+    if not running:
+        notify("Remote emergency stop: stopping the test")
+    return running
+
+
+class cAsyncStream:
+    """
+    Acquisition task of the asyncio runtime, the counterpart of ADCStream:
+    the blocking I2C reads of one channel run in the worker thread of the
+    runtime and the signed counts are put into the bounded "samples"
+    channel as (time, count); when it is full the task waits
+    (backpressure). latest() serves the watchdog as ADCStream.latest does.
+    """
+
+    def __init__(self, runtime, adc, channel=1, size=256):
+        self.runtime = runtime
+        self.adc = adc
+        self.channel = channel
+        self.samples = runtime.channel("samples", size)
+        self.failures = 0  # failed reads (after the retries of the driver)
+        self.__latest = None
+
+    def latest(self):
+        """
+        returns the newest sample as (sequence, time, count) or None
+        """
+        return self.__latest
+
+    async def acquire(self, task):
+        clock = self.runtime.clock
+        async for n in task.iterate():
+            try:
+                count = await self.runtime.offload(self.adc.read_count,
+                                                   self.channel)
+            except (IOError, OSError):  # counted by the driver
+                self.failures += 1
+                continue
+            t = clock.monotonic()
+            self.__latest = (n, t, count)
+            await self.samples.put((t, count))
+
+
+async def intake(task, server, remote, frequency):
+    """
+    command task: every 1/frequency seconds moves the commands received by
+    the server thread into the bounded remote channel; waits when the
+    control task falls behind
+    """
+    async for tick in task.ticks(frequency):
+        for command in server.pending():
+            await remote.put(command)
+
+
+async def control(task, loop, stream, commands, records, live, remote,
+                  server, limits, frequency, staleTimeout):
+    """
+    control task: every 1/frequency seconds filters the new samples and
+    steps the controller. commands holds callables (e.g. a re-zero) run at
+    the next tick, remote the commands of the cCommandServer server (or
+    None) and limits their (maxSpeed, loadLimit). Returns when the test
+    ends
+    """
+    clock = loop.clock
+    controller = loop.controller
+    motor = loop.motor
+    watchdog = loop.watchdog
+    notify = loop.notify
+    tValid = clock.monotonic()  # time of the newest valid reading
+    load = None
+    async for tick in task.ticks(frequency):
+        now = clock.time()
+        watchdog.kick()
+        if watchdog.tripped is not None:
+            notify("Watchdog: %s: stopping the test" % watchdog.tripped)
+            return  # the motor is locked out
+        for command in commands.drain(task):
+            command()
+        if remote is not None and not applyCommands(
+                remote.drain(task), server, controller, now, notify, *limits):
+            return  # remote emergency stop
+        batch = stream.samples.drain(task)
+        if batch:
+            tValid = batch[-1][0]
+        elif clock.monotonic() - tValid > staleTimeout:
+            notify("No valid ADC reading for %.2f sec: stopping the test" %
+                   staleTimeout)
+            return  # the load is unknown; the motor is stopped by the caller
+        if not batch:
+            if controller.step(now) is None:  # timed states still advance
+                return  # the profile has finished
+            continue
+        for t, count in batch:  # filter every sample, even if behind
+            load = loop.loadFilter.update(loop.calibration.convert(count))
+            loop.gradient.update(load)
+        state = controller.step(now, load)
+        if state is None:
+            return  # the profile has finished
+        speed = controller.currentSpeed if motor.enabled else 0
+        await records.put((now, batch[-1][1], controller.load, speed,
+                           motor.direction, controller.cycleCount,
+                           len(batch), stream.failures, state))
+        if live is not None:
+            live.putNowait((now, controller.load, speed, state))
+
+
+async def log(task, loop, records, recorder, dashboard, controlTask,
+              tStart):
+    """
+    logging task: records every control cycle and updates the status
+    display, with the timing statistics of controlTask
+    """
+    controller = loop.controller
+    reads = 0
+    failedPrior = 0
+    async for (now, count, load, speed, direction, cycle, batch, failed,
+               state) in task.consume(records):
+        recorder.append(now, count, load, speed, direction, cycle,
+                        failed != failedPrior)
+        failedPrior = failed
+        reads += batch
+        tElapsed = now - tStart
+        timing = controlTask.stats()
+        errors = loop.adc.get_error_stats()
+        dashboard.update(
+            time=tElapsed, frequency=reads / tElapsed, reads=reads,
+            cycle=cycle, failed=(failed / (failed + reads)) * 100,
+            errors=(errors.bus_errors, errors.timeouts, errors.implausible),
+            state=controller.stateName(), load=load,
+            speed=controller.currentSpeed, status=controller.status,
+            gradient=loop.gradient.value,
+            latency=(timing.latency_p50 * 1e3, timing.latency_p99 * 1e3,
+                     timing.latency_max * 1e3),
+            work=(timing.work_p50 * 1e3, timing.work_p99 * 1e3,
+                  timing.work_max * 1e3),
+            overruns=timing.overruns)
+
+
+async def publish(task, live, telemetry):
+    """
+    telemetry task: sends the live samples from the event loop
+    """
+    async for tick in task.ticks(1 / telemetry.maxDelay):
+        for sample in live.drain(task):
+            telemetry.publish(*sample)
+        telemetry.flush()
+
+
+def addTasks(runtime, loop, stream, recorder, dashboard, telemetry=None,
+             server=None, limits=None, frequency=60, staleTimeout=0.5,
+             tStart=0.0):
+    """
+    adds the acquisition, control, logging, (with a command server)
+    command intake and (with a telemetry publisher) telemetry tasks and
+    their channels to the runtime; returns the channel of callables run by
+    the control task at its next tick
+    """
+    records = runtime.channel("records", 1024)  # for the recorder/display
+    live = runtime.channel("telemetry", 256, dropOldest=True) \
+        if telemetry is not None else None  # only the newest matters
+    commands = runtime.channel("commands", 16)
+    remote = runtime.channel("remote", 16) \
+        if server is not None else None  # received remote commands
+    runtime.task("acquire", stream.acquire)
+    if server is not None:
+        runtime.task("intake", intake, server, remote, frequency)
+    controlTask = runtime.task("control", control, loop, stream, commands,
+                               records, live, remote, server, limits,
+                               frequency, staleTimeout)
+    runtime.task("logging", log, loop, records, recorder, dashboard,
+                 controlTask, tStart)
+    if telemetry is not None:
+        runtime.task("telemetry", publish, live, telemetry)
+    return commands
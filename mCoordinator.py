@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Multi-actuator coordination: runs several actuator/load cell pairs (axes)
+from one fixed-rate loop (mScheduler.cLoopScheduler). Every axis has its
+own motor driver (on its own pins, mMotorDriver.PIN_MAPS), load cell
+channel, calibration, filter and controller (cLoadCycleController or a
+cProfileRunner with its own profile), so the axes run independent tests
+in the same phase.
+
+Every tick is done in batches so all axes see the same timing:
+    1. read the conversions started at the previous tick, back to back
+    2. start the next conversion on every MCP3424, converting in parallel
+       during the rest of the period
+    3. step every controller; the motor commands of the controllers and
+       ramps go to a cDeferredMotor and do not touch the GPIO yet
+    4. write the pin changes of all axes back to back
+Axes on different MCP3424 devices are sampled at every tick; axes sharing
+a device take turns, so each is sampled every n-th tick. The loop rate
+should therefore not exceed the sample rate of the ADC bitrate.
+
+Per axis the read to GPIO update latency (age of the reading when it is
+acted on), the controller work, reads and failures are recorded; the
+spread of the reads and of the GPIO updates within a tick shows how well
+the axes stay in phase. report() returns the statistics as a table. An
+axis without a valid reading for staleTimeout seconds is stopped.
+
+    coordinator = cCoordinator(50, clock)
+    for i, profile in enumerate(profiles):
+        axis = coordinator.axis("A%i" % (i + 1), cMotorDriver(pins=PIN_MAPS[i]),
+                                adcs[i], 1, calibration, acceleration=50)
+        axis.controller = cProfileRunner(loadProfile(profile), axis.motor,
+                                         pid=cPID(1, 0.5), ramp=axis.ramp)
+    coordinator.run()
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import threading
+import time
+
+from mRamp import cRampGenerator
+from mScheduler import cLatencyHistogram, cLoopScheduler
+
+# Per-axis metrics; times in seconds
+AxisStats = collections.namedtuple('AxisStats', [
+    'name', 'reads', 'failures', 'writes', 'state', 'load',
+    'age_p50', 'age_p99', 'age_max',
+    'work_p50', 'work_p99', 'work_max'])
+
+
+class cDeferredMotor:
+    """
+    stand-in for the cMotorDriver of an axis, given to its controller and
+    ramp generator: the requested pin states are only recorded and flush()
+    writes the changes to the driver with one apply() (in its safe order)
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.enabled = driver.enabled
+        self.direction = driver.direction
+        self.speed = driver.speed
+        self.lock = threading.RLock()
+
+    def setEnable(self, enabled=0):
+        self.enabled = 1 if enabled == 1 else 0
+
+    def toggleSleep(self):
+        self.enabled = 1 - self.enabled
+
+    def setForward(self):
+        self.direction = 1
+
+    def setBackward(self):
+        self.direction = 0
+
+    def toggleDirection(self):
+        self.direction = 1 - self.direction
+
+    def setSpeed(self, speed=0):
+        self.speed = speed if 0 <= speed <= 100 else 0
+
+    def apply(self, direction, speed, enabled):
+        self.direction = 1 if direction == 1 else 0
+        self.setSpeed(speed)
+        self.setEnable(enabled)
+
+    def flush(self):
+        """
+        write the requested state to the driver; returns True if it changed
+        """
+        driver = self.driver
+        if (self.enabled == driver.enabled and
+                self.direction == driver.direction and
+                self.speed == driver.speed):
+            return False
+        driver.apply(self.direction, self.speed, self.enabled)
+        return True
+
+
+class cAxis:
+    """
+    one actuator/load cell pair of a cCoordinator. The controller must be
+    built on axis.motor (and axis.ramp, if any) before the coordinator runs.
+    """
+
+    def __init__(self, name, driver, adc, channel, calibration,
+                 loadFilter=None, acceleration=None, clock=time):
+        self.name = name
+        self.driver = driver            # cMotorDriver of the actuator
+        self.motor = cDeferredMotor(driver)
+        self.adc = adc                  # ADCDifferentialPi of the load cell
+        self.channel = channel
+        self.calibration = calibration  # cChannelCalibration (volts to kg)
+        self.loadFilter = loadFilter    # e.g. mFilter.cFilterChain or None
+        # slew rate limit, advanced by the coordinator instead of a thread
+        self.ramp = cRampGenerator(self.motor, acceleration, clock=clock) \
+            if acceleration else None
+        self.controller = None
+        self.state = None       # last state (or step index) of the controller
+        self.load = None        # last filtered, calibrated reading
+        self.volts = None       # last raw reading (V)
+        self.finished = False   # the test of the axis has ended
+        self.reads = 0
+        self.failures = 0
+        self.lastError = None
+        self.tValid = None      # clock time of the newest valid reading
+        self.age = cLatencyHistogram()   # reading to GPIO update (us)
+        self.work = cLatencyHistogram()  # controller step (us)
+
+    def halt(self):
+        """
+        stop the actuator at once, bypassing the deferred updates
+        """
+        if self.ramp is not None:
+            self.ramp.brake()
+        self.motor.setEnable(enabled=0)
+        self.driver.setEnable(enabled=0)
+
+    def stats(self):
+        age = self.age
+        work = self.work
+        return AxisStats(self.name, self.reads, self.failures,
+                         self.driver.writes, self.state, self.load,
+                         age.percentile(50) / 1e6, age.percentile(99) / 1e6,
+                         age.max / 1e6,
+                         work.percentile(50) / 1e6, work.percentile(99) / 1e6,
+                         work.max / 1e6)
+
+
+class cCoordinator:
+    def __init__(self, frequency, clock=time, priority=None, cpu=None,
+                 staleTimeout=0.5, onEvent=None):
+        self.clock = clock
+        self.scheduler = cLoopScheduler(frequency, clock, priority, cpu)
+        self.staleTimeout = staleTimeout  # stop an axis without readings (sec)
+        self.onEvent = onEvent  # called with messages, e.g. a stopped axis
+        self.axes = []
+        # first to last read and GPIO update of the ticks with several (us)
+        self.readSkew = cLatencyHistogram()
+        self.updateSkew = cLatencyHistogram()
+        self.__devices = []   # [adc, axes on it, axis converting, mode]
+        self.__tStart = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __event(self, message):
+        if self.onEvent is not None:
+            self.onEvent(message)
+
+    def axis(self, name, driver, adc, channel, calibration, loadFilter=None,
+             acceleration=None):
+        """
+        add an actuator/load cell pair; returns its cAxis
+        """
+        for axis in self.axes:
+            if set(axis.driver.pinAssign) & set(driver.pinAssign):
+                raise ValueError("cCoordinator: %s shares motor pins with %s"
+                                 % (name, axis.name))
+            if axis.adc is adc and axis.channel == channel:
+                raise ValueError("cCoordinator: %s shares ADC channel %i "
+                                 "with %s" % (name, channel, axis.name))
+        axis = cAxis(name, driver, adc, channel, calibration, loadFilter,
+                     acceleration, self.clock)
+        self.axes.append(axis)
+        for device in self.__devices:
+            if device[0] is adc:
+                device[1].append(axis)
+                break
+        else:
+            self.__devices.append([adc, [axis], None, None])
+        return axis
+
+    def __startConversions(self, tick):
+        # start the next conversion on every device (round robin per device)
+        for device in self.__devices:
+            adc, axes = device[0], device[1]
+            running = [axis for axis in axes if not axis.finished]
+            if not running:
+                device[2] = None
+                continue
+            axis = running[tick % len(running)]
+            try:
+                adc.start_conversion(axis.channel)
+                device[2] = axis
+            except (IOError, OSError) as err:  # retried by the driver
+                axis.failures += 1
+                axis.lastError = err
+                device[2] = None
+
+    def __readConversions(self):
+        # collect the conversions started at the previous tick; returns the
+        # axes with a new reading
+        clock = self.clock
+        fresh = []
+        times = []
+        for device in self.__devices:
+            adc, axis = device[0], device[2]
+            if axis is None:
+                continue
+            try:
+                volts = adc.read_conversion(axis.channel)
+            except (IOError, OSError) as err:  # bus error, timeout, implausible
+                axis.failures += 1
+                axis.lastError = err
+                continue
+            now = clock.monotonic()
+            load = axis.calibration.convertVolts(volts)
+            if axis.loadFilter is not None:
+                load = axis.loadFilter.update(load)
+            axis.volts = volts
+            axis.load = load
+            axis.tValid = now
+            axis.reads += 1
+            fresh.append(axis)
+            times.append(now)
+        if len(times) > 1:
+            self.readSkew.record((times[-1] - times[0]) * 1e6)
+        return fresh
+
+    def start(self):
+        """
+        start the controllers and the first conversions
+        """
+        for axis in self.axes:
+            if axis.controller is None:
+                raise ValueError("cCoordinator: axis %s has no controller"
+                                 % axis.name)
+        now = self.clock.time()
+        self.__tStart = self.clock.monotonic()
+        for device in self.__devices:
+            device[3] = device[0].get_conversion_mode()
+            device[0].set_conversion_mode(0)  # one-shot, started per tick
+        for axis in self.axes:
+            axis.finished = False
+            axis.tValid = self.__tStart
+            axis.controller.start(now)
+        self.__startConversions(0)
+        self.scheduler.start()
+
+    def tick(self, tick):
+        """
+        read, control and update every axis once; returns False when all
+        axes have finished
+        """
+        clock = self.clock
+        monotonic = clock.monotonic
+        fresh = self.__readConversions()
+        self.__startConversions(tick)
+        now = clock.time()
+        for axis in self.axes:
+            if axis.finished:
+                continue
+            tWork = monotonic()
+            if tWork - axis.tValid <= self.staleTimeout:
+                # without a new reading timed states still advance
+                axis.state = axis.controller.step(
+                    now, axis.load if axis in fresh else None)
+            else:
+                self.__event("%s: no valid ADC reading for %.2f sec (%s): "
+                             "stopping the axis" % (axis.name,
+                                                    self.staleTimeout,
+                                                    axis.lastError))
+                axis.state = None
+            if axis.state is None:  # the test (profile) of the axis ended
+                axis.finished = True
+                axis.halt()
+            elif axis.ramp is not None:
+                axis.ramp.update(monotonic())
+            axis.work.record((monotonic() - tWork) * 1e6)
+        updates = []
+        for axis in self.axes:
+            if axis.motor.flush():
+                updates.append(monotonic())
+            if axis in fresh:  # the reading has been acted on
+                axis.age.record((monotonic() - axis.tValid) * 1e6)
+        if len(updates) > 1:
+            self.updateSkew.record((updates[-1] - updates[0]) * 1e6)
+        return not all(axis.finished for axis in self.axes)
+
+    def run(self, duration=None, onTick=None):
+        """
+        run all axes until every test has finished or for duration seconds
+        (None = no limit); the motors are always stopped at the end.
+        onTick(tick) is called after every tick, e.g. to record the axes
+        """
+        self.start()
+        try:
+            while True:
+                tick = self.scheduler.wait()
+                if duration is not None and \
+                        self.clock.monotonic() - self.__tStart >= duration:
+                    break
+                if not self.tick(tick):
+                    break
+                if onTick is not None:
+                    onTick(tick)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        stop every actuator and restore the conversion modes of the ADCs
+        """
+        for axis in self.axes:
+            axis.halt()
+        for device in self.__devices:
+            if device[3] is not None:
+                device[0].set_conversion_mode(device[3])
+                device[3] = None
+
+    def stats(self):
+        """
+        returns the LoopStats of the loop and the AxisStats of every axis
+        """
+        return self.scheduler.stats(), [axis.stats() for axis in self.axes]
+
+    def report(self):
+        """
+        returns the loop, per-axis and phase statistics as a printable table
+        """
+        loop, axes = self.stats()
+        lines = ["Loop: %i ticks at %.1f Hz, %i overruns, latency p50/p99/max "
+                 "%.2f/%.2f/%.2f ms, work %.2f/%.2f/%.2f ms" % (
+                     loop.iterations, loop.frequency, loop.overruns,
+                     loop.latency_p50 * 1e3, loop.latency_p99 * 1e3,
+                     loop.latency_max * 1e3, loop.work_p50 * 1e3,
+                     loop.work_p99 * 1e3, loop.work_max * 1e3),
+                 "%-8s %8s %6s %7s  %-23s %-23s" % (
+                     "Axis", "Reads", "Fail", "Writes",
+                     "Age p50/p99/max ms", "Work p50/p99/max ms")]
+        for s in axes:
+            lines.append("%-8s %8i %6i %7i  %6.2f/%6.2f/%8.2f  %6.3f/%6.3f/"
+                         "%8.3f" % (s.name, s.reads, s.failures, s.writes,
+                                    s.age_p50 * 1e3, s.age_p99 * 1e3,
+                                    s.age_max * 1e3, s.work_p50 * 1e3,
+                                    s.work_p99 * 1e3, s.work_max * 1e3))
+        for name, skew in (("reads", self.readSkew),
+                           ("GPIO updates", self.updateSkew)):
+            lines.append("Spread of the %s in a tick p50/p99/max: "
+                         "%.3f/%.3f/%.3f ms" % (
+                             name, skew.percentile(50) / 1e3,
+                             skew.percentile(99) / 1e3, skew.max / 1e3))
+        return "\n".join(lines)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Non-blocking status display. The control loop publishes a snapshot of its
+state with update() (a single reference assignment) and posts occasional
+messages with log(); a daemon thread redraws the screen at a fixed rate
+using ANSI escape sequences. Slow terminals (e.g. SSH) therefore only
+delay the display thread, never the control loop.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import sys
+import threading
+import time
+
+HOME = "\x1b[H"               # move the cursor to the top left corner
+CLEAR_SCREEN = "\x1b[2J"      # erase the whole screen
+CLEAR_LINE = "\x1b[K"         # erase to the end of the line
+CLEAR_BELOW = "\x1b[J"        # erase to the end of the screen
+
+
+class cDashboard:
+    """
+    fields is a list of (label, key, format) tuples; each refresh prints
+    one "label : value" line per field from the latest snapshot, followed
+    by the most recent log messages.
+    """
+
+    def __init__(self, title, fields, rate=5.0, messages=5, out=None):
+        self.title = title
+        self.fields = list(fields)
+        self.rate = rate  # screen refreshes per second
+        self.out = sys.stdout if out is None else out
+        self.frames = 0   # number of screens drawn
+        self.__messages = collections.deque(maxlen=messages)
+        self.__snapshot = {}
+        self.__width = max([len(label) for label, key, fmt in self.fields]
+                           + [0])
+        self.__running = False
+        self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def update(self, **values):  # publish a new snapshot (non-blocking)
+        self.__snapshot = values
+
+    def log(self, message):  # add a message below the status (non-blocking)
+        self.__messages.append(message)
+
+    def render(self):  # returns the current screen as a string
+        snapshot = self.__snapshot
+        lines = [self.title]
+        for label, key, fmt in self.fields:
+            value = snapshot.get(key)
+            if value is None:
+                text = "-"
+            else:
+                try:
+                    text = fmt % value
+                except (TypeError, ValueError):
+                    text = str(value)
+            lines.append(label.ljust(self.__width) + " : " + text)
+        if self.__messages:
+            lines.append("")
+            lines.extend(list(self.__messages))
+        return HOME + (CLEAR_LINE + "\n").join(lines) + CLEAR_LINE + "\n" + \
+            CLEAR_BELOW
+
+    def __run(self):
+        period = 1.0 / self.rate
+        dueTime = time.monotonic()
+        self.out.write(CLEAR_SCREEN)
+        while self.__running:
+            self.out.write(self.render())
+            self.out.flush()
+            self.frames += 1
+            dueTime += period
+            delay = dueTime - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:  # the terminal is too slow; skip the missed frames
+                dueTime = time.monotonic()
+
+    def start(self):
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="Dashboard")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):  # stop the display thread after drawing a final frame
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+            self.out.write(self.render())
+            self.out.flush()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Streaming filters for the load signal, placed between the ADC stream and
+the controller:
+    cMovingAverage   mean of the last window samples
+    cExponential     first order low-pass (exponential moving average)
+    cMedian          median of the last window samples (rejects spikes)
+    cSavitzkyGolay   least squares polynomial fit over the last window
+                     samples; smoothed value or derivative (e.g. kg/s) at
+                     the newest sample, so it adds no delay
+    cFilterChain     filters applied in series
+
+Every filter keeps its state between calls and offers update(x), which
+filters one sample in pure Python, and process(values), which filters a
+batch (e.g. from ADCStream.drain_arrays) with numpy and returns a numpy
+array. Both give the same result and can be mixed. Until a filter has
+seen a full window it works on the samples available so far.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import bisect
+import collections
+import math
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # only required by the batch (process) functions
+
+
+def _asArray(values):
+    if numpy is None:
+        raise ImportError("numpy not found")
+    return numpy.asarray(values, dtype=float)
+
+
+def _windows(history, x, window):
+    # sliding windows over the full history followed by the new samples
+    data = numpy.concatenate((numpy.asarray(history, dtype=float), x))
+    return numpy.lib.stride_tricks.sliding_window_view(data, window)
+
+
+class cMovingAverage:
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError("cMovingAverage: window must be at least 1")
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.value = None  # latest output
+        self.__buffer = collections.deque(maxlen=self.window)
+        self.__sum = 0.0
+        self.__count = 0   # samples since the sum was recomputed
+
+    def update(self, x):
+        buffer = self.__buffer
+        if len(buffer) == self.window:
+            self.__sum -= buffer[0]
+        buffer.append(x)
+        self.__count += 1
+        if self.__count >= self.window:  # limit the rounding drift
+            self.__sum = math.fsum(buffer)
+            self.__count = 0
+        else:
+            self.__sum += x
+        self.value = self.__sum / len(buffer)
+        return self.value
+
+    def process(self, values):
+        x = _asArray(values)
+        head = []
+        while len(self.__buffer) < self.window - 1 and len(head) < len(x):
+            head.append(self.update(x[len(head)]))  # filling the window
+        x = x[len(head):]
+        if len(x) == 0:
+            return numpy.array(head, dtype=float)
+        history = list(self.__buffer)[1 - self.window:] \
+            if self.window > 1 else []
+        data = numpy.concatenate((numpy.asarray(history, dtype=float), x))
+        total = numpy.concatenate(([0.0], numpy.cumsum(data)))
+        out = (total[self.window:] - total[:-self.window]) / self.window
+        self.__buffer.extend(x[-self.window:].tolist())
+        self.__sum = math.fsum(self.__buffer)
+        self.__count = 0
+        self.value = float(out[-1])
+        return numpy.concatenate((head, out))
+
+
+class cExponential:
+    """
+    y += alpha * (x - y); alpha = dt / (timeConstant + dt) for a time
+    constant, or give alpha directly
+    """
+
+    def __init__(self, alpha=None, timeConstant=None, dt=None):
+        if alpha is None:
+            alpha = dt / (timeConstant + dt)
+        if not 0 < alpha <= 1:
+            raise ValueError("cExponential: alpha must be in (0, 1]")
+        self.alpha = alpha
+        # longest batch block for which decay**-n stays well within range
+        decay = 1.0 - alpha
+        self.__block = int(100 / -math.log(decay)) if decay > 0 else 0
+        self.reset()
+
+    def reset(self):
+        self.value = None  # latest output; the first sample initialises it
+
+    def update(self, x):
+        if self.value is None:
+            self.value = float(x)
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def process(self, values):
+        x = _asArray(values)
+        out = numpy.empty(len(x))
+        if len(x) == 0:
+            return out
+        start = 0
+        if self.value is None:
+            out[0] = self.update(x[0])
+            start = 1
+        if self.__block == 0:  # alpha = 1: no filtering
+            out[start:] = x[start:]
+        else:
+            alpha = self.alpha
+            decay = 1.0 - alpha
+            y = self.value
+            # y[n] = decay**(n+1) * y[-1] + alpha * sum(decay**(n-k) * x[k])
+            for i in range(start, len(x), self.__block):
+                block = x[i:i + self.__block]
+                k = numpy.arange(len(block))
+                power = decay ** k
+                out[i:i + len(block)] = decay * power * y + alpha * power * \
+                    numpy.cumsum(block / power)
+                y = out[i + len(block) - 1]
+        self.value = float(out[-1])
+        return out
+
+
+class cMedian:
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError("cMedian: window must be at least 1")
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.value = None  # latest output
+        self.__buffer = collections.deque(maxlen=self.window)
+        self.__sorted = []
+
+    def update(self, x):
+        buffer = self.__buffer
+        ordered = self.__sorted
+        if len(buffer) == self.window:
+            del ordered[bisect.bisect_left(ordered, buffer[0])]
+        buffer.append(x)
+        bisect.insort(ordered, x)
+        n = len(ordered)
+        middle = n // 2
+        self.value = ordered[middle] if n % 2 else \
+            (ordered[middle - 1] + ordered[middle]) / 2.0
+        return self.value
+
+    def process(self, values):
+        x = _asArray(values)
+        head = []
+        while len(self.__buffer) < self.window - 1 and len(head) < len(x):
+            head.append(self.update(x[len(head)]))  # filling the window
+        x = x[len(head):]
+        if len(x) == 0:
+            return numpy.array(head, dtype=float)
+        history = list(self.__buffer)[1 - self.window:] \
+            if self.window > 1 else []
+        out = numpy.median(_windows(history, x, self.window), axis=1)
+        self.__buffer.extend(x[-self.window:].tolist())
+        self.__sorted = sorted(self.__buffer)
+        self.value = float(out[-1])
+        return numpy.concatenate((head, out))
+
+
+def savitzkyGolayCoefficients(window, order=2, derivative=0, dt=1.0):
+    """
+    returns the weights (oldest sample first) that give the order-th
+    degree least squares fit over window samples spaced dt apart, or its
+    derivative, at the newest sample
+    """
+    order = min(order, window - 1)
+    if derivative > order:
+        return [0.0] * window
+    # normal equations of the fit in t = -(window - 1) .. 0 (samples)
+    ts = range(1 - window, 1)
+    n = order + 1
+    matrix = [[float(sum(t ** (i + j) for t in ts)) for j in range(n)] +
+              [1.0 if i == derivative else 0.0] for i in range(n)]
+    for col in range(n):  # Gauss-Jordan elimination with pivoting
+        pivot = max(range(col, n), key=lambda row: abs(matrix[row][col]))
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        for row in range(n):
+            if row != col:
+                factor = matrix[row][col] / matrix[col][col]
+                matrix[row] = [a - factor * b for a, b in
+                               zip(matrix[row], matrix[col])]
+    h = [matrix[i][n] / matrix[i][i] for i in range(n)]
+    scale = math.factorial(derivative) / dt ** derivative
+    return [scale * sum(h[j] * t ** j for j in range(n)) for t in ts]
+
+
+class cSavitzkyGolay:
+    """
+    derivative=0 smooths, derivative=1 gives the slope per second when dt
+    is the sample period (sec)
+    """
+
+    def __init__(self, window, order=2, derivative=1, dt=1.0):
+        if window < 1:
+            raise ValueError("cSavitzkyGolay: window must be at least 1")
+        self.window = window
+        self.order = order
+        self.derivative = derivative
+        self.dt = dt
+        # weights for every fill level of the window during start-up
+        self.coefficients = [savitzkyGolayCoefficients(n, order, derivative,
+                                                       dt)
+                             for n in range(1, window + 1)]
+        self.reset()
+
+    def reset(self):
+        self.value = None  # latest output
+        self.__buffer = collections.deque(maxlen=self.window)
+
+    def update(self, x):
+        buffer = self.__buffer
+        buffer.append(x)
+        self.value = sum(map(operator.mul,
+                             self.coefficients[len(buffer) - 1], buffer))
+        return self.value
+
+    def process(self, values):
+        x = _asArray(values)
+        head = []
+        while len(self.__buffer) < self.window - 1 and len(head) < len(x):
+            head.append(self.update(x[len(head)]))  # filling the window
+        x = x[len(head):]
+        if len(x) == 0:
+            return numpy.array(head, dtype=float)
+        history = list(self.__buffer)[1 - self.window:] \
+            if self.window > 1 else []
+        out = _windows(history, x, self.window).dot(
+            numpy.asarray(self.coefficients[-1]))
+        self.__buffer.extend(x[-self.window:].tolist())
+        self.value = float(out[-1])
+        return numpy.concatenate((head, out))
+
+
+class cFilterChain:
+    def __init__(self, *filters):
+        self.filters = filters
+        self.value = None  # latest output
+
+    def reset(self):
+        self.value = None
+        for f in self.filters:
+            f.reset()
+
+    def update(self, x):
+        for f in self.filters:
+            x = f.update(x)
+        self.value = x
+        return x
+
+    def process(self, values):
+        x = _asArray(values)
+        for f in self.filters:
+            x = f.process(x)
+        if len(x):
+            self.value = float(x[-1])
+        return x
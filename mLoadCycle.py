@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Non-blocking state machine for cyclic load tests. The actuator is first
+retracted, the zero load is measured and the actuator then cycles between
+the target (maximum) and minimum load, holding at each end for a set time:
+
+    RETRACT -> ZERO -> LOADING -> HOLD_MAX -> UNLOADING -> HOLD_MIN
+                          ^                                   |
+                          +-----------------------------------+
+
+step() is called once per control tick with the current time and the
+latest calibrated reading. It never sleeps: timed states end on a
+deadline, so sampling, recording and safety checks keep running at the
+full loop rate in every state. Motor changes on state entry go through
+cMotorDriver.apply(), so the direction is never reversed under power.
+When a cRampGenerator (mRamp.py) is supplied, speed changes are slew-rate
+limited by its thread instead; the holds still stop the motor at once.
+pause() stops the motor and freezes the state machine (deadlines are
+extended by the pause) until resume() restarts the stroke.
+
+The LOADING stroke either uses the original heuristic (add 1% or 2% PWM
+every gainInterval seconds while the load gradient is small) or, when a
+cPID is supplied, drives the duty cycle from the PID output on every
+sample and holds once the load is within targetTolerance of the target.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+
+RETRACT, ZERO, LOADING, HOLD_MAX, UNLOADING, HOLD_MIN = range(6)
+STATE_NAMES = ("RETRACT", "ZERO", "LOADING", "HOLD_MAX", "UNLOADING",
+               "HOLD_MIN")
+
+
+class cLoadCycleController:
+    def __init__(self, motor, targetLoad=70, minimumLoad=2, holdTime=10,
+                 startSpeed=9, retractTime=4.5, settleTime=1.0,
+                 zeroSamples=100, gainInterval=2.0, onEvent=None, pid=None,
+                 targetTolerance=0.5, ramp=None):
+        self.motor = motor
+        self.targetLoad = targetLoad      # maximum load of a cycle (kg)
+        self.minimumLoad = minimumLoad    # minimum/contact load (kg)
+        self.holdTime = holdTime          # dwell at either end (sec)
+        self.startSpeed = startSpeed      # PWM% at the start of a stroke
+        self.retractTime = retractTime    # initial retraction (sec)
+        self.settleTime = settleTime      # pause before zeroing (sec)
+        self.zeroSamples = zeroSamples    # readings averaged for the zero
+        self.gainInterval = gainInterval  # time between gain steps (sec)
+        self.onEvent = onEvent            # callback for status messages
+        self.pid = pid                    # cPID for the loading stroke
+        self.targetTolerance = targetTolerance  # PID hold band (kg)
+        self.ramp = ramp                  # cRampGenerator or None
+        self.state = None
+        self.deadline = None      # end time of a timed state
+        self.zeroLoad = 0.0       # zero/bias load subtracted from readings
+        self.load = 0.0           # latest zeroed load (kg)
+        self.currentSpeed = startSpeed
+        self.cycleCount = 0       # completed or started load cycles
+        self.status = ""
+        self.paused = False
+        self.__tPaused = 0.0
+        self.__driving = None     # (direction, speed) while the motor runs
+        self.__zeroSum = 0.0
+        self.__zeroCount = 0
+        self.__tPrior = 0.0       # time of the last gain check
+        self.__loadPrior = 0.0    # load at the last gain step
+        self.__handlers = (self.__retract, self.__zero, self.__loading,
+                           self.__holdMax, self.__unloading, self.__holdMin)
+
+    def __event(self, message):
+        self.status = message
+        if self.onEvent is not None:
+            self.onEvent(message)
+
+    def __drive(self, direction, speed):
+        # run the motor, ramping to the speed if a ramp generator is used
+        self.__driving = (direction, speed)
+        if self.ramp is not None:
+            self.ramp.setTarget(speed, direction)
+        else:
+            self.motor.apply(direction=direction, speed=speed, enabled=1)
+
+    def __setSpeed(self, speed):
+        if self.__driving is not None:
+            self.__driving = (self.__driving[0], speed)
+        if self.ramp is not None:
+            self.ramp.setTarget(speed)
+        else:
+            self.motor.setSpeed(speed)
+
+    def __halt(self):
+        # stop the motor immediately
+        self.__driving = None
+        if self.ramp is not None:
+            self.ramp.brake()
+        else:
+            self.motor.setEnable(enabled=0)
+
+    def __enter(self, state, now):
+        # perform the entry actions of a state
+        self.state = state
+        self.deadline = None
+        if state == RETRACT:
+            self.__drive(0, self.startSpeed)
+            self.deadline = now + self.retractTime
+            self.__event("Retract the motor")
+        elif state == ZERO:
+            self.__zeroSum = 0.0
+            self.__zeroCount = 0
+            self.__event("Calculate the zero load on the load cell")
+        elif state == LOADING:
+            self.currentSpeed = self.startSpeed
+            self.__loadPrior = self.load
+            self.__tPrior = now + self.gainInterval  # no gain straight away
+            self.cycleCount += 1
+            if self.pid is not None:
+                self.pid.reset()
+            self.__drive(1, self.currentSpeed)
+            self.__event("Go forward. Target load (max) not reached")
+        elif state == HOLD_MAX:
+            self.__halt()
+            self.deadline = now + self.holdTime
+            self.__event("Stop going forward. Target load (max) reached; "
+                         "motor speed %% = %.1f" % self.currentSpeed)
+        elif state == UNLOADING:
+            self.currentSpeed = self.startSpeed
+            self.__drive(0, self.currentSpeed)
+            self.__event("Go backward. Target load (min) not reached")
+        elif state == HOLD_MIN:
+            self.__halt()
+            self.deadline = now + self.holdTime
+            self.__event("Stop going backward. Target load (min) reached")
+
+    def __retract(self, now, load):
+        if now >= self.deadline:
+            if self.motor.enabled:  # retraction done; let the system settle
+                self.__halt()
+                self.deadline = now + self.settleTime
+            else:
+                self.__enter(ZERO, now)
+
+    def __zero(self, now, load):
+        if load is None:
+            return
+        self.__zeroSum += load
+        self.__zeroCount += 1
+        if self.__zeroCount >= self.zeroSamples:
+            self.zeroLoad = self.__zeroSum / self.__zeroCount
+            self.load = 0.0
+            self.__event("Zero load = " + str(round(self.zeroLoad, 3)) +
+                         " [kg]")
+            self.__enter(LOADING, now)
+
+    def __loading(self, now, load):
+        if load is None:
+            return
+        if self.pid is not None:
+            if self.load >= self.targetLoad - self.targetTolerance:
+                self.__enter(HOLD_MAX, now)
+            else:
+                self.currentSpeed = self.pid.update(now, self.targetLoad,
+                                                    self.load)
+                self.__setSpeed(self.currentSpeed)
+        elif self.load > self.targetLoad:
+            self.__enter(HOLD_MAX, now)
+        elif (self.__tPrior + self.gainInterval) < now:
+            # add power every gainInterval seconds, only if:
+            #   the gradient is small
+            #   actuator contact is established
+            #   current load is far enough away from the target load
+            self.__tPrior = now
+            if (((self.load - self.__loadPrior) < 1) and
+                    (self.load > self.minimumLoad) and
+                    (self.load < self.targetLoad - 5)):
+                self.currentSpeed += 1 if self.load < 50 else 2
+                self.__setSpeed(self.currentSpeed)
+                self.__loadPrior = self.load
+                self.__event("Go forward. " + str(self.currentSpeed) +
+                             "% speed after gain")
+
+    def __holdMax(self, now, load):
+        if now >= self.deadline:
+            self.__enter(UNLOADING, now)
+
+    def __unloading(self, now, load):
+        if load is not None and self.load <= self.minimumLoad:
+            self.__enter(HOLD_MIN, now)
+
+    def __holdMin(self, now, load):
+        if now >= self.deadline:
+            self.__enter(LOADING, now)
+
+    def start(self, now):
+        """
+        begin the test by retracting the actuator
+        """
+        self.cycleCount = 0
+        self.__enter(RETRACT, now)
+
+    def step(self, now, load=None):
+        """
+        advance the state machine; load is the latest calibrated (not
+        zeroed) reading in kg, or None when no new valid reading is
+        available. Returns the current state.
+        """
+        if load is not None and self.state != ZERO:
+            self.load = load - self.zeroLoad
+        if not self.paused:
+            self.__handlers[self.state](now, load)
+        return self.state
+
+    def pause(self, now):
+        """
+        stop the motor and freeze the test until resume()
+        """
+        if self.paused:
+            return
+        driving = self.__driving
+        self.__halt()
+        self.__driving = driving  # restarted by resume()
+        self.paused = True
+        self.__tPaused = now
+        self.__event("Paused")
+
+    def resume(self, now):
+        """
+        continue a paused test; deadlines are extended by the pause
+        """
+        if not self.paused:
+            return
+        self.paused = False
+        pause = now - self.__tPaused
+        if self.deadline is not None:
+            self.deadline += pause
+        self.__tPrior += pause
+        if self.pid is not None:
+            self.pid.reset()
+        if self.__driving is not None:
+            self.__drive(*self.__driving)
+        self.__event("Resumed")
+
+    def gradient(self):  # load change since the last gain step (kg/s)
+        return (self.load - self.__loadPrior) / self.gainInterval
+
+    def stateName(self):
+        return STATE_NAMES[self.state] if self.state is not None else ""
@@ -6,6 +6,22 @@ ABElectronics ADC Differential Pi 8-Channel ADC
 Requires python smbus or smbus2 to be installed
 https://github.com/abelectronicsuk/ABElectronics_Python_Libraries
 
+Read errors are raised as subclasses of ADCError (an IOError):
+    BusError           an i2c transaction failed (NACK / remote I/O error)
+                       after the retries of the RetryPolicy
+    ConversionTimeout  no conversion completed within the timeout, also a
+                       TimeoutError
+    ImplausibleValue   the conversion was clipped at full scale or lies
+                       outside the range set with set_plausible_range
+Every error is counted, see get_error_stats.
+
+Oversampling (set_oversampling) reads ratio consecutive conversions, e.g.
+at 12 bit, and decimates them into one output sample with an average or a
+CIC (sinc^order) filter. read_raw, read_count and read_voltage then return
+the decimated samples at the resolution of get_output_profile;
+get_oversampling reports the effective resolution, output rate and delay.
+The resolution gain assumes the noise spans at least one lsb (dither).
+
 Modified by Andre Broekman 2020/05/13
 ================================================
 """
@@ -18,10 +34,136 @@ except ImportError:
     try:
         from smbus import SMBus
     except ImportError:
-        raise ImportError("python-smbus or smbus2 not found")
+        SMBus = None  # only required when no bus instance is supplied
+import math
+import operator
 import re
 import platform
 import time
+from array import array
+from collections import deque, namedtuple
+
+
+# Frozen decode profile for the current bitrate and PGA setting; rebuilt by
+# set_bit_rate/set_pga so that read_raw/read_voltage do no per-sample lookups
+DecodeProfile = namedtuple('DecodeProfile', [
+    'bitrate',             # 12, 14, 16 or 18
+    'length',              # number of bytes in the i2c block read
+    'cmd_index',           # index of the command/config byte in the block
+    'high_mask',           # mask applied to the upper data byte
+    'sign_mask',           # sign bit of the combined raw value
+    'value_mask',          # raw value with the sign bit cleared
+    'scale',               # volts per count (lsb / pga)
+    'offset',              # full scale offset subtracted for negative values
+    'seconds_per_sample',  # nominal conversion time
+    'timeout',             # maximum time to wait for a conversion
+    'poll_interval',       # first backoff between polls of a late result
+    'max_poll_interval',   # upper bound of the polling backoff
+])
+
+# Polling statistics of the deadline aware conversion wait
+PollStats = namedtuple('PollStats', ['samples', 'polls', 'polls_per_sample'])
+
+# Error counters of the read path: failed i2c transactions, conversion
+# timeouts, implausible conversions and retries issued by the RetryPolicy
+ErrorStats = namedtuple('ErrorStats', ['bus_errors', 'timeouts',
+                                       'implausible', 'retries'])
+
+# Retry policy of the read path: a failed i2c transaction or a conversion
+# timeout is retried up to retries times, sleeping backoff seconds before the
+# first retry and factor times longer before each next one (at most
+# max_backoff)
+RetryPolicy = namedtuple('RetryPolicy', ['retries', 'backoff', 'factor',
+                                         'max_backoff'])
+DEFAULT_RETRY_POLICY = RetryPolicy(2, 0.001, 2.0, 0.01)
+
+
+class ADCError(IOError):
+    """
+    base class of the read errors; channel is the channel being read
+    """
+
+    def __init__(self, message, channel=None):
+        super(ADCError, self).__init__(message)
+        self.channel = channel
+
+
+class BusError(ADCError):
+    """
+    an i2c transaction failed (NACK) after all retries
+    """
+
+
+class ConversionTimeout(ADCError, TimeoutError):
+    """
+    the conversion did not complete within the timeout of the profile
+    """
+
+
+class ImplausibleValue(ADCError):
+    """
+    the conversion is clipped or out of the plausible range; value holds
+    the rejected voltage
+    """
+
+    def __init__(self, message, channel=None, value=None):
+        super(ImplausibleValue, self).__init__(message, channel)
+        self.value = value
+
+
+# Oversampling setting: decimation ratio, filter ('average' or 'cic'), CIC
+# order, effective resolution (bits, white noise), output sample rate (SPS)
+# and group delay of the filter (sec)
+OversamplingInfo = namedtuple('OversamplingInfo', [
+    'ratio', 'filter', 'order', 'effective_bits', 'output_rate', 'delay'])
+
+
+def decimation_weights(ratio, filter='average', order=3):
+    """
+    returns the integer FIR weights of the decimation filter: a boxcar of
+    ratio samples for 'average', or order cascaded boxcars for 'cic'
+    (the impulse response of an order stage CIC decimator)
+    """
+    if ratio < 1:
+        raise ValueError('decimation_weights: ratio must be at least 1')
+    if filter == 'average':
+        order = 1
+    elif filter != 'cic' or order < 1:
+        raise ValueError('decimation_weights: unknown filter')
+    weights = [1]
+    for stage in range(order):
+        out = [0] * (len(weights) + ratio - 1)
+        for i, w in enumerate(weights):
+            for j in range(ratio):
+                out[i + j] += w
+        weights = out
+    return weights
+
+
+# bitrate: (length, cmd_index, high_mask, sign_bit, lsb, seconds_per_sample)
+_BITRATE_TABLE = {
+    12: (3, 2, 0x0F, 11, 0.0005, 0.00416),
+    14: (3, 2, 0x3F, 13, 0.000125, 0.01666),
+    16: (3, 2, 0xFF, 15, 0.00003125, 0.06666),
+    18: (4, 3, 0x03, 17, 0.0000078125, 0.26666),
+}
+
+
+def build_decode_profile(bitrate, pga):
+    """
+    returns the DecodeProfile for a bitrate (12, 14, 16 or 18) and
+    internal pga factor (0.5, 1.0, 2.0 or 4.0)
+    """
+    try:
+        length, cmd_index, high_mask, sign_bit, lsb, seconds_per_sample = \
+            _BITRATE_TABLE[bitrate]
+    except KeyError:
+        raise ValueError('build_decode_profile: rate out of range')
+    sign_mask = 1 << sign_bit
+    return DecodeProfile(bitrate, length, cmd_index, high_mask, sign_mask,
+                         sign_mask - 1, lsb / pga, 2.048 / (pga * 2),
+                         seconds_per_sample, 10 * seconds_per_sample,
+                         seconds_per_sample / 20, seconds_per_sample / 4)
 
 
 class ADCDifferentialPi:
@@ -39,12 +181,44 @@ class ADCDifferentialPi:
     __conversionmode = 1  # Conversion Mode
     __pga = float(0.5)  # current pga setting
     __lsb = float(0.0000078125)  # default lsb value for 18 bit
-    __signbit = 0  # stores the sign bit for the sampled value
+    __profile = build_decode_profile(18, 0.5)  # decode profile in use
+    __output = __profile  # profile of the returned (decimated) samples
+    __scale = __profile.scale  # volts per count of the returned samples
+    __collect_args = (__profile.length, __profile.cmd_index,
+                      __profile.high_mask, __profile.sign_mask,
+                      __profile.seconds_per_sample)  # see __update_profile
+    __fast_channel = 0x01  # channel read by the fast path, None = none
 
     # create byte array and fill with initial values to define size
     __adcreading = bytearray([0, 0, 0, 0])
 
     __bus = None
+    __clock = time  # provides monotonic() and sleep()
+
+    # deadline aware conversion wait
+    __ready_time = 0.0  # clock time at which the pending result is due
+    __samples = 0  # conversions collected
+    __polls = 0  # i2c block reads beyond the first of each conversion
+
+    # error handling
+    __retry = DEFAULT_RETRY_POLICY
+    __plausible = None  # (minimum, maximum, saturation) or None = no check
+    __count_limits = None  # accepted signed counts (low, high) or None
+    __bus_errors = 0  # failed i2c transactions
+    __timeouts = 0  # conversions that timed out
+    __implausible = 0  # conversions rejected as implausible
+    __retries = 0  # retries issued by the retry policy
+
+    # oversampling
+    __ratio = 1  # conversions per output sample, 1 = off
+    __filter = 'average'
+    __order = 1
+    __weights = None  # decimation FIR weights, oldest conversion first
+    __weight_sum = 1
+    __extra_bits = 0  # resolution added to the output samples
+    __gain_bits = 0.0  # theoretical resolution gain (white noise)
+    __history = None  # recent signed counts of the decimated channel
+    __history_channel = 0
 
     # local methods
 
@@ -81,6 +255,8 @@ class ADCDifferentialPi:
                         else:
                             i2c__bus = 1
                         break
+        if SMBus is None:
+            raise ImportError("python-smbus or smbus2 not found")
         try:
             return SMBus(i2c__bus)
         except IOError:
@@ -108,105 +284,506 @@ class ADCDifferentialPi:
                 elif channel == 4:  # bit 5 = 1, bit 6 = 1
                     self.__adc1_conf = self.__updatebyte(self.__adc1_conf,
                                                          0x9F, 0x60)
+                self.__update_fast()
         return
 
-    # init object with i2caddress, default is 0x68
-    def __init__(self, address=0x68, rate=18):
+    def __update_fast(self):
+        # internal method selecting the channel of the fast read path: the
+        # next continuous conversion of the current channel without
+        # oversampling
+        if self.__conversionmode == 1 and self.__weights is None:
+            self.__fast_channel = self.__adc1_channel
+        else:
+            self.__fast_channel = None
+
+    def __update_profile(self):
+        # internal method for rebuilding the decode profile
+        profile = build_decode_profile(self.__bitrate, self.__pga)
+        self.__profile = profile
+        # the fields read by __collect, unpacked once per conversion; the
+        # profile is only replaced here, so the two cannot drift apart
+        self.__collect_args = (profile.length, profile.cmd_index,
+                               profile.high_mask, profile.sign_mask,
+                               profile.seconds_per_sample)
+        self.__update_limits()
+        self.__update_output()
+
+    def __update_output(self):
+        # internal method for rebuilding the profile of the output samples
+        profile = self.__profile
+        self.__update_fast()
+        if self.__weights is None:
+            self.__output = profile
+            self.__scale = profile.scale
+            return
+        extra = self.__extra_bits
+        ratio = self.__ratio
+        sign_mask = profile.sign_mask << extra
+        self.__output = profile._replace(
+            bitrate=profile.bitrate + extra, sign_mask=sign_mask,
+            value_mask=sign_mask - 1, scale=profile.scale / (1 << extra),
+            seconds_per_sample=profile.seconds_per_sample * ratio,
+            timeout=profile.timeout * ratio)
+        self.__scale = self.__output.scale
+        self.__history = deque(maxlen=len(self.__weights))
+
+    def __update_limits(self):
+        # internal method converting the plausible range to signed counts
+        if self.__plausible is None:
+            self.__count_limits = None
+            return
+        minimum, maximum, saturation = self.__plausible
+        profile = self.__profile
+        low = -profile.sign_mask
+        high = profile.sign_mask - 1
+        if saturation:  # the full scale codes are clipped conversions
+            low += 1
+            high -= 1
+        if minimum is not None:
+            low = max(low, int(math.ceil(minimum / profile.scale)))
+        if maximum is not None:
+            high = min(high, int(math.floor(maximum / profile.scale)))
+        self.__count_limits = (low, high)
+
+    def __bus_call(self, func, *args):
+        # internal method for an i2c transaction, retried with backoff
+        # according to the retry policy when the bus reports an error
+        try:
+            return func(*args)
+        except (IOError, OSError) as err:
+            return self.__bus_retry(err, func, *args)
+
+    def __bus_retry(self, err, func, *args):
+        # internal method retrying an i2c transaction that failed with err;
+        # the read path calls the bus directly and only comes here on error
+        policy = self.__retry
+        backoff = policy.backoff
+        attempt = 0
+        while True:
+            self.__bus_errors += 1
+            if attempt >= policy.retries:
+                raise BusError('i2c transaction with 0x%02X failed: %s' %
+                               (self.__adc1_address, err))
+            attempt += 1
+            self.__retries += 1
+            self.__clock.sleep(backoff)
+            backoff = min(backoff * policy.factor, policy.max_backoff)
+            try:
+                return func(*args)
+            except (IOError, OSError) as retry_err:
+                err = retry_err
+
+    def __restart_conversion(self):
+        # internal method called whenever a conversion is (re)started
+        self.__ready_time = (self.__clock.monotonic() +
+                             self.__profile.seconds_per_sample)
 
-        self.__bus = self.__get_smbus()
+    # init object with i2caddress, default is 0x68
+    # an smbus compatible bus object can be supplied instead of the system
+    # bus and a clock object (monotonic and sleep) instead of the time module
+    def __init__(self, address=0x68, rate=18, bus=None, clock=None):
+
+        if bus is None:
+            bus = self.__get_smbus()
+        self.__bus = bus
+        if clock is not None:
+            self.__clock = clock
         self.__adc1_address = address
         self.set_bit_rate(rate)
 
+    def __collect(self, channel):
+        # internal method that waits for the pending conversion on the
+        # selected channel to complete and returns its signed count
+        (length, cmd_index, high_mask, sign_mask,
+         seconds_per_sample) = self.__collect_args
+        clock = self.__clock
+
+        # sleep until the conversion is expected to be complete instead of
+        # loading the bus with reads that can only return a stale result
+        now = clock.monotonic()
+        if self.__ready_time > now:
+            clock.sleep(self.__ready_time - now)
+            now = self.__ready_time
+
+        config = self.__adc1_conf & ~(1 << 7)  # never re-trigger a one-shot
+        try:
+            __adcreading = self.__bus.read_i2c_block_data(
+                self.__adc1_address, config, length)
+        except (IOError, OSError) as err:
+            __adcreading = self.__bus_retry(
+                err, self.__bus.read_i2c_block_data, self.__adc1_address,
+                config, length)
+        # check if bit 7 of the command byte is 0.
+        if __adcreading[cmd_index] & (1 << 7):
+            __adcreading = self.__poll(channel, config)
+        else:
+            # ready on the first read: in continuous mode the next result
+            # is due at most one conversion time after the read started
+            self.__ready_time = now + seconds_per_sample
+        self.__samples += 1
+
+        # extract the returned bytes and combine in the correct order,
+        # then extend the sign bit
+        if cmd_index == 3:
+            raw = (((__adcreading[0] & high_mask) << 16) |
+                   (__adcreading[1] << 8) | __adcreading[2])
+        else:
+            raw = ((__adcreading[0] & high_mask) << 8) | __adcreading[1]
+        count = (raw ^ sign_mask) - sign_mask
+        if self.__count_limits is not None:
+            self.__check_count(channel, count)
+        return count
+
+    def __check_count(self, channel, count):
+        # internal method raising ImplausibleValue for a count outside the
+        # plausible range
+        low, high = self.__count_limits
+        if not low <= count <= high:
+            self.__implausible += 1
+            value = count * self.__profile.scale
+            raise ImplausibleValue('read_raw: channel %i implausible '
+                                   'value %f V' % (channel, value),
+                                   channel, value)
+
+    def __poll(self, channel, config):
+        # internal method that keeps reading a conversion that was not ready
+        # on the first read, backing off between reads, and returns the
+        # completed reading
+        clock = self.__clock
+        profile = self.__profile
+        read_block = self.__bus.read_i2c_block_data
+        address = self.__adc1_address
+        length = profile.length
+        cmd_index = profile.cmd_index
+        backoff = profile.poll_interval
+        timeout_time = clock.monotonic() + profile.timeout
+        polls = 1
+        while True:
+            clock.sleep(backoff)
+            backoff = min(backoff * 2, profile.max_poll_interval)
+            polls += 1
+            __adcreading = self.__bus_call(read_block, address, config,
+                                           length)
+            if not __adcreading[cmd_index] & (1 << 7):
+                break
+            if clock.monotonic() > timeout_time:
+                self.__polls += polls  # the conversion is not collected
+                self.__timeouts += 1
+                msg = 'read_raw: channel %i conversion timed out' % channel
+                raise ConversionTimeout(msg, channel)
+        self.__polls += polls - 1
+        # the result was completed before the last read, so in continuous
+        # mode the next one is due at most one conversion time from now
+        self.__ready_time = clock.monotonic() + profile.seconds_per_sample
+        return __adcreading
+
+    def __decimate(self, channel):
+        # internal method collecting conversions until the next output
+        # sample of the decimation filter is due
+        history = self.__history
+        if channel != self.__history_channel:
+            if not 0 < channel < 5:
+                raise ValueError('read_raw: channel out of range')
+            history.clear()  # the filter restarts on a new channel
+            self.__history_channel = channel
+        if len(history) == history.maxlen:
+            needed = self.__ratio
+        else:  # fill the filter window for the first output
+            needed = history.maxlen - len(history)
+        for i in range(needed):
+            history.append(self.__read_single(channel))
+        total = self.__weight_sum
+        acc = sum(map(operator.mul, self.__weights, history)) << \
+            self.__extra_bits
+        count = (2 * acc + total) // (2 * total)  # rounded to nearest
+        output_mask = self.__output.sign_mask
+        return min(max(count, -output_mask), output_mask - 1)
+
     def read_voltage(self, channel):
         """
         returns the voltage from the selected adc channel - channels 1 to 4
         """
-        raw = self.read_raw(channel)
+        return self.__read_count(channel) * self.__scale
 
-        if self.__signbit:
-            voltage = (raw * (self.__lsb / self.__pga)) - (2.048 /
-                                                           (self.__pga * 2))
-        else:
-            voltage = (raw * (self.__lsb / self.__pga))
-        return float(voltage)
+    def read_count(self, channel):
+        """
+        returns the signed (two's complement) count from the selected adc
+        channel - channels 1 to 4; volts = count * scale of the profile
+        """
+        return self.__read_count(channel)
 
     def read_raw(self, channel):
         """
         reads the raw value from the selected adc channel - channels 1 to 4
         """
-        high = 0
-        low = 0
-        mid = 0
-        cmdbyte = 0
-
+        count = self.__read_count(channel)
+        if count < 0:  # the value without its sign bit
+            return count + self.__output.sign_mask
+        return count
+
+    def __read_count(self, channel):
+        # internal method returning the signed count of the next sample
+        if channel == self.__fast_channel:
+            # fast path: the next continuous conversion of the channel. In
+            # the common case it is due and ready on the first read, which
+            # is handled here; waiting, polling and the timeout retry are
+            # left to __read_next
+            now = self.__clock.monotonic()
+            if now >= self.__ready_time:
+                (length, cmd_index, high_mask, sign_mask,
+                 seconds_per_sample) = self.__collect_args
+                config = self.__adc1_conf & ~(1 << 7)
+                try:
+                    __adcreading = self.__bus.read_i2c_block_data(
+                        self.__adc1_address, config, length)
+                except (IOError, OSError) as err:
+                    __adcreading = self.__bus_retry(
+                        err, self.__bus.read_i2c_block_data,
+                        self.__adc1_address, config, length)
+                if not __adcreading[cmd_index] & (1 << 7):
+                    self.__ready_time = now + seconds_per_sample
+                    self.__samples += 1
+                    if cmd_index == 3:
+                        raw = (((__adcreading[0] & high_mask) << 16) |
+                               (__adcreading[1] << 8) | __adcreading[2])
+                    else:
+                        raw = (((__adcreading[0] & high_mask) << 8) |
+                               __adcreading[1])
+                    count = (raw ^ sign_mask) - sign_mask
+                    if self.__count_limits is not None:
+                        self.__check_count(channel, count)
+                    return count
+            return self.__read_next(channel)
+        if self.__weights is not None:
+            return self.__decimate(channel)
+        return self.__read_single(channel)
+
+    def __read_next(self, channel):
+        # internal method for the fast path when the conversion is not due
+        # or not ready yet: waits for it and retries a timed out conversion
+        try:
+            return self.__collect(channel)
+        except ConversionTimeout:
+            if self.__retry.retries == 0:
+                raise
+        self.__retries += 1
+        return self.__read_single(channel, 1)
+
+    def __read_single(self, channel, attempt=0):
+        # internal method reading one conversion, see read_raw; attempt > 0
+        # restarts a stalled conversion first
         # get the config and i2c address for the selected channel
-        self.__setchannel(channel)
+        if channel != self.__adc1_channel:
+            if channel > 0 and channel < 5:
+                self.__setchannel(channel)
+                if self.__conversionmode == 1:
+                    # write the new config straight away: it restarts the
+                    # conversion on the new channel, otherwise the pending
+                    # result of the old channel would be returned
+                    self.__bus_call(self.__bus.write_byte,
+                                    self.__adc1_address, self.__adc1_conf)
+                self.__restart_conversion()
+            else:
+                raise ValueError('read_raw: channel out of range')
+
+        while True:
+            # if the conversion mode is set to one-shot update the ready
+            # bit to 1
+            if self.__conversionmode == 0:
+                self.__bus_call(self.__bus.write_byte, self.__adc1_address,
+                                self.__adc1_conf | (1 << 7))
+                self.__restart_conversion()
+            elif attempt:
+                # rewrite the config to restart the stalled conversion
+                self.__bus_call(self.__bus.write_byte, self.__adc1_address,
+                                self.__adc1_conf)
+                self.__restart_conversion()
+            try:
+                return self.__collect(channel)
+            except ConversionTimeout:
+                if attempt >= self.__retry.retries:
+                    raise
+            attempt += 1
+            self.__retries += 1
+
+    def start_conversion(self, channel):
+        """
+        starts a one-shot conversion on the selected adc channel - channels
+        1 to 4 - and returns the clock time at which it should be ready
+        """
         if channel > 0 and channel < 5:
-            config = self.__adc1_conf
-            address = self.__adc1_address
+            self.__setchannel(channel)
         else:
-            raise ValueError('read_raw: channel out of range')
-
-        # if the conversion mode is set to one-shot update the ready bit to 1
-        if self.__conversionmode == 0:
-            config = config | (1 << 7)
-            self.__bus.write_byte(address, config)
-            config = config & ~(1 << 7)  # reset the ready bit to 0
-
-        # determine a reasonable amount of time to wait for a conversion
-        if self.__bitrate == 18:
-            seconds_per_sample = 0.26666
-        elif self.__bitrate == 16:
-            seconds_per_sample = 0.06666
-        elif self.__bitrate == 14:
-            seconds_per_sample = 0.01666
-        elif self.__bitrate == 12:
-            seconds_per_sample = 0.00416
-        timeout_time = time.time() + (10 * seconds_per_sample)
-
-        # keep reading the adc data until the conversion result is ready
-        while True:
-            __adcreading = self.__bus.read_i2c_block_data(address, config, 4)
-            if self.__bitrate == 18:
-                high = __adcreading[0]
-                mid = __adcreading[1]
-                low = __adcreading[2]
-                cmdbyte = __adcreading[3]
-            else:
-                high = __adcreading[0]
-                mid = __adcreading[1]
-                cmdbyte = __adcreading[2]
-            # check if bit 7 of the command byte is 0.
-            if(cmdbyte & (1 << 7)) == 0:
-                break
-            elif time.time() > timeout_time:
-                msg = 'read_raw: channel %i conversion timed out' % channel
-                raise TimeoutError(msg)
+            raise ValueError('start_conversion: channel out of range')
+        self.__bus_call(self.__bus.write_byte, self.__adc1_address,
+                        self.__adc1_conf | (1 << 7))
+        self.__restart_conversion()
+        return self.__ready_time
 
-        self.__signbit = False
-        raw = 0
-        # extract the returned bytes and combine in the correct order
-        if self.__bitrate == 18:
-            raw = ((high & 0x03) << 16) | (mid << 8) | low
-            self.__signbit = bool(raw & (1 << 17))
-            raw = raw & ~(1 << 17)  # reset sign bit to 0
+    def read_conversion(self, channel):
+        """
+        returns the voltage of the conversion started with start_conversion
+        """
+        if channel != self.__adc1_channel:
+            raise ValueError('read_conversion: no conversion started on '
+                             'channel %i' % channel)
+        return self.__collect(channel) * self.__profile.scale
 
-        elif self.__bitrate == 16:
-            raw = (high << 8) | mid
-            self.__signbit = bool(raw & (1 << 15))
-            raw = raw & ~(1 << 15)  # reset sign bit to 0
+    def scan(self, channels, rate=None, count=1):
+        """
+        reads each of the listed channels count times in round-robin order
+        using one-shot conversions, optionally paced at rate scans/second.
+        Returns a ScanResult keyed by channel number, see ADCScanner
+        """
+        result = ADCScanner([self]).scan(channels, rate, count)
+        address = self.__adc1_address
+        return ScanResult(
+            dict((c, result.voltages[(address, c)]) for c in channels),
+            dict((c, result.times[(address, c)]) for c in channels),
+            dict((c, result.rates[(address, c)]) for c in channels))
+
+    def get_address(self):
+        """
+        returns the i2c address of the adc
+        """
+        return self.__adc1_address
+
+    def get_conversion_mode(self):
+        """
+        returns the conversion mode, 0 = one shot, 1 = continuous
+        """
+        return self.__conversionmode
+
+    def get_clock(self):
+        """
+        returns the clock object used for conversion deadlines
+        """
+        return self.__clock
+
+    def get_decode_profile(self):
+        """
+        returns the DecodeProfile currently used to decode conversions
+        """
+        return self.__profile
+
+    def get_output_profile(self):
+        """
+        returns the DecodeProfile of the samples returned by read_raw,
+        read_count and read_voltage: the decode profile widened by the
+        resolution gained from oversampling
+        """
+        return self.__output
+
+    def get_oversampling(self):
+        """
+        returns OversamplingInfo: ratio, filter, order, effective resolution
+        in bits, output rate (SPS) and group delay (sec) of the filter
+        """
+        sps = self.__profile.seconds_per_sample
+        taps = len(self.__weights) if self.__weights is not None else 1
+        return OversamplingInfo(self.__ratio, self.__filter, self.__order,
+                                self.__profile.bitrate + self.__gain_bits,
+                                1.0 / (sps * self.__ratio),
+                                (taps - 1) / 2.0 * sps)
+
+    def set_oversampling(self, ratio=1, filter='average', order=3):
+        """
+        decimate ratio conversions into one output sample
+        filter = 'average' (mean of ratio conversions) or 'cic' (order
+        cascaded averages: better rejection of the noise, longer delay)
+        ratio = 1 returns single conversions. Use the fastest bitrate that
+        gives enough resolution, e.g. 12 bit with ratio 4 gives 60 SPS.
+        """
+        if ratio == 1:
+            self.__ratio = 1
+            self.__filter = 'average'
+            self.__order = 1
+            self.__weights = None
+            self.__gain_bits = 0.0
+            self.__extra_bits = 0
+        else:
+            weights = decimation_weights(ratio, filter, order)
+            total = sum(weights)
+            self.__ratio = ratio
+            self.__filter = filter
+            self.__order = order if filter == 'cic' else 1
+            self.__weights = weights
+            self.__weight_sum = total
+            # white noise power is reduced by sum(w^2) / sum(w)^2
+            self.__gain_bits = -0.5 * math.log(
+                sum(w * w for w in weights) / float(total * total), 2)
+            self.__extra_bits = int(self.__gain_bits + 1e-9)
+        self.__history_channel = 0
+        self.__update_output()
+
+    def get_poll_stats(self):
+        """
+        returns PollStats: conversions collected, i2c reads issued while
+        collecting them and the average number of reads per conversion
+        """
+        samples = self.__samples
+        polls = samples + self.__polls
+        return PollStats(samples, polls,
+                         float(polls) / samples if samples else 0.0)
+
+    def reset_poll_stats(self):
+        """
+        resets the counters reported by get_poll_stats
+        """
+        self.__samples = 0
+        self.__polls = 0
+
+    def get_error_stats(self):
+        """
+        returns ErrorStats: failed i2c transactions, conversion timeouts,
+        implausible conversions and retries issued by the retry policy
+        """
+        return ErrorStats(self.__bus_errors, self.__timeouts,
+                          self.__implausible, self.__retries)
 
-        elif self.__bitrate == 14:
-            raw = ((high & 0b00111111) << 8) | mid
-            self.__signbit = bool(raw & (1 << 13))
-            raw = raw & ~(1 << 13)  # reset sign bit to 0
+    def reset_error_stats(self):
+        """
+        resets the counters reported by get_error_stats
+        """
+        self.__bus_errors = 0
+        self.__timeouts = 0
+        self.__implausible = 0
+        self.__retries = 0
+
+    def get_retry_policy(self):
+        """
+        returns the RetryPolicy of the read path
+        """
+        return self.__retry
 
-        elif self.__bitrate == 12:
-            raw = ((high & 0x0f) << 8) | mid
-            self.__signbit = bool(raw & (1 << 11))
-            raw = raw & ~(1 << 11)  # reset sign bit to 0
+    def set_retry_policy(self, retries=2, backoff=0.001, factor=2.0,
+                         max_backoff=0.01):
+        """
+        retries of a failed i2c transaction or timed out conversion, with
+        backoff seconds before the first retry growing by factor up to
+        max_backoff; retries=0 raises the first error
+        """
+        if retries < 0 or backoff < 0 or factor < 1:
+            raise ValueError('set_retry_policy: invalid policy')
+        self.__retry = RetryPolicy(int(retries), backoff, factor,
+                                   max(backoff, max_backoff))
 
-        return raw
+    def set_plausible_range(self, minimum=None, maximum=None,
+                            saturation=True):
+        """
+        conversions below minimum or above maximum volts raise
+        ImplausibleValue, as do conversions clipped at full scale when
+        saturation is True. Call with no arguments to only reject clipped
+        conversions; disable the check with set_plausible_range(None, None,
+        False)
+        """
+        if minimum is not None and maximum is not None and minimum > maximum:
+            raise ValueError('set_plausible_range: minimum above maximum')
+        if minimum is None and maximum is None and not saturation:
+            self.__plausible = None
+        else:
+            self.__plausible = (minimum, maximum, saturation)
+        self.__update_limits()
 
     def set_pga(self, gain):
         """
@@ -236,7 +813,10 @@ class ADCDifferentialPi:
         else:
             raise ValueError('set_pga: gain out of range')
 
-        self.__bus.write_byte(self.__adc1_address, self.__adc1_conf)
+        self.__update_profile()
+        self.__bus_call(self.__bus.write_byte, self.__adc1_address,
+                        self.__adc1_conf)
+        self.__restart_conversion()
         return
 
     def set_bit_rate(self, rate):
@@ -271,7 +851,10 @@ class ADCDifferentialPi:
         else:
             raise ValueError('set_bit_rate: rate out of range')
 
-        self.__bus.write_byte(self.__adc1_address, self.__adc1_conf)
+        self.__update_profile()
+        self.__bus_call(self.__bus.write_byte, self.__adc1_address,
+                        self.__adc1_conf)
+        self.__restart_conversion()
         return
 
     def set_conversion_mode(self, mode):
@@ -284,11 +867,123 @@ class ADCDifferentialPi:
             # bit 4 = 0
             self.__adc1_conf = self.__updatebyte(self.__adc1_conf, 0xEF, 0x00)
             self.__conversionmode = 0
+            self.__update_fast()
         elif mode == 1:
             # bit 4 = 1
             self.__adc1_conf = self.__updatebyte(self.__adc1_conf, 0xEF, 0x10)
             self.__conversionmode = 1
+            self.__update_fast()
         else:
             raise ValueError('set_conversion_mode: mode out of range')
 
         return
+
+    def write_config(self):
+        """
+        writes the configuration (channel, bit rate, gain and conversion
+        mode) to the device, which restarts a continuous conversion; the
+        set_ methods leave this to the next read
+        """
+        self.__bus_call(self.__bus.write_byte, self.__adc1_address,
+                        self.__adc1_conf & ~(1 << 7))
+        if self.__conversionmode == 1:
+            self.__restart_conversion()
+
+
+# Result of a channel scan. voltages and times map each scanned channel to an
+# array('d') that numpy.asarray() can wrap without copying; rates holds the
+# achieved per-channel sample rate in samples/sec
+ScanResult = namedtuple('ScanResult', ['voltages', 'times', 'rates'])
+
+
+class ADCScanner:
+    """
+    Round-robin scan of several channels on one or more MCP3424 devices
+    sharing an i2c bus. Each slot of the scan starts a one-shot conversion
+    on every device, sleeps until the conversions are due and then collects
+    them, so the devices convert in parallel and the bus is not polled
+    while the conversions are running.
+    """
+
+    def __init__(self, adcs, clock=None):
+        self.adcs = list(adcs)
+        if clock is None:
+            clock = self.adcs[0].get_clock()
+        self.clock = clock
+        addresses = [adc.get_address() for adc in self.adcs]
+        if len(set(addresses)) != len(addresses):
+            raise ValueError('ADCScanner: duplicate adc address')
+
+    def scan(self, channels, rate=None, count=1):
+        """
+        channels is a list of channels scanned on every device, or a dict
+        mapping an adc address to its own list of channels. Every channel is
+        sampled count times; rate limits the number of complete scans per
+        second (None = as fast as the conversions allow). Returns a
+        ScanResult keyed by (address, channel)
+        """
+        plan = []
+        for adc in self.adcs:
+            address = adc.get_address()
+            if isinstance(channels, dict):
+                chans = list(channels.get(address, []))
+            else:
+                chans = list(channels)
+            for channel in chans:
+                if channel < 1 or channel > 4:
+                    raise ValueError('scan: channel out of range')
+            if chans:
+                plan.append((adc, address, chans))
+        if not plan:
+            raise ValueError('scan: no channels to scan')
+
+        voltages = {}
+        times = {}
+        for adc, address, chans in plan:
+            for channel in chans:
+                voltages[(address, channel)] = array('d')
+                times[(address, channel)] = array('d')
+
+        modes = [adc.get_conversion_mode() for adc, address, chans in plan]
+        for adc, address, chans in plan:
+            adc.set_conversion_mode(0)
+
+        clock = self.clock
+        slotsPerScan = max(len(chans) for adc, address, chans in plan)
+        scanPeriod = 0 if rate is None else 1.0 / rate
+        tStart = clock.monotonic()
+        try:
+            for slot in range(slotsPerScan * count):
+                if scanPeriod and slot % slotsPerScan == 0:
+                    # pace the start of every scan on an absolute schedule
+                    dueTime = tStart + (slot // slotsPerScan) * scanPeriod
+                    delay = dueTime - clock.monotonic()
+                    if delay > 0:
+                        clock.sleep(delay)
+                # start the conversions on every device before waiting
+                readyTime = 0
+                pending = []
+                position = slot % slotsPerScan  # slot within the scan
+                for adc, address, chans in plan:
+                    if position >= len(chans):
+                        continue  # every channel of the device is read
+                    channel = chans[position]
+                    readyTime = max(readyTime,
+                                    adc.start_conversion(channel))
+                    pending.append((adc, address, channel))
+                delay = readyTime - clock.monotonic()
+                if delay > 0:
+                    clock.sleep(delay)
+                for adc, address, channel in pending:
+                    voltage = adc.read_conversion(channel)
+                    times[(address, channel)].append(clock.monotonic())
+                    voltages[(address, channel)].append(voltage)
+        finally:
+            for (adc, address, chans), mode in zip(plan, modes):
+                adc.set_conversion_mode(mode)
+                adc.write_config()  # back in continuous mode straight away
+
+        elapsed = clock.monotonic() - tStart
+        rates = dict((key, len(values) / elapsed if elapsed > 0 else 0.0)
+                     for key, values in voltages.items())
+        return ScanResult(voltages, times, rates)
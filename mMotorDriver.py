@@ -5,92 +5,189 @@ Fly-by-Pi Controller
 Class file for the motor driver (Pololu 24v13). Simplifies the
 control motor driver by exposing function to enable/disengage
 the motor, set the speed (duty cycle) and direction of movement.
-Standard Raspberry Pi pinouts are used.
+Standard Raspberry Pi pinouts are used. A module with the RPi.GPIO
+interface (e.g. mSimulator.cSimGPIO) can be supplied instead of RPi.GPIO.
+The PWM signal is generated by RPi.GPIO software PWM at frequency (Hz,
+default 300) unless a hardware PWM backend with the same interface is
+supplied, e.g. mPWM.cSysfsPWM(frequency=20000) for GPIO18.
+
+The driver keeps a shadow copy of the pin states (enabled, direction,
+speed) and skips writes that would not change anything, so calling the
+set functions on every control tick costs no GPIO access. apply() sets
+direction, speed and enable together in a safe order: the driver is
+put to sleep before the direction is reversed and is only enabled once
+direction and speed are set, so the motor never reverses under power.
+
+lockOut() disables the driver and refuses to enable it again until
+unlock(), whoever asks (e.g. a safety watchdog stopping the motor while
+the control loop or ramp thread keeps driving it).
+
+pins selects the (PWM, DIR, SLP) pins, so several drivers can run from
+one process; PIN_MAPS lists the pin maps of the actuators of a package
+(axis 1 on the original pins). Only GPIO18 (PWM0) and GPIO13 (PWM1) can
+be driven by the hardware PWM (mPWM.cSysfsPWM channel 0 and 1); the third
+axis uses software PWM.
 
 Modified by Andre Broekman 2020/05/13
 Open Source License: Creative Commons Attribution-ShareAlike
 """
 
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None  # only required when no gpio backend is supplied
 from time import sleep
+import threading
+
+# (PWM, DIR, SLP) pins of up to three actuators
+PIN_MAPS = ((18, 27, 22), (13, 23, 24), (16, 20, 21))
 
 class cMotorDriver:
-    def __init__(self): 
-        self.pinAssign = [18, 27, 22]  # PWM, DIR, SLP
+    def __init__(self, gpio=None, pwm=None, frequency=None, pins=PIN_MAPS[0]):
+        if gpio is None:
+            if GPIO is None:
+                raise ImportError("RPi.GPIO not found")
+            gpio = GPIO
+        self.gpio = gpio    # RPi.GPIO compatible backend
+        if len(pins) != 3 or len(set(pins)) != 3:
+            raise ValueError("cMotorDriver: pins must be three different (PWM, DIR, SLP) pins")
+        self.pinAssign = list(pins)  # PWM, DIR, SLP
         self.enabled = 0    # LOW state disables the driver, HIGH state enables the driver
         self.direction = 0  # 0 = Current flows from OUTB to OUTA // 1 = Current flows from OUTA to OUTB
         self.speed = 0      # PWM value
+        self.writes = 0     # number of pin and duty cycle writes
+        self.locked = False # True while locked out: the driver is never enabled
+        self.lock = threading.RLock()  # serialises pin changes between threads
+        self.frequency = 300 if frequency is None else frequency  # PWM carrier frequency (Hz)
         try:
-            GPIO.setmode(GPIO.BCM)  # Use Broadcom chip-specific numbering scheme
-            for pin in self.pinAssign:  # Set all pins as output
-                GPIO.setup(pin, GPIO.OUT)
-            self.p = GPIO.PWM(self.pinAssign[0], 300) # 300 Hz PWM frequency
+            self.gpio.setmode(self.gpio.BCM)  # Use Broadcom chip-specific numbering scheme
+            # Set all pins as output; a hardware PWM pin stays in its PWM (ALT) function
+            for pin in self.pinAssign[1:] if pwm is not None else self.pinAssign:
+                self.gpio.setup(pin, self.gpio.OUT, initial=0)  # LOW matches the shadow state
+            if pwm is None:
+                self.p = self.gpio.PWM(self.pinAssign[0], self.frequency)  # software PWM
+            else:
+                self.p = pwm  # hardware PWM backend; keeps its own frequency unless one is given
+                if frequency is not None:
+                    self.p.ChangeFrequency(frequency)
+                self.frequency = self.p.frequency
             self.p.start(0) # Start the PWM generator (0% duty cycle)
         except:
             print("MotorDriver class _init_ exception")
 
 
+    def __writeEnable(self, enabled):
+        # write the SLP pin only when its state changes; never enable while locked out
+        if self.locked:
+            enabled = 0
+        if enabled != self.enabled:
+            self.gpio.output(self.pinAssign[2], enabled)
+            self.enabled = enabled
+            self.writes += 1
+
+
+    def __writeDirection(self, direction):
+        # write the DIR pin only when its state changes
+        if direction != self.direction:
+            self.gpio.output(self.pinAssign[1], direction)
+            self.direction = direction
+            self.writes += 1
+
+
+    def __writeSpeed(self, speed):
+        # write the duty cycle only when it changes; out of range stops the motor
+        if not 0 <= speed <= 100:
+            speed = 0
+        if speed != self.speed:
+            self.p.ChangeDutyCycle(speed)
+            self.speed = speed
+            self.writes += 1
+
+
     def setEnable(self, enabled=0):  # enable the motor
         try:
-            if enabled == 1:
-                GPIO.output(self.pinAssign[2], 1)
-                self.enabled = 1
-            else:
-                GPIO.output(self.pinAssign[2], 0)
-                self.enabled = 0
+            with self.lock:
+                self.__writeEnable(1 if enabled == 1 else 0)
         except:
             print("motor enable: try exception")
 
 
+    def lockOut(self):  # disable the motor and keep it disabled until unlock()
+        try:
+            with self.lock:
+                self.locked = True
+                self.__writeEnable(0)
+        except:
+            print("motor lock out: try exception")
+
+
+    def unlock(self):  # allow the motor to be enabled again after lockOut()
+        with self.lock:
+            self.locked = False
+
+
     def toggleSleep(self):  # toggle the motor sleep state
         try:
-            if self.enabled == 0:
-                GPIO.output(self.pinAssign[2], 1)
-                self.enabled = 1
-            else:
-                GPIO.output(self.pinAssign[2], 0)
-                self.enabled = 0
+            with self.lock:
+                self.__writeEnable(1 - self.enabled)
         except:
             print("motor sleep toggle: try exception")
 
 
     def setForward(self):  # set the actuator to extend (go forward)
         try:
-            GPIO.output(self.pinAssign[1], 1)
-            self.direction = 1
+            with self.lock:
+                self.__writeDirection(1)
         except:
             print("motor forward: try exception")
 
 
     def setBackward(self):  # set the actuator to retract (go backward)
         try:
-            GPIO.output(self.pinAssign[1], 0)
-            self.direction = 0
+            with self.lock:
+                self.__writeDirection(0)
         except:
             print("motor backward: try exception")
 
 
     def toggleDirection(self):  # toggle the direction of the motor
         try:
-            if self.direction == 0:
-                GPIO.output(self.pinAssign[1], 1)
-                self.direction = 1
-            else:
-                GPIO.output(self.pinAssign[1], 0)
-                self.direction = 0
+            with self.lock:
+                self.__writeDirection(1 - self.direction)
         except:
             print("motor sleep toggle: try exception")
 
 
+    def apply(self, direction, speed, enabled):  # set direction, speed and enable together
+        # Order: sleep before a reversal or when disabling, then direction and
+        # speed, and enable last. Unchanged pins are not written.
+        enabled = 1 if enabled == 1 else 0
+        direction = 1 if direction == 1 else 0
+        try:
+            with self.lock:
+                if self.enabled and (not enabled or direction != self.direction):
+                    self.__writeEnable(0)
+                self.__writeDirection(direction)
+                self.__writeSpeed(speed)
+                self.__writeEnable(enabled)
+        except:
+            self.setEnable(enabled=0)  # leave the driver in a safe state
+            print("motor apply: try exception")
+
+
+    def setFrequency(self, frequency):  # change the PWM carrier frequency (Hz)
+        try:
+            with self.lock:
+                self.p.ChangeFrequency(frequency)
+                self.frequency = frequency
+        except:
+            print("motor frequency: try exception")
+
+
     def setSpeed(self, speed=0):  # set the duty cycle of PWM pin (0-100%)
-        if speed in range(101):
-            try:
-                self.p.ChangeDutyCycle(speed)
-            except:
-                print("motor speed: try exception")
-        else:
-            try:
-                self.p.ChangeDutyCycle(0)
-            except:
-                print("motor speed: catastrophic exception")
+        try:
+            with self.lock:
+                self.__writeSpeed(speed)
+        except:
+            print("motor speed: try exception")
    
\ No newline at end of file
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Discrete PID controller with feed-forward for force (load) tracking. The
+derivative acts on the measurement (no kick on setpoint changes) through a
+first order low-pass filter, and the integrator uses conditional
+integration so it does not wind up while the output is saturated, e.g.
+while the actuator is still approaching contact.
+
+    output = bias + kff * setpoint + kp * e + ki * integral(e) - kd * d(y)/dt
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+
+
+class cPID:
+    def __init__(self, kp, ki=0.0, kd=0.0, outputMin=0.0, outputMax=100.0,
+                 kff=0.0, bias=0.0, derivativeTime=0.1):
+        self.kp = kp                  # proportional gain (output/unit)
+        self.ki = ki                  # integral gain (output/unit/sec)
+        self.kd = kd                  # derivative gain (output.sec/unit)
+        self.outputMin = outputMin    # output limits (e.g. PWM %)
+        self.outputMax = outputMax
+        self.kff = kff                # feed-forward gain (output/unit)
+        self.bias = bias              # constant feed-forward (output)
+        self.derivativeTime = derivativeTime  # derivative filter (sec)
+        self.output = 0.0
+        self.integral = 0.0
+        self.__derivative = 0.0
+        self.__tPrior = None
+        self.__measurementPrior = 0.0
+
+    def reset(self, integral=0.0):
+        """
+        clear the controller state, e.g. at the start of a load stroke
+        """
+        self.integral = integral
+        self.__derivative = 0.0
+        self.__tPrior = None
+
+    def update(self, now, setpoint, measurement):
+        """
+        returns the new output for the measurement taken at time now
+        """
+        dt = 0.0 if self.__tPrior is None else now - self.__tPrior
+        error = setpoint - measurement
+        if dt > 0:
+            rate = (measurement - self.__measurementPrior) / dt
+            alpha = dt / (self.derivativeTime + dt)
+            self.__derivative += alpha * (rate - self.__derivative)
+        self.__tPrior = now
+        self.__measurementPrior = measurement
+
+        base = (self.bias + self.kff * setpoint + self.kp * error -
+                self.kd * self.__derivative)
+        integral = self.integral + self.ki * error * dt
+        output = base + integral
+        if output > self.outputMax:
+            output = self.outputMax
+            if error < 0:  # only integrate when it unwinds the saturation
+                self.integral = integral
+        elif output < self.outputMin:
+            output = self.outputMin
+            if error > 0:
+                self.integral = integral
+        else:
+            self.integral = integral
+        self.output = output
+        return output
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Hardware PWM backend for cMotorDriver. RPi.GPIO.PWM is software PWM
+generated by a thread, so its duty cycle jitters whenever the CPU is busy
+(e.g. polling the I2C bus). cSysfsPWM drives one of the Broadcom PWM
+channels through the Linux sysfs interface (/sys/class/pwm/pwmchipN)
+instead; the waveform is then generated in hardware and can run at a
+carrier frequency above the audible range.
+
+cSysfsPWM has the same interface as the object returned by RPi.GPIO.PWM
+(start, ChangeDutyCycle, ChangeFrequency, stop), so either can be passed
+to cMotorDriver(pwm=...). The duty_cycle file is kept open and written
+with a single pwrite per update.
+
+GPIO18 is PWM0 (pwmchip0, channel 0) once the overlay is enabled in
+/boot/config.txt:
+    dtoverlay=pwm,pin=18,func=2
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import os
+import time
+
+SYSFS_ROOT = "/sys/class/pwm"
+
+
+class cSysfsPWM:
+    def __init__(self, chip=0, channel=0, frequency=20000, root=SYSFS_ROOT,
+                 timeout=1.0):
+        self.chip = chip
+        self.channel = channel
+        self.path = os.path.join(root, "pwmchip%i" % chip, "pwm%i" % channel)
+        self.frequency = frequency
+        self.dutyCycle = 0.0
+        self.running = False
+        self.writes = 0   # number of writes to the sysfs attributes
+        self.period = 0   # carrier period (ns)
+        self.__fdDuty = None
+        self.__export(timeout)
+        self.__fdDuty = os.open(os.path.join(self.path, "duty_cycle"),
+                                os.O_WRONLY)
+        self.ChangeFrequency(frequency)
+
+    def __del__(self):
+        if self.__fdDuty is not None:
+            os.close(self.__fdDuty)
+            self.__fdDuty = None
+
+    def __export(self, timeout):
+        # export the channel; udev needs a moment to create the attributes
+        # and set their permissions
+        duty = os.path.join(self.path, "duty_cycle")
+        if not os.path.exists(self.path):
+            with open(os.path.join(os.path.dirname(self.path), "export"),
+                      "w") as f:
+                f.write(str(self.channel))
+        tEnd = time.monotonic() + timeout
+        while not os.access(duty, os.W_OK):
+            if time.monotonic() > tEnd:
+                raise IOError("PWM channel %s not available" % self.path)
+            time.sleep(0.01)
+
+    def __write(self, name, value):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(str(value))
+        self.writes += 1
+
+    def __writeDuty(self, ns):
+        os.pwrite(self.__fdDuty, b"%i" % ns, 0)
+        self.writes += 1
+
+    def start(self, dutyCycle):
+        self.ChangeDutyCycle(dutyCycle)
+        self.__write("enable", 1)
+        self.running = True
+
+    def ChangeDutyCycle(self, dutyCycle):
+        if dutyCycle < 0 or dutyCycle > 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.__writeDuty(int(self.period * dutyCycle / 100))
+        self.dutyCycle = dutyCycle
+
+    def ChangeFrequency(self, frequency):
+        if frequency <= 0:
+            raise ValueError("frequency must be greater than 0.0")
+        # the kernel rejects a duty cycle longer than the period, so clear
+        # the duty cycle before changing the period
+        self.__writeDuty(0)
+        self.period = int(round(1e9 / frequency))
+        self.__write("period", self.period)
+        self.frequency = frequency
+        self.__writeDuty(int(self.period * self.dutyCycle / 100))
+
+    def stop(self):
+        self.__writeDuty(0)
+        self.__write("enable", 0)
+        self.running = False
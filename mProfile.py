@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Declarative test profiles. A test is described in a JSON file as a list
+of segments instead of a copy of a control script:
+
+    {"name": "Time control demonstration",
+     "speed": 20,
+     "segments": [
+        {"repeat": 1000, "segments": [
+            {"time": 2, "direction": "backward", "label": "Retracting"},
+            {"time": 2, "direction": "forward", "label": "Extending"}]}]}
+
+Segment types (the key names the type and holds its main value):
+    time          drive in direction at speed for a number of seconds
+    ramp          change the speed linearly from speed to endSpeed over a
+                  number of seconds
+    hold          stop the motor for a number of seconds
+    load          drive until the zeroed load reaches the value (kg):
+                  forward until load > value, backward until load <= value;
+                  "pid": true drives the speed from the cPID of the runner;
+                  "gain": contact load (kg) steps the speed up as the
+                  original load control scripts did: every 2 s from 4 s
+                  into the segment, by 1% (2% above 50 kg), while the load
+                  rose less than 1 kg, is above the contact load and is
+                  more than 5 kg short of the value
+    displacement  drive until the actuator has moved the value (mm)
+    zero          stop and average the value (number) of load readings as
+                  the zero load
+    repeat        run "segments" the value times (0 = forever)
+Optional keys: speed (PWM %, default the profile speed), direction
+("forward"/"backward", default "forward"), timeout (sec, load and
+displacement segments; the test is aborted when it expires) and label.
+
+compileProfile() validates the definition and flattens it into a step
+table; repeat blocks become loop steps with a counter slot, so the
+control loop only evaluates the current step on every tick (O(1) work)
+and never interprets the definition at run time. cProfileRunner walks
+the table with the same interface as cLoadCycleController (mLoadCycle.py),
+including pause() and resume().
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import json
+from collections import namedtuple
+
+# step operations
+TIME, RAMP, HOLD, LOAD, DISPLACEMENT, ZERO, LOOP_START, LOOP_END, END = \
+    range(9)
+OP_NAMES = ("TIME", "RAMP", "HOLD", "LOAD", "DISPLACEMENT", "ZERO",
+            "LOOP_START", "LOOP_END", "END")
+SEGMENT_TYPES = {"time": TIME, "ramp": RAMP, "hold": HOLD, "load": LOAD,
+                 "displacement": DISPLACEMENT, "zero": ZERO}
+DIRECTIONS = {"forward": 1, "backward": 0, 1: 1, 0: 0}
+
+# One entry of the step table. value is the duration (sec), load (kg),
+# distance (mm) or number of zero samples; for the loop steps jump is the
+# index of the other end of the block and value the repeat count.
+Step = namedtuple('Step', ['op', 'direction', 'speed', 'endSpeed', 'value',
+                           'timeout', 'pid', 'gain', 'jump', 'slot',
+                           'label'])
+GAIN_INTERVAL = 2.0  # interval of the gain steps of a load segment (sec)
+ProfileTable = namedtuple('ProfileTable', ['name', 'steps', 'slots',
+                                           'needsLoad',
+                                           'needsDisplacement'])
+
+
+def loadProfile(path):
+    """
+    returns the step table compiled from a JSON profile file
+    """
+    with open(path) as f:
+        return compileProfile(json.load(f))
+
+
+def compileProfile(definition):
+    """
+    validates a profile definition (dict) and returns its ProfileTable
+    """
+    steps = []
+    slots = [0]
+    speed = definition.get("speed", 0)
+
+    def number(segment, key, where, default=None, positive=True):
+        value = segment.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                or (positive and value < 0):
+            raise ValueError("%s: %s must be a%s number" %
+                             (where, key, " positive" if positive else ""))
+        return value
+
+    def emit(segments, where):
+        if not isinstance(segments, list) or not segments:
+            raise ValueError("%s: segments must be a non-empty list" % where)
+        for index, segment in enumerate(segments):
+            here = "%s[%i]" % (where, index)
+            if not isinstance(segment, dict):
+                raise ValueError("%s: segment must be an object" % here)
+            if "repeat" in segment:
+                count = int(number(segment, "repeat", here))
+                slot = slots[0]
+                slots[0] += 1
+                start = len(steps)
+                steps.append(None)  # patched once the block end is known
+                emit(segment.get("segments"), here + ".segments")
+                label = segment.get("label", "")
+                steps[start] = Step(LOOP_START, 0, 0, 0, count, None, False,
+                                    None, len(steps), slot, label)
+                steps.append(Step(LOOP_END, 0, 0, 0, count, None, False,
+                                  None, start + 1, slot, label))
+                continue
+            kinds = [key for key in SEGMENT_TYPES if key in segment]
+            if len(kinds) != 1:
+                raise ValueError("%s: exactly one of %s is required" %
+                                 (here, ", ".join(sorted(SEGMENT_TYPES))))
+            kind = kinds[0]
+            op = SEGMENT_TYPES[kind]
+            direction = segment.get("direction", "forward")
+            if direction not in DIRECTIONS:
+                raise ValueError("%s: unknown direction %r" %
+                                 (here, direction))
+            value = number(segment, kind, here, positive=op != LOAD)
+            if op == ZERO:
+                value = max(1, int(value))
+            stepSpeed = number(segment, "speed", here, speed)
+            endSpeed = number(segment, "endSpeed", here, stepSpeed) \
+                if op == RAMP else stepSpeed
+            if stepSpeed > 100 or endSpeed > 100:
+                raise ValueError("%s: speed must be 0-100%%" % here)
+            timeout = segment.get("timeout")
+            if timeout is not None:
+                timeout = number(segment, "timeout", here)
+            gain = segment.get("gain")
+            if gain is not None:
+                gain = number(segment, "gain", here)
+                if op != LOAD or segment.get("pid"):
+                    raise ValueError("%s: gain only applies to load segments "
+                                     "without pid" % here)
+            steps.append(Step(op, DIRECTIONS[direction], stepSpeed, endSpeed,
+                              value, timeout, bool(segment.get("pid")), gain,
+                              None, None, segment.get("label", "")))
+
+    emit(definition.get("segments"), "segments")
+    steps.append(Step(END, 0, 0, 0, 0, None, False, None, None, None, ""))
+    ops = set(step.op for step in steps)
+    return ProfileTable(definition.get("name", ""), tuple(steps), slots[0],
+                        bool(ops & set((LOAD, ZERO))), DISPLACEMENT in ops)
+
+
+class cProfileRunner:
+    """
+    Non-blocking executor of a ProfileTable. step() is called once per
+    control tick with the time and the latest calibrated (not zeroed)
+    load and displacement, or None when no new reading is available.
+    """
+
+    def __init__(self, table, motor, pid=None, ramp=None, onEvent=None,
+                 targetTolerance=0.5):
+        self.table = table
+        self.motor = motor
+        self.pid = pid            # cPID for load segments with "pid": true
+        self.ramp = ramp          # cRampGenerator or None
+        self.onEvent = onEvent    # callback for status messages
+        self.targetTolerance = targetTolerance  # PID load band (kg)
+        self.index = None         # current step
+        self.deadline = None      # end of a timed step or timeout
+        self.zeroLoad = 0.0       # zero load subtracted from readings
+        self.load = 0.0           # latest zeroed load (kg)
+        self.displacement = None  # latest displacement (mm)
+        self.currentSpeed = 0.0
+        self.cycleCount = 0       # iterations of the outermost repeat block
+        self.finished = False
+        self.aborted = False      # True when a segment timed out
+        self.paused = False
+        self.status = ""
+        self.__counters = [0] * table.slots
+        self.__tStart = 0.0       # start time of the current step
+        self.__tPaused = 0.0
+        self.__origin = None      # displacement at the start of a step
+        self.__zeroSum = 0.0
+        self.__zeroCount = 0
+        self.__gradient = 0.0
+        self.__tGradient = None
+        self.__loadGradient = 0.0
+        self.__tGain = 0.0        # time of the last gain check
+        self.__loadGain = None    # load at the last gain step
+
+    def __event(self, message):
+        self.status = message
+        if self.onEvent is not None:
+            self.onEvent(message)
+
+    def __drive(self, direction, speed):
+        self.currentSpeed = speed
+        if self.ramp is not None:
+            self.ramp.setTarget(speed, direction)
+        else:
+            self.motor.apply(direction=direction, speed=speed, enabled=1)
+
+    def __setSpeed(self, speed):
+        self.currentSpeed = speed
+        if self.ramp is not None:
+            self.ramp.setTarget(speed)
+        else:
+            self.motor.setSpeed(speed)
+
+    def __halt(self):
+        self.currentSpeed = 0.0
+        if self.ramp is not None:
+            self.ramp.brake()
+        else:
+            self.motor.setEnable(enabled=0)
+
+    def __enter(self, index, now):
+        # perform the entry actions of a step; loop steps take no time and
+        # are passed straight through (bounded by the nesting depth)
+        steps = self.table.steps
+        while True:
+            step = steps[index]
+            op = step.op
+            if op == LOOP_START:
+                self.__counters[step.slot] = 0
+                if step.slot == 0:
+                    self.cycleCount += 1
+                index += 1
+            elif op == LOOP_END:
+                self.__counters[step.slot] += 1
+                if step.value == 0 or self.__counters[step.slot] < step.value:
+                    if step.slot == 0:
+                        self.cycleCount += 1
+                    index = step.jump
+                else:
+                    index += 1
+            else:
+                break
+        self.index = index
+        self.__tStart = now
+        self.deadline = None
+        if op in (TIME, RAMP, HOLD):
+            self.deadline = now + step.value
+        elif step.timeout is not None:
+            self.deadline = now + step.timeout
+        if op in (TIME, RAMP, LOAD, DISPLACEMENT):
+            if op == LOAD and step.pid and self.pid is not None:
+                self.pid.reset()
+            # the first gain check is 2 * GAIN_INTERVAL into the segment,
+            # as in the original load control scripts
+            self.__tGain = now + GAIN_INTERVAL
+            self.__loadGain = None  # taken from the next reading
+            self.__origin = self.displacement
+            self.__drive(step.direction, step.speed)
+        elif op == ZERO:
+            self.__zeroSum = 0.0
+            self.__zeroCount = 0
+            self.__halt()
+        elif op == HOLD:
+            self.__halt()
+        elif op == END:
+            self.__halt()
+            self.finished = True
+        self.__event(step.label or OP_NAMES[op])
+
+    def start(self, now):
+        """
+        begin the test at the first step
+        """
+        self.cycleCount = 0
+        self.finished = False
+        self.aborted = False
+        self.__enter(0, now)
+
+    def step(self, now, load=None, displacement=None):
+        """
+        advance the profile; returns the current step index or None once
+        the profile has finished
+        """
+        if self.finished:
+            return None
+        step = self.table.steps[self.index]
+        op = step.op
+        if load is not None and op != ZERO:
+            self.load = load - self.zeroLoad
+            if self.__tGradient is None:
+                self.__tGradient = now
+                self.__loadGradient = self.load
+            elif now - self.__tGradient >= 1.0:
+                self.__gradient = ((self.load - self.__loadGradient) /
+                                   (now - self.__tGradient))
+                self.__tGradient = now
+                self.__loadGradient = self.load
+        if displacement is not None:
+            self.displacement = displacement
+        if self.paused:
+            return self.index
+        done = False
+        if op == TIME or op == HOLD:
+            done = now > self.deadline
+        elif op == RAMP:
+            if now > self.deadline:
+                done = True
+            elif step.value > 0:
+                self.__setSpeed(step.speed + (step.endSpeed - step.speed) *
+                                (now - self.__tStart) / step.value)
+        elif op == LOAD:
+            if load is not None:
+                sign = 1 if step.direction == 1 else -1
+                if step.pid and self.pid is not None:
+                    done = sign * (self.load - step.value) >= \
+                        -self.targetTolerance
+                    if not done:
+                        self.__setSpeed(self.pid.update(
+                            now, sign * step.value, sign * self.load))
+                else:
+                    # strict > forward and <= backward, as the original
+                    # scripts compared the load with the target
+                    done = self.load > step.value if sign == 1 else \
+                        self.load <= step.value
+                    if self.__loadGain is None:
+                        self.__loadGain = self.load
+                    if not done and step.gain is not None and \
+                            now - self.__tGain > GAIN_INTERVAL:
+                        self.__tGain = now
+                        if (self.load - self.__loadGain < 1 and
+                                self.load > step.gain and
+                                self.load < step.value - 5):
+                            gain = 1 if self.load < 50 else 2
+                            self.__setSpeed(self.currentSpeed + gain)
+                            self.__loadGain = None
+                            self.__event("%s; %i%% GAIN added" % (
+                                step.label or OP_NAMES[op], gain))
+        elif op == DISPLACEMENT:
+            if displacement is not None:
+                if self.__origin is None:
+                    self.__origin = displacement
+                done = abs(displacement - self.__origin) >= step.value
+        elif op == ZERO:
+            if load is not None:
+                self.__zeroSum += load
+                self.__zeroCount += 1
+                if self.__zeroCount >= step.value:
+                    self.zeroLoad = self.__zeroSum / self.__zeroCount
+                    self.load = 0.0
+                    self.__event("Zero load = " + str(round(self.zeroLoad, 3))
+                                 + " [kg]")
+                    done = True
+        if done:
+            self.__enter(self.index + 1, now)
+        elif self.deadline is not None and now > self.deadline:
+            # a load or displacement segment timed out; stop the test
+            self.aborted = True
+            self.__enter(len(self.table.steps) - 1, now)
+            self.__event("Aborted: %s timed out"
+                         % (step.label or OP_NAMES[op]))
+        return None if self.finished else self.index
+
+    def pause(self, now):
+        """
+        stop the motor and freeze the profile until resume()
+        """
+        if self.paused or self.finished:
+            return
+        speed = self.currentSpeed
+        self.__halt()
+        self.currentSpeed = speed  # restored by resume()
+        self.paused = True
+        self.__tPaused = now
+        self.__event("Paused")
+
+    def resume(self, now):
+        """
+        continue a paused profile; the current step is extended by the pause
+        """
+        if not self.paused:
+            return
+        self.paused = False
+        pause = now - self.__tPaused
+        self.__tStart += pause
+        self.__tGain += pause
+        if self.deadline is not None:
+            self.deadline += pause
+        step = self.table.steps[self.index]
+        if step.op in (TIME, RAMP, LOAD, DISPLACEMENT):
+            if step.op == LOAD and step.pid and self.pid is not None:
+                self.pid.reset()
+            self.__drive(step.direction, self.currentSpeed)
+        self.__event("Resumed")
+
+    def gradient(self):  # load rate over the last second (kg/s)
+        return self.__gradient
+
+    def stateName(self):
+        if self.index is None:
+            return ""
+        step = self.table.steps[self.index]
+        return step.label or OP_NAMES[step.op]
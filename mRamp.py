@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Slew-rate-limited ramp generator for the motor driver. Instead of jumping
+the duty cycle or flipping the direction at speed, the caller sets a
+target speed and direction and a timer thread moves the motor towards it
+at a limited acceleration (%/s), optionally with a jerk limit (%/s^2) for
+an S-curve profile. A reversal ramps down to zero, dwells for
+reversalDelay seconds and then ramps up in the new direction, which
+avoids the current and load spikes of an instant reversal.
+
+The velocity is kept as a signed duty cycle (positive = forward). The
+thread paces itself with cLoopScheduler and sleeps on an event once the
+target is reached, so setTarget() never blocks the caller and an idle
+ramp costs nothing. update() can also be called directly from a
+single-threaded (e.g. simulated) loop instead of starting the thread.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import math
+import threading
+import time
+
+from mScheduler import cLoopScheduler
+
+
+class cRampGenerator:
+    def __init__(self, motor, acceleration=50.0, jerk=None,
+                 reversalDelay=0.1, rate=100, clock=time):
+        self.motor = motor
+        self.acceleration = acceleration    # maximum slew rate (%/s)
+        self.jerk = jerk                    # maximum change of slew (%/s^2)
+        self.reversalDelay = reversalDelay  # dwell at zero speed (sec)
+        self.rate = rate                    # update rate of the thread (Hz)
+        self.clock = clock
+        # signed duty cycle applied to the motor (%); starts from the motor
+        self.velocity = float(motor.speed if motor.direction else
+                              -motor.speed)
+        self.slew = 0.0       # current rate of change of velocity (%/s)
+        self.updates = 0      # number of ramp steps applied
+        self.__target = (float(motor.speed), motor.direction,
+                         motor.enabled)  # speed, direction, enabled
+        self.__tPrior = None
+        self.__dwellEnd = None
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__running = False
+        self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __run(self):
+        scheduler = cLoopScheduler(self.rate, self.clock)
+        while self.__running:
+            self.__wake.clear()
+            if self.settled():
+                self.__wake.wait()  # idle until a new target is set
+                self.__tPrior = None
+                scheduler.start()
+                continue
+            scheduler.wait()
+            self.update(self.clock.monotonic())
+
+    def start(self):
+        """
+        start the ramp thread
+        """
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="Ramp")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        stop the ramp thread; the motor keeps its current speed
+        """
+        self.__running = False
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def setTarget(self, speed, direction=None, enabled=1):
+        """
+        ramp to speed (%) in direction (1 = forward, 0 = backward, None
+        keeps the target direction); with enabled=0 the driver is disabled
+        once the motor has ramped down to rest. Never blocks.
+        """
+        if direction is None:
+            direction = self.__target[1]
+        self.__target = (min(max(speed, 0.0), 100.0), direction, enabled)
+        self.__wake.set()
+
+    def target(self):  # returns the target (speed, direction, enabled)
+        return self.__target
+
+    def brake(self):
+        """
+        stop immediately: zero the speed and disable the driver (e.g. at
+        a load limit or on a fault); the next setTarget ramps up from rest
+        """
+        with self.__lock:
+            self.__target = (0.0, self.__target[1], 0)
+            self.velocity = 0.0
+            self.slew = 0.0
+            self.__dwellEnd = None
+            self.motor.apply(self.motor.direction, 0, 0)
+
+    def settled(self):
+        """
+        returns True when the motor runs at the target speed and direction
+        """
+        speed, direction, enabled = self.__target
+        return (self.velocity == (speed if direction == 1 else -speed) and
+                self.slew == 0.0 and self.__dwellEnd is None and
+                (enabled or not self.motor.enabled))
+
+    def wait(self, timeout=None):
+        """
+        block until the target is reached; returns False on a timeout
+        """
+        tEnd = None if timeout is None else self.clock.monotonic() + timeout
+        while not self.settled():
+            if tEnd is not None and self.clock.monotonic() > tEnd:
+                return False
+            self.clock.sleep(1.0 / self.rate)
+        return True
+
+    def update(self, now):
+        """
+        advance the ramp to time now and apply it to the motor
+        """
+        with self.__lock:
+            dt = 0.0 if self.__tPrior is None else max(0.0, now -
+                                                        self.__tPrior)
+            self.__tPrior = now
+            speed, direction, enabled = self.__target
+            target = speed if direction == 1 else -speed
+            velocity = self.velocity
+            if self.__dwellEnd is not None:
+                if now < self.__dwellEnd:
+                    return
+                self.__dwellEnd = None
+            error = target - velocity
+            if self.jerk:
+                # S-curve: limit the change of slew and start easing off
+                # early enough to arrive at the target without overshoot
+                slew = math.copysign(min(self.acceleration, math.sqrt(
+                    2.0 * self.jerk * abs(error))), error)
+                change = self.jerk * dt
+                self.slew += min(max(slew - self.slew, -change), change)
+            else:
+                self.slew = math.copysign(self.acceleration, error) \
+                    if error else 0.0
+            step = self.slew * dt
+            if step * error >= 0 and abs(step) >= abs(error):  # arrived
+                velocity = target
+                self.slew = 0.0
+            else:
+                velocity += step
+            if target * self.velocity < 0 and velocity * self.velocity <= 0:
+                # reversal reached zero: stop and dwell before reversing
+                velocity = 0.0
+                self.slew = 0.0
+                self.__dwellEnd = now + self.reversalDelay
+            self.velocity = velocity
+            if velocity > 0:
+                motorDirection = 1
+            elif velocity < 0:
+                motorDirection = 0
+            else:
+                motorDirection = self.motor.direction
+            self.motor.apply(motorDirection, abs(velocity),
+                             1 if (enabled or velocity) else 0)
+            self.updates += 1
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Binary time-series recorder for the control loop. Fixed-width records are
+written into a preallocated, memory-mapped file with struct.pack_into, so an
+append is O(1) and needs no per-sample buffers. The file grows in large
+chunks (doubling) when full. The record count in the header is updated after
+every record, so a recording cut short by a power failure stays readable.
+
+Each record holds the timestamp, raw ADC count, calibrated load, PWM duty
+cycle, direction, cycle count and a fail flag. loadRecording() exposes a
+file as a numpy structured array (memory-mapped, no copy) for post-test
+analysis; iterRecords() does the same without numpy.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import mmap
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # only required by loadRecording
+
+
+MAGIC = b'FBPREC01'
+HEADER = struct.Struct('<8sII')  # magic, record size, record count
+COUNT = struct.Struct('<I')      # record count, at offset 12 of the header
+RECORD = struct.Struct('<didfBIB')
+# numpy equivalent of RECORD (packed, little endian)
+RECORD_FIELDS = [('time', '<f8'),       # clock time (sec)
+                 ('raw', '<i4'),        # signed ADC count
+                 ('load', '<f8'),       # calibrated load (kg)
+                 ('duty', '<f4'),       # PWM duty cycle (%)
+                 ('direction', 'u1'),   # 1 = forward, 0 = backward
+                 ('cycle', '<u4'),      # load cycle counter
+                 ('fail', 'u1')]        # 1 = failed or stale reading
+
+
+class cRecorder:
+    def __init__(self, path, capacity=65536):
+        self.path = path
+        self.count = 0  # records written
+        self.__file = open(path, 'w+b')
+        self.__map = None
+        self.__resize(capacity)
+        HEADER.pack_into(self.__map, 0, MAGIC, RECORD.size, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __resize(self, capacity):
+        # (re)map the file with room for capacity records
+        if self.__map is not None:
+            self.__map.close()
+        self.capacity = capacity
+        self.__file.truncate(HEADER.size + capacity * RECORD.size)
+        self.__map = mmap.mmap(self.__file.fileno(), 0)
+
+    def append(self, t, raw, load, duty, direction, cycle, fail=0):
+        """
+        append one record; O(1) apart from doubling the file when full
+        """
+        if self.count == self.capacity:
+            self.__resize(self.capacity * 2)
+        RECORD.pack_into(self.__map, HEADER.size + self.count * RECORD.size,
+                         t, raw, load, duty, direction, cycle, fail)
+        self.count += 1
+        COUNT.pack_into(self.__map, 12, self.count)
+
+    def flush(self):
+        self.__map.flush()
+
+    def close(self):
+        """
+        flush the records and trim the unused preallocated space
+        """
+        if self.__map is None:
+            return
+        self.__map.flush()
+        self.__map.close()
+        self.__map = None
+        self.__file.truncate(HEADER.size + self.count * RECORD.size)
+        self.__file.close()
+
+
+def readHeader(path):
+    """
+    returns the number of records in a recording
+    """
+    with open(path, 'rb') as f:
+        magic, size, count = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError("readHeader: %s is not a Fly-by-Pi recording" % path)
+    return count
+
+
+def loadRecording(path):
+    """
+    returns the records of a recording as a memory-mapped numpy structured
+    array with the fields of RECORD_FIELDS
+    """
+    if numpy is None:
+        raise ImportError("numpy not found")
+    count = readHeader(path)
+    if count == 0:
+        return numpy.zeros(0, dtype=numpy.dtype(RECORD_FIELDS))
+    return numpy.memmap(path, dtype=numpy.dtype(RECORD_FIELDS), mode='r',
+                        offset=HEADER.size, shape=(count,))
+
+
+def iterRecords(path):
+    """
+    yields the records of a recording as tuples in RECORD_FIELDS order
+    """
+    count = readHeader(path)
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for n in range(count):
+                yield RECORD.unpack_from(data, HEADER.size + n * RECORD.size)
+        finally:
+            data.close()
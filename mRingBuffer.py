@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Fixed size ring buffer of timestamped samples for passing data from a
+single producer thread (e.g. ADC acquisition) to a single consumer thread
+(e.g. the control loop) without locks. The producer fills a slot before
+publishing it by advancing the write counter; the consumer only ever reads
+published slots and detects when the producer has lapped it. drain()
+returns a list of (time, value) pairs; drainArrays() copies the same
+samples as two arrays for vectorised (numpy) processing.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+from array import array
+
+
+class cRingBuffer:
+    def __init__(self, capacity=1024):
+        if capacity < 2:
+            raise ValueError("cRingBuffer: capacity must be at least 2")
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity   # sample timestamps
+        self.values = array('d', [0.0]) * capacity  # sample values
+        self.head = 0      # number of samples published (next sequence no.)
+        self.tail = 0      # sequence number of the next sample to drain
+        self.overruns = 0  # samples overwritten before they were drained
+
+    def __len__(self):  # number of samples waiting to be drained
+        return min(self.head - self.tail, self.capacity)
+
+    def push(self, t, value):  # producer side: store and publish a sample
+        i = self.head % self.capacity
+        self.times[i] = t
+        self.values[i] = value
+        self.head += 1  # publish only once the slot is complete
+
+    def latest(self):  # newest sample as (sequence, time, value) or None
+        head = self.head
+        if head == 0:
+            return None
+        i = (head - 1) % self.capacity
+        return head - 1, self.times[i], self.values[i]
+
+    def drain(self, maxItems=None):  # consumer side: take unread samples
+        head = self.head
+        tail = self.tail
+        if head - tail > self.capacity:  # producer lapped the consumer
+            self.overruns += head - tail - self.capacity
+            tail = head - self.capacity
+        if maxItems is not None and head - tail > maxItems:
+            head = tail + maxItems
+        times = self.times
+        values = self.values
+        capacity = self.capacity
+        batch = [(times[n % capacity], values[n % capacity])
+                 for n in range(tail, head)]
+        # discard slots the producer may have been rewriting during the copy
+        lost = min(self.head - capacity + 1 - tail, len(batch))
+        if lost > 0:
+            self.overruns += lost
+            batch = batch[lost:]
+        self.tail = head
+        return batch
+
+    def drainArrays(self, maxItems=None):  # consumer side: as drain() in arrays
+        head = self.head
+        tail = self.tail
+        if head - tail > self.capacity:  # producer lapped the consumer
+            self.overruns += head - tail - self.capacity
+            tail = head - self.capacity
+        if maxItems is not None and head - tail > maxItems:
+            head = tail + maxItems
+        capacity = self.capacity
+        start = tail % capacity
+        end = start + head - tail
+        if end <= capacity:  # contiguous slice copies
+            times = self.times[start:end]
+            values = self.values[start:end]
+        else:  # the batch wraps around the end of the buffer
+            times = self.times[start:] + self.times[:end - capacity]
+            values = self.values[start:] + self.values[:end - capacity]
+        # discard slots the producer may have been rewriting during the copy
+        lost = min(self.head - capacity + 1 - tail, len(times))
+        if lost > 0:
+            self.overruns += lost
+            del times[:lost]
+            del values[:lost]
+        self.tail = head
+        return times, values
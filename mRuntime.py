@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+asyncio runtime for running acquisition, control, telemetry, logging and
+command handling as concurrent tasks instead of one blocking loop. Tasks
+pass data through bounded cChannel queues: a full channel either makes
+the producer wait (backpressure) or, for live data where only the newest
+matters, drops the oldest item. Blocking calls (e.g. I2C reads) are run
+in a worker thread with offload() so they never stall the event loop.
+
+Every task gets a cTask with histograms of its wake-up latency (how late
+a periodic task woke after its deadline), its work per iteration and the
+queue latency (age of the items it takes from channels). A monitor task
+measures the lag of the event loop itself. stats() and report() return
+the per-task and per-channel metrics.
+
+    runtime = cRuntime()
+    samples = runtime.channel("samples", 256)
+
+    async def acquire(task):
+        while True:
+            await samples.put(await runtime.offload(adc.read_count, 1))
+
+    async def control(task):
+        async for tick in task.ticks(60):
+            for count in samples.drain(task):
+                ...
+
+    runtime.task("acquire", acquire)
+    runtime.task("control", control)
+    runtime.run(duration=60)
+
+The clock may be the time module or a sped-up simulation clock
+(mSimulator.cSimClock with a speedup factor).
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import asyncio
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mScheduler import cLatencyHistogram
+
+# Per-task metrics; times in seconds
+TaskStats = collections.namedtuple('TaskStats', [
+    'name', 'runs', 'overruns',
+    'latency_p50', 'latency_p99', 'latency_max',
+    'work_p50', 'work_p99', 'work_max',
+    'queue_p50', 'queue_p99', 'queue_max'])
+
+# Per-channel metrics: items put, items dropped (dropOldest), puts that had
+# to wait for room (backpressure), current and highest depth
+ChannelStats = collections.namedtuple('ChannelStats', [
+    'name', 'maxsize', 'depth', 'high_water', 'put', 'dropped', 'blocked'])
+
+
+class cChannel:
+    """
+    bounded FIFO between tasks; items are stamped with the clock time when
+    they are put so consumers can measure the queue latency
+    """
+
+    def __init__(self, name, maxsize, dropOldest=False, clock=time):
+        if maxsize < 1:
+            raise ValueError("cChannel: maxsize must be at least 1")
+        self.name = name
+        self.maxsize = maxsize
+        self.dropOldest = dropOldest  # False = backpressure
+        self.clock = clock
+        self.putCount = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.highWater = 0
+        self.__items = collections.deque()
+        self.__readers = collections.deque()  # futures of waiting getters
+        self.__writers = collections.deque()  # futures of waiting putters
+
+    def __len__(self):
+        return len(self.__items)
+
+    def full(self):
+        return len(self.__items) >= self.maxsize
+
+    @staticmethod
+    def __wakeOne(waiters):
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def putNowait(self, item):
+        """
+        put an item without waiting; returns False if the channel is full
+        (with dropOldest the oldest item is discarded instead)
+        """
+        items = self.__items
+        if len(items) >= self.maxsize:
+            if not self.dropOldest:
+                return False
+            items.popleft()
+            self.dropped += 1
+        items.append((self.clock.monotonic(), item))
+        self.putCount += 1
+        if len(items) > self.highWater:
+            self.highWater = len(items)
+        self.__wakeOne(self.__readers)
+        return True
+
+    async def put(self, item):
+        """
+        put an item, waiting for room while the channel is full (unless
+        dropOldest is set)
+        """
+        if self.full() and not self.dropOldest:
+            self.blocked += 1
+            while self.full():
+                waiter = asyncio.get_running_loop().create_future()
+                self.__writers.append(waiter)
+                await waiter
+        self.putNowait(item)
+
+    def __take(self, task):
+        t, item = self.__items.popleft()
+        if task is not None:
+            task.queue.record((self.clock.monotonic() - t) * 1e6)
+        self.__wakeOne(self.__writers)
+        return item
+
+    async def get(self, task=None):
+        """
+        wait for and return the oldest item; task records the queue latency
+        """
+        while not self.__items:
+            waiter = asyncio.get_running_loop().create_future()
+            self.__readers.append(waiter)
+            await waiter
+        return self.__take(task)
+
+    def drain(self, task=None):
+        """
+        returns all waiting items without waiting (oldest first)
+        """
+        items = []
+        while self.__items:
+            items.append(self.__take(task))
+        return items
+
+    def stats(self):
+        return ChannelStats(self.name, self.maxsize, len(self.__items),
+                            self.highWater, self.putCount, self.dropped,
+                            self.blocked)
+
+
+class cTask:
+    """
+    handle and metrics of one runtime task, passed to its coroutine
+    """
+
+    def __init__(self, runtime, name):
+        self.runtime = runtime
+        self.name = name
+        self.latency = cLatencyHistogram()  # wake-up latency (us)
+        self.work = cLatencyHistogram()     # work per iteration (us)
+        self.queue = cLatencyHistogram()    # age of consumed items (us)
+        self.runs = 0
+        self.overruns = 0  # periodic iterations that ran past a deadline
+        self.__resumed = None
+
+    def __begin(self, now):
+        # end of the waiting: start timing the work of the iteration
+        self.__resumed = now
+        self.runs += 1
+
+    def __end(self, now):
+        # the iteration waits again: record its work
+        if self.__resumed is not None:
+            self.work.record((now - self.__resumed) * 1e6)
+            self.__resumed = None
+
+    async def ticks(self, frequency):
+        """
+        async iterator yielding the iteration number at a fixed rate;
+        deadlines are absolute and missed periods are skipped
+        """
+        clock = self.runtime.clock
+        period = 1.0 / frequency
+        deadline = clock.monotonic() + period
+        n = 0
+        while True:
+            now = clock.monotonic()
+            self.__end(now)
+            if now > deadline:
+                self.overruns += 1
+                deadline += ((now - deadline) // period) * period
+            await self.runtime.sleep(deadline - now)
+            now = clock.monotonic()
+            self.latency.record((now - deadline) * 1e6)
+            self.__begin(now)
+            deadline += period
+            n += 1
+            yield n
+
+    async def iterate(self):
+        """
+        async iterator for a free-running task (e.g. one paced by blocking
+        reads in offload); every iteration counts as one run
+        """
+        clock = self.runtime.clock
+        n = 0
+        while True:
+            now = clock.monotonic()
+            self.__end(now)
+            self.__begin(now)
+            n += 1
+            yield n
+
+    async def consume(self, channel):
+        """
+        async iterator yielding the items of a channel as they arrive
+        """
+        clock = self.runtime.clock
+        while True:
+            self.__end(clock.monotonic())
+            item = await channel.get(self)
+            self.__begin(clock.monotonic())
+            yield item
+
+    def stats(self):
+        latency = self.latency
+        work = self.work
+        queue = self.queue
+        return TaskStats(self.name, self.runs, self.overruns,
+                         latency.percentile(50) / 1e6,
+                         latency.percentile(99) / 1e6, latency.max / 1e6,
+                         work.percentile(50) / 1e6, work.percentile(99) / 1e6,
+                         work.max / 1e6,
+                         queue.percentile(50) / 1e6,
+                         queue.percentile(99) / 1e6, queue.max / 1e6)
+
+
+class cRuntime:
+    def __init__(self, clock=time, workers=1, monitorInterval=0.01):
+        if hasattr(clock, "speedup") and clock.speedup is None:
+            raise ValueError("cRuntime: the clock must run in real time "
+                             "(cSimClock needs a speedup factor)")
+        self.clock = clock
+        # a simulation clock runs speedup times faster than real time
+        self.speedup = getattr(clock, "speedup", None) or 1.0
+        self.monitorInterval = monitorInterval  # event loop lag check (sec)
+        self.tasks = []
+        self.channels = []
+        self.loop = None
+        self.__executor = ThreadPoolExecutor(workers)
+        self.__coroutines = []
+        self.__stopped = None
+
+    def channel(self, name, maxsize, dropOldest=False):
+        """
+        returns a new bounded channel registered for the statistics
+        """
+        channel = cChannel(name, maxsize, dropOldest, self.clock)
+        self.channels.append(channel)
+        return channel
+
+    def task(self, name, function, *args):
+        """
+        add a task: function(task, *args) is a coroutine function that
+        runs until the runtime stops; returns the cTask
+        """
+        task = cTask(self, name)
+        self.tasks.append(task)
+        self.__coroutines.append((task, function, args))
+        return task
+
+    async def sleep(self, seconds):
+        """
+        sleep for seconds of the runtime clock
+        """
+        await asyncio.sleep(max(0.0, seconds) / self.speedup)
+
+    async def offload(self, function, *args):
+        """
+        run a blocking function in the worker thread and return its result
+        """
+        return await self.loop.run_in_executor(self.__executor, function,
+                                               *args)
+
+    def post(self, channel, item):
+        """
+        put an item into a channel from another thread or a signal handler
+        (dropped if the channel is full)
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(channel.putNowait, item)
+
+    def stop(self):
+        """
+        stop all tasks; may be called from any task or thread
+        """
+        if self.loop is not None and self.__stopped is not None:
+            self.loop.call_soon_threadsafe(self.__stopped.set)
+
+    async def __monitor(self, task):
+        # event loop lag: how late a short sleep wakes up
+        async for tick in task.ticks(1.0 / self.monitorInterval):
+            pass
+
+    async def __main(self, duration):
+        self.loop = asyncio.get_running_loop()
+        self.__stopped = asyncio.Event()
+        monitor = cTask(self, "event loop")
+        self.tasks.insert(0, monitor)
+        running = [asyncio.ensure_future(self.__monitor(monitor))]
+        running += [asyncio.ensure_future(function(task, *args))
+                    for task, function, args in self.__coroutines]
+        stopped = asyncio.ensure_future(self.__stopped.wait())
+        timeout = None if duration is None else duration / self.speedup
+        try:
+            done, pending = await asyncio.wait(
+                running + [stopped], timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for future in running + [stopped]:
+                future.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        for future in done:  # a task that ended with an error stops the run
+            if future is not stopped and not future.cancelled() and \
+                    future.exception() is not None:
+                raise future.exception()
+
+    def run(self, duration=None):
+        """
+        run the tasks until one of them ends, stop() is called or after
+        duration seconds (None = no limit)
+        """
+        try:
+            asyncio.run(self.__main(duration))
+        finally:
+            self.loop = None
+            self.__executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        returns TaskStats of every task and ChannelStats of every channel
+        """
+        return ([task.stats() for task in self.tasks],
+                [channel.stats() for channel in self.channels])
+
+    def report(self):
+        """
+        returns the task and channel metrics as a printable table
+        """
+        tasks, channels = self.stats()
+        lines = ["%-12s %8s %5s  %-23s %-23s %-23s" % (
+            "Task", "Runs", "Over", "Latency p50/p99/max ms",
+            "Work p50/p99/max ms", "Queue p50/p99/max ms")]
+        for s in tasks:
+            lines.append("%-12s %8i %5i  %6.2f/%6.2f/%8.2f  %6.2f/%6.2f/%8.2f"
+                         "  %6.2f/%6.2f/%8.2f" % (
+                             s.name, s.runs, s.overruns, s.latency_p50 * 1e3,
+                             s.latency_p99 * 1e3, s.latency_max * 1e3,
+                             s.work_p50 * 1e3, s.work_p99 * 1e3,
+                             s.work_max * 1e3, s.queue_p50 * 1e3,
+                             s.queue_p99 * 1e3, s.queue_max * 1e3))
+        lines.append("%-12s %8s %8s %8s %8s %8s %8s" % (
+            "Channel", "Size", "Depth", "High", "Put", "Dropped", "Blocked"))
+        for s in channels:
+            lines.append("%-12s %8i %8i %8i %8i %8i %8i" % (
+                s.name, s.maxsize, s.depth, s.high_water, s.put, s.dropped,
+                s.blocked))
+        return "\n".join(lines)
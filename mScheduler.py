@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Fixed-rate loop scheduler for the control loop. Deadlines are absolute
+(start + n * period, in integer nanoseconds from time.monotonic_ns) so
+timing errors do not accumulate. Every iteration records the wake-up
+latency (how late the loop woke after its deadline) and the work time
+(from waking to the next wait) in histograms. Iterations that run past
+the next deadline are counted as overruns and any whole periods missed
+are skipped rather than caught up in a burst.
+
+Optionally the loop thread is switched to the SCHED_FIFO real-time policy
+and pinned to a CPU core (Linux, requires root).
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import os
+import time
+from array import array
+from collections import namedtuple
+
+
+# Loop timing statistics; times in seconds
+LoopStats = namedtuple('LoopStats', [
+    'iterations', 'overruns', 'frequency',
+    'latency_p50', 'latency_p99', 'latency_max',
+    'work_p50', 'work_p99', 'work_max'])
+
+
+class cLatencyHistogram:
+    """
+    Histogram of durations in microseconds with about 1% resolution: 1 us
+    bins below 1 ms, then 100 bins per decade up to 1000 s. Recording is
+    O(1) and needs no allocation; percentiles are read from the bins.
+    """
+    DECADES = 6  # decades above 1 ms (1 ms .. 1000 s)
+
+    def __init__(self):
+        self.bins = array('L', [0]) * (1000 + 900 * self.DECADES)
+        self.count = 0
+        self.total = 0  # sum of all recorded values (us)
+        self.max = 0    # largest recorded value (us)
+
+    def record(self, us):
+        us = int(us)
+        if us < 0:
+            us = 0
+        if us < 1000:
+            index = us
+        else:
+            # decade d covers 10**(3+d) .. 10**(4+d) us in 10**(1+d) us bins
+            decade = 0
+            while us >= 10 ** (4 + decade) and decade < self.DECADES - 1:
+                decade += 1
+            index = 1000 + 900 * decade + us // 10 ** (1 + decade) - 100
+        self.bins[min(index, len(self.bins) - 1)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def __value(self, index):
+        # lower edge (us) of a bin
+        if index < 1000:
+            return index
+        decade, offset = divmod(index - 1000, 900)
+        return (offset + 100) * 10 ** (decade + 1)
+
+    def percentile(self, p):
+        """
+        returns the p-th percentile (0-100) in microseconds
+        """
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index, n in enumerate(self.bins):
+            seen += n
+            if seen >= target:
+                return min(self.__value(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self):
+        for index in range(len(self.bins)):
+            self.bins[index] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class cLoopScheduler:
+    def __init__(self, frequency, clock=time, priority=None, cpu=None):
+        self.period = int(round(1e9 / frequency))  # loop period (ns)
+        self.clock = clock
+        self.priority = priority  # SCHED_FIFO priority (1-99) or None
+        self.cpu = cpu            # CPU core to pin the loop to or None
+        self.latency = cLatencyHistogram()  # wake-up latency (us)
+        self.work = cLatencyHistogram()     # work per iteration (us)
+        self.iterations = 0
+        self.overruns = 0  # iterations that ran past the next deadline
+        self.realtime = False  # True once SCHED_FIFO was applied
+        self.pinned = False    # True once the CPU affinity was applied
+        self.__tStart = 0
+        self.__deadline = 0
+        self.__wake = None
+
+    def __iter__(self):
+        self.start()
+        while True:
+            yield self.wait()
+
+    def start(self):
+        """
+        apply the real-time settings to the calling thread and set the
+        first deadline one period from now
+        """
+        if self.priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO,
+                                      os.sched_param(self.priority))
+                self.realtime = True
+            except (AttributeError, OSError):
+                self.realtime = False  # not Linux or not running as root
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+                self.pinned = True
+            except (AttributeError, OSError):
+                self.pinned = False
+        self.__tStart = self.clock.monotonic_ns()
+        self.__deadline = self.__tStart + self.period
+        self.__wake = None
+
+    def wait(self):
+        """
+        sleep until the next deadline and return the iteration number
+        """
+        clock = self.clock
+        now = clock.monotonic_ns()
+        if self.__wake is not None:
+            self.work.record((now - self.__wake) // 1000)
+        deadline = self.__deadline
+        if now > deadline:
+            # the iteration overran its period; skip any whole periods that
+            # were missed instead of running a burst of late iterations
+            self.overruns += 1
+            deadline += ((now - deadline) // self.period) * self.period
+        if deadline > now:
+            clock.sleep((deadline - now) / 1e9)
+            now = clock.monotonic_ns()
+        self.latency.record((now - deadline) // 1000)
+        self.__wake = now
+        self.__deadline = deadline + self.period
+        self.iterations += 1
+        return self.iterations
+
+    def stats(self):
+        """
+        returns LoopStats for the iterations so far
+        """
+        elapsed = (self.clock.monotonic_ns() - self.__tStart) / 1e9
+        latency = self.latency
+        work = self.work
+        return LoopStats(
+            self.iterations, self.overruns,
+            self.iterations / elapsed if elapsed > 0 else 0.0,
+            latency.percentile(50) / 1e6, latency.percentile(99) / 1e6,
+            latency.max / 1e6,
+            work.percentile(50) / 1e6, work.percentile(99) / 1e6,
+            work.max / 1e6)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Ring buffer in shared memory (multiprocessing.shared_memory) for passing
+the records of the control loop to other processes, so recording, the
+status display and telemetry do not compete with acquisition and control
+for the GIL of one interpreter. The control process creates a
+cSharedRingBuffer and pushes one record (a fixed number of floats) per
+control cycle; it never waits on a consumer. Every consumer process
+attaches a cSharedRingReader with its own read position, so any number
+of consumers can read the same stream.
+
+As with cRingBuffer (mRingBuffer.py) a slot is written before the head
+counter is advanced and a reader that is lapped by the producer skips the
+overwritten records and counts them as overruns.
+
+cConsumerProcess runs a consumer in its own process: handler =
+factory(*args) is created in the child (e.g. opening the recording file
+there) and called with every batch of new records until stop(); the
+remaining records are handled and handler.close() is called, if present.
+
+    ring = cSharedRingBuffer(("time", "load"), 4096)
+    recorder = cConsumerProcess(ring, cWriter, ("test.rec",))
+    recorder.start()
+    while running:
+        ring.push((now, load))
+    recorder.stop()
+    ring.close()
+
+Layout: header magic b'FBPR', version (u32), capacity (u32), width (u32),
+head (u64, records pushed), followed by capacity records of width
+float64 values.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import multiprocessing
+import signal
+import struct
+import time
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None  # Python < 3.8
+
+MAGIC = b'FBPR'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+HEAD_OFFSET = HEADER.size      # u64 head counter, 8 byte aligned
+DATA_OFFSET = HEAD_OFFSET + 8
+
+
+class cSharedRingBuffer:
+    """
+    producer side: creates the shared memory block (name None = a unique
+    name) for capacity records with one float per field
+    """
+
+    def __init__(self, fields, capacity=4096, name=None):
+        if shared_memory is None:
+            raise ImportError("multiprocessing.shared_memory not found "
+                              "(requires Python 3.8)")
+        if capacity < 2:
+            raise ValueError("cSharedRingBuffer: capacity must be at least 2")
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.record = struct.Struct('<%id' % len(self.fields))
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=True,
+            size=DATA_OFFSET + capacity * self.record.size)
+        self.name = self.shm.name
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, capacity,
+                         len(self.fields))
+        self.__head = self.shm.buf[HEAD_OFFSET:DATA_OFFSET].cast('Q')
+        self.__head[0] = 0
+        self.head = 0  # records pushed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def push(self, record):
+        """
+        store and publish one record (a sequence of len(fields) numbers)
+        """
+        head = self.head
+        self.record.pack_into(self.shm.buf, DATA_OFFSET + (
+            head % self.capacity) * self.record.size, *record)
+        self.head = head + 1
+        self.__head[0] = head + 1  # publish only once the slot is complete
+
+    def close(self):
+        """
+        release and remove the shared memory block; call after the
+        consumers have stopped
+        """
+        if self.shm is None:
+            return
+        self.__head.release()
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class cSharedRingReader:
+    """
+    consumer side: attaches to the cSharedRingBuffer called name; drain()
+    returns the records not yet read by this reader (as namedtuples of the
+    fields when they are given)
+    """
+
+    def __init__(self, name, fields=None):
+        if shared_memory is None:
+            raise ImportError("multiprocessing.shared_memory not found "
+                              "(requires Python 3.8)")
+        self.shm = shared_memory.SharedMemory(name=name)
+        magic, version, capacity, width = HEADER.unpack_from(self.shm.buf)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError("cSharedRingReader: %s is not a ring buffer"
+                             % name)
+        if fields is not None and len(fields) != width:
+            self.shm.close()
+            raise ValueError("cSharedRingReader: %s holds %i fields, not %i"
+                             % (name, width, len(fields)))
+        self.capacity = capacity
+        self.record = struct.Struct('<%id' % width)
+        self.Record = None if fields is None else \
+            collections.namedtuple('Record', fields)
+        self.__head = self.shm.buf[HEAD_OFFSET:DATA_OFFSET].cast('Q')
+        self.tail = 0      # next record to read
+        self.overruns = 0  # records overwritten before they were read
+
+    def __len__(self):  # number of records waiting
+        return min(self.__head[0] - self.tail, self.capacity)
+
+    def drain(self, maxItems=None):
+        head = self.__head[0]
+        tail = self.tail
+        capacity = self.capacity
+        if head - tail > capacity:  # the producer lapped the reader
+            self.overruns += head - tail - capacity
+            tail = head - capacity
+        if maxItems is not None and head - tail > maxItems:
+            head = tail + maxItems
+        unpack = self.record.unpack_from
+        buf = self.shm.buf
+        size = self.record.size
+        batch = [unpack(buf, DATA_OFFSET + (n % capacity) * size)
+                 for n in range(tail, head)]
+        # discard slots the producer may have been rewriting during the copy
+        lost = min(self.__head[0] - capacity + 1 - tail, len(batch))
+        if lost > 0:
+            self.overruns += lost
+            batch = batch[lost:]
+        self.tail = head
+        if self.Record is not None:
+            batch = [self.Record._make(record) for record in batch]
+        return batch
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.__head.release()
+        self.shm.close()
+        self.shm = None
+
+
+def _consume(name, fields, factory, args, interval, stopped):
+    # body of a consumer process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # stopped by the producer
+    reader = cSharedRingReader(name, fields)
+    handler = factory(*args)
+    try:
+        while True:
+            stopping = stopped.is_set()
+            batch = reader.drain()
+            if batch:
+                handler(batch)
+            elif stopping:
+                break  # everything pushed before stop() has been handled
+            else:
+                time.sleep(interval)
+    finally:
+        if hasattr(handler, "close"):
+            handler.close()
+        reader.close()
+
+
+class cConsumerProcess:
+    """
+    runs factory(*args)(records) in its own process for every batch of new
+    records of ring, polling every interval seconds
+    """
+
+    def __init__(self, ring, factory, args=(), interval=0.02, name=None):
+        self.stopped = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_consume, name=name,
+            args=(ring.name, ring.fields, factory, args, interval,
+                  self.stopped))
+        self.process.daemon = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.process.start()
+
+    def stop(self, timeout=5.0):
+        """
+        let the consumer handle the remaining records and wait for it to
+        exit; returns False if it had to be terminated
+        """
+        self.stopped.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+            return False
+        return True
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Deterministic simulation backends for running the control code off the
+Raspberry Pi (CI, profiling and regression benchmarks):
+
+* cSimClock   - virtual or accelerated clock (monotonic, time, sleep)
+* cSimGPIO    - stand-in for the RPi.GPIO module, including software PWM
+* cSimMCP3424 - smbus compatible MCP3424 model with per-bitrate conversion
+                latency, continuous/one-shot modes, noise and I2C errors
+* cSimPlant   - linear actuator pushing on a load cell, driven by the
+                simulated PWM duty cycle, direction and enable pins
+* cSimRig     - convenience bundle wiring the above together
+
+The backends are injected with ADCDifferentialPi(bus=..., clock=...) and
+cMotorDriver(gpio=...). Random noise and bus errors use a seeded generator
+so runs are repeatable.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import random
+import threading
+import time
+
+from mMCP3424 import build_decode_profile
+from mMotorDriver import PIN_MAPS
+
+
+class cSimClock:
+    """
+    Simulation clock. With speedup=None time only advances when sleep() is
+    called, so a single threaded loop runs as fast as the CPU allows. With
+    a speedup factor the clock runs that many times faster than real time,
+    which keeps background threads (e.g. ADCStream) consistent.
+    """
+
+    def __init__(self, speedup=None, epoch=1.6e9):
+        self.speedup = speedup
+        self.epoch = epoch  # value of time() at the start of the simulation
+        self.__t = 0.0
+        self.__lock = threading.Lock()
+        self.__real0 = time.monotonic()
+
+    def monotonic(self):
+        if self.speedup is None:
+            return self.__t
+        return (time.monotonic() - self.__real0) * self.speedup
+
+    def time(self):
+        return self.epoch + self.monotonic()
+
+    def monotonic_ns(self):
+        return int(self.monotonic() * 1e9)
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.speedup is None:
+            with self.__lock:
+                self.__t += seconds
+        else:
+            time.sleep(seconds / self.speedup)
+
+
+class cSimPWM:
+    # software PWM channel returned by cSimGPIO.PWM
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.dutyCycle = 0.0
+        self.running = False
+
+    def start(self, dutyCycle):
+        self.running = True
+        self.ChangeDutyCycle(dutyCycle)
+
+    def ChangeDutyCycle(self, dutyCycle):
+        if dutyCycle < 0 or dutyCycle > 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.gpio.writes += 1
+        self.dutyCycle = float(dutyCycle)
+        self.gpio.pwm[self.pin] = self.dutyCycle
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.running = False
+        self.gpio.pwm[self.pin] = 0.0
+
+
+class cSimGPIO:
+    """
+    Stand-in for the RPi.GPIO module. Pin levels and PWM duty cycles are
+    kept in dictionaries and every write is counted.
+    """
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}  # pin: output level
+        self.pwm = {}     # pin: duty cycle (%)
+        self.writes = 0   # number of output and duty cycle writes
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, initial=0):
+        if self.mode is None:
+            raise RuntimeError("Please set pin numbering mode using "
+                               "GPIO.setmode(GPIO.BOARD) or "
+                               "GPIO.setmode(GPIO.BCM)")
+        self.levels[pin] = initial
+
+    def output(self, pin, value):
+        if pin not in self.levels:
+            raise RuntimeError("The GPIO channel has not been set up as "
+                               "an OUTPUT")
+        self.writes += 1
+        self.levels[pin] = 1 if value else 0
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def PWM(self, pin, frequency):
+        return cSimPWM(self, pin, frequency)
+
+    def cleanup(self):
+        self.levels.clear()
+        self.pwm.clear()
+
+
+class cSimPlant:
+    """
+    Linear actuator pushing on a load cell through a linear spring. The
+    actuator speed is proportional to the PWM duty cycle above a static
+    friction dead band and drops towards zero as the load approaches the
+    stall load; the actuator follows speed changes with a first order lag
+    (timeConstant), so it coasts briefly when stopped. The plant state is
+    integrated up to the clock time whenever it is queried.
+    """
+
+    def __init__(self, gpio, clock, pins=(18, 27, 22), maxSpeed=10.0,
+                 deadBand=4.0, stallLoad=150.0, stiffness=10.0,
+                 contact=5.0, stroke=50.0, calibrationFactor=100.0,
+                 zeroVoltage=0.02, timeConstant=0.1, step=0.001):
+        self.gpio = gpio
+        self.clock = clock
+        self.pins = pins                # PWM, DIR, SLP
+        self.maxSpeed = maxSpeed        # actuator speed at 100% duty (mm/s)
+        self.deadBand = deadBand        # duty cycle needed to move (%)
+        self.stallLoad = stallLoad      # load at which the actuator stalls (kg)
+        self.stiffness = stiffness      # spring stiffness (kg/mm)
+        self.contact = contact          # position of first contact (mm)
+        self.stroke = stroke            # actuator stroke (mm)
+        self.calibrationFactor = calibrationFactor  # load cell (kg/V)
+        self.zeroVoltage = zeroVoltage  # load cell output at zero load (V)
+        self.timeConstant = timeConstant  # speed response lag (s)
+        self.step = step                # integration step (s)
+        self.position = 0.0             # actuator position (mm)
+        self.velocity = 0.0             # actuator speed (mm/s)
+        self.__t = clock.monotonic()
+        self.__lock = threading.Lock()
+
+    def __velocity(self):
+        pwmPin, dirPin, slpPin = self.pins
+        if not self.gpio.levels.get(slpPin, 0):
+            return 0.0
+        duty = self.gpio.pwm.get(pwmPin, 0.0)
+        if duty <= self.deadBand:
+            return 0.0
+        speed = self.maxSpeed * (duty - self.deadBand) / (100.0 - self.deadBand)
+        if self.gpio.levels.get(dirPin, 0):  # extend, against the load
+            return speed * max(0.0, 1.0 - self.load() / self.stallLoad)
+        return -speed
+
+    def update(self):
+        """
+        integrate the actuator position up to the current clock time
+        """
+        with self.__lock:
+            now = self.clock.monotonic()
+            while self.__t < now:
+                dt = min(self.step, now - self.__t)
+                lag = min(1.0, dt / self.timeConstant) \
+                    if self.timeConstant > 0 else 1.0
+                self.velocity += (self.__velocity() - self.velocity) * lag
+                position = self.position + self.velocity * dt
+                self.position = min(max(position, 0.0), self.stroke)
+                if self.position != position:  # end of stroke
+                    self.velocity = 0.0
+                self.__t += dt
+
+    def load(self):
+        return self.stiffness * max(0.0, self.position - self.contact)
+
+    def voltage(self):
+        """
+        load cell voltage at the current clock time
+        """
+        self.update()
+        return self.load() / self.calibrationFactor + self.zeroVoltage
+
+
+class cSimMCP3424:
+    """
+    smbus compatible model of one or more MCP3424 devices. sources maps an
+    (address, channel) pair or just a channel number to a callable that
+    returns the input voltage. Conversions take the nominal time of the
+    configured bitrate; noise (V rms) is added to each result and every
+    transaction fails with probability errorRate.
+    """
+
+    def __init__(self, clock, sources=None, noise=0.0, errorRate=0.0,
+                 seed=1, addresses=(0x68,)):
+        self.clock = clock
+        self.sources = dict(sources or {})
+        self.noise = noise
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        self.transactions = 0  # i2c transactions issued
+        self.errors = 0        # simulated bus errors
+        self.devices = {}
+        for address in addresses:
+            # power on default: continuous, channel 1, 12 bit, gain 1
+            self.devices[address] = {'config': 0x10, 'start': 0.0,
+                                     'value': 0, 'fresh': False,
+                                     'busy': True}
+
+    def __device(self, address):
+        self.transactions += 1
+        if address not in self.devices:
+            raise IOError(121, 'Remote I/O error')
+        if self.errorRate and self.random.random() < self.errorRate:
+            self.errors += 1
+            raise IOError(121, 'Remote I/O error')
+        return self.devices[address]
+
+    def __profile(self, config):
+        pga = (0.5, 1.0, 2.0, 4.0)[config & 0x03]
+        bitrate = (12, 14, 16, 18)[(config >> 2) & 0x03]
+        return build_decode_profile(bitrate, pga)
+
+    def __convert(self, address, device, tDone):
+        # complete the pending conversion with the input at time tDone
+        config = device['config']
+        profile = self.__profile(config)
+        channel = ((config >> 5) & 0x03) + 1
+        source = self.sources.get((address, channel),
+                                  self.sources.get(channel))
+        voltage = source() if source is not None else 0.0
+        if self.noise:
+            voltage += self.random.gauss(0.0, self.noise)
+        code = int(round(voltage / profile.scale))
+        limit = profile.sign_mask
+        device['value'] = min(max(code, -limit), limit - 1)
+        device['fresh'] = True
+        device['start'] = tDone
+
+    def __advance(self, address, device):
+        # bring the device state up to the current clock time
+        if not device['busy']:
+            return
+        period = self.__profile(device['config']).seconds_per_sample
+        now = self.clock.monotonic()
+        if now - device['start'] >= period:
+            if device['config'] & 0x10:  # continuous: skip missed results
+                elapsed = now - device['start']
+                tDone = device['start'] + period * int(elapsed / period)
+                self.__convert(address, device, tDone)
+            else:
+                self.__convert(address, device, device['start'] + period)
+                device['busy'] = False
+
+    def __configure(self, address, device, config):
+        changed = (config & 0x7F) != (device['config'] & 0x7F)
+        device['config'] = config & 0x7F
+        if (config & 0x10 and changed) or (config & 0x80 and
+                                           not config & 0x10):
+            # new continuous configuration or one-shot trigger
+            device['busy'] = True
+            device['start'] = self.clock.monotonic()
+
+    def write_byte(self, address, value):
+        device = self.__device(address)
+        self.__advance(address, device)
+        self.__configure(address, device, value)
+
+    def read_i2c_block_data(self, address, cmd, length):
+        device = self.__device(address)
+        self.__advance(address, device)
+        # the command byte is written as configuration before the read
+        self.__configure(address, device, cmd)
+        config = device['config'] | (0x00 if device['fresh'] else 0x80)
+        device['fresh'] = False
+        value = device['value']
+        if (config >> 2) & 0x03 == 3:  # 18 bit: three data bytes
+            code = value & 0x3FFFF
+            data = [(code >> 16) & 0x03 | (0xFC if value < 0 else 0x00),
+                    (code >> 8) & 0xFF, code & 0xFF, config]
+        else:
+            code = value & 0xFFFF
+            data = [(code >> 8) & 0xFF, code & 0xFF, config, config]
+        return data[:length]
+
+
+class cSimRig:
+    """
+    Simulated actuator, load cell and MCP3424 wired together as in the
+    centrifuge package: the load cell is read on channel 1 at 0x68 and the
+    actuator is driven through cSimGPIO on the default motor driver pins.
+    With several axes, axis i is driven on mMotorDriver.PIN_MAPS[i] and its
+    load cell is read on channel 1 of the MCP3424 at 0x68 + i; plants
+    lists the plant of every axis.
+    """
+
+    def __init__(self, speedup=None, noise=0.0005, errorRate=0.0, seed=1,
+                 axes=1, **plantArgs):
+        self.clock = cSimClock(speedup)
+        self.gpio = cSimGPIO()
+        self.plants = [cSimPlant(self.gpio, self.clock, pins=PIN_MAPS[i],
+                                 **plantArgs) for i in range(axes)]
+        self.plant = self.plants[0]
+        if axes == 1:
+            sources = {1: self.plant.voltage}
+        else:
+            sources = dict(((0x68 + i, 1), plant.voltage)
+                           for i, plant in enumerate(self.plants))
+        self.bus = cSimMCP3424(self.clock, sources, noise=noise,
+                               errorRate=errorRate, seed=seed,
+                               addresses=tuple(0x68 + i for i in range(axes)))
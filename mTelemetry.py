@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Live telemetry over UDP from the control loop to the control room.
+cTelemetryPublisher.publish() only appends the sample to a bounded queue,
+so the control loop never blocks on the network; a background thread packs
+batches of samples into fixed-layout binary datagrams and sends them.
+cTelemetryReceiver unpacks the datagrams, puts them back in order, drops
+duplicates and counts the lost datagrams and samples.
+
+Wire format (little endian), one header followed by count samples:
+    header  magic b'FBPT', version (u8), flags (u8), count (u16),
+            session (u32, random per publisher), sequence (u32, datagram
+            number), first (u64, number of the first sample)
+    sample  time (f8, sec), load (f8, kg), speed (f4, PWM%), state (u8)
+
+Samples are numbered consecutively by the publisher, so a gap in the sample
+numbers also shows samples dropped when the queue of the publisher was
+full. A new session number (publisher restarted) restarts the stream.
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import random
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b'FBPT'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIIQ')
+SAMPLE = struct.Struct('<ddfB')
+MAX_DATAGRAM = 1400  # stay below the Ethernet MTU, no IP fragmentation
+MAX_SAMPLES = (MAX_DATAGRAM - HEADER.size) // SAMPLE.size
+
+# A received sample; number is its position in the published stream
+TelemetrySample = collections.namedtuple('TelemetrySample', [
+    'number', 'time', 'load', 'speed', 'state'])
+
+
+class cTelemetryPublisher:
+    """
+    send (time, load, speed, state) samples to host:port in batches of up
+    to batchSize samples, at least every maxDelay seconds
+    """
+
+    def __init__(self, host, port=20001, batchSize=32, maxDelay=0.05,
+                 capacity=4096, clock=time):
+        if not 1 <= batchSize <= MAX_SAMPLES:
+            raise ValueError("cTelemetryPublisher: batchSize must be 1 to %i"
+                             % MAX_SAMPLES)
+        self.address = (host, port)
+        self.batchSize = batchSize
+        self.maxDelay = maxDelay
+        self.clock = clock
+        self.session = random.getrandbits(32)
+        self.published = 0   # samples passed to publish()
+        self.dropped = 0     # samples lost because the queue was full
+        self.sent = 0        # datagrams sent
+        self.sendErrors = 0  # datagrams the network refused
+        self.__queue = collections.deque(maxlen=capacity)
+        self.__wake = threading.Event()
+        self.__buffer = bytearray(HEADER.size + batchSize * SAMPLE.size)
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__thread = None
+        self.__running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def publish(self, t, load, speed, state):
+        """
+        queue one sample; never blocks (the oldest sample is dropped when
+        the queue is full)
+        """
+        queue = self.__queue
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append((self.published, t, load, speed, state))
+        self.published += 1
+        if len(queue) >= self.batchSize:
+            self.__wake.set()
+
+    def flush(self):
+        """
+        pack and send the queued samples, batchSize per datagram; called by
+        the sender thread, or directly when the publisher is not started
+        (e.g. by a cRuntime task, mRuntime.py)
+        """
+        queue = self.__queue
+        buffer = self.__buffer
+        carry = None  # first sample of the next datagram after a gap
+        while carry is not None or queue:
+            count = 0
+            first = None
+            offset = HEADER.size
+            while count < self.batchSize:
+                if carry is not None:
+                    sample, carry = carry, None
+                elif queue:
+                    sample = queue.popleft()
+                else:
+                    break
+                number, t, load, speed, state = sample
+                if first is None:
+                    first = number
+                elif number != first + count:
+                    # samples were dropped: start a new datagram, keeping
+                    # this sample off the queue the producer appends to
+                    carry = sample
+                    break
+                SAMPLE.pack_into(buffer, offset, t, load, speed, state)
+                offset += SAMPLE.size
+                count += 1
+            HEADER.pack_into(buffer, 0, MAGIC, VERSION, 0, count,
+                             self.session, self.sent & 0xFFFFFFFF, first)
+            try:
+                self.__socket.sendto(memoryview(buffer)[:offset],
+                                     self.address)
+            except (IOError, OSError):
+                self.sendErrors += 1
+            self.sent += 1
+
+    def __run(self):
+        # sender thread: wakes on a full batch or after maxDelay
+        while self.__running:
+            self.__wake.wait(self.maxDelay)
+            self.__wake.clear()
+            self.flush()
+        self.flush()  # flush the remaining samples
+
+    def start(self):
+        if self.__running:
+            return
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run,
+                                         name="cTelemetryPublisher")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        send the queued samples and stop the sender thread
+        """
+        self.__running = False
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self):
+        self.stop()
+        self.flush()  # when the sender thread was never started
+        self.__socket.close()
+
+
+class cTelemetryReceiver:
+    """
+    receive the datagrams of a cTelemetryPublisher on port and return the
+    samples in order. Datagrams arriving out of order are held back until
+    reorderWindow later datagrams have arrived; the missing ones then count
+    as lost.
+    """
+
+    def __init__(self, port=20001, host="", reorderWindow=8):
+        self.reorderWindow = reorderWindow
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.reset()
+
+    def reset(self):
+        self.session = None
+        self.received = 0      # datagrams received
+        self.invalid = 0       # datagrams with a bad magic, version or size
+        self.late = 0          # duplicate datagrams or arriving too late
+        self.lostDatagrams = 0
+        self.lostSamples = 0   # gaps in the sample numbers
+        self.gaps = collections.deque(maxlen=100)  # (first, last) missing
+        self.samples = 0       # samples delivered
+        self.__expected = None  # next datagram sequence number
+        self.__next = None      # next sample number
+        self.__pending = {}     # out of order datagrams by sequence
+
+    def __unpack(self, data):
+        # returns (session, sequence, samples) or None for a bad datagram
+        if len(data) < HEADER.size:
+            return None
+        magic, version, flags, count, session, sequence, first = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or \
+                len(data) != HEADER.size + count * SAMPLE.size:
+            return None
+        samples = [TelemetrySample(first + i, *SAMPLE.unpack_from(
+            data, HEADER.size + i * SAMPLE.size)) for i in range(count)]
+        return session, sequence, samples
+
+    def __deliver(self, samples, out):
+        if samples:
+            first = samples[0].number
+            if self.__next is not None and first > self.__next:
+                self.lostSamples += first - self.__next
+                self.gaps.append((self.__next, first - 1))
+            self.__next = samples[-1].number + 1
+        self.samples += len(samples)
+        out.extend(samples)
+
+    def feed(self, data):
+        """
+        process one datagram; returns the samples now available in order
+        """
+        packet = self.__unpack(data)
+        if packet is None:
+            self.invalid += 1
+            return []
+        session, sequence, samples = packet
+        self.received += 1
+        if session != self.session:  # new or restarted publisher
+            self.session = session
+            self.__expected = sequence
+            self.__next = None
+            self.__pending = {}
+        if sequence < self.__expected or sequence in self.__pending:
+            self.late += 1
+            return []
+        out = []
+        pending = self.__pending
+        pending[sequence] = samples
+        if len(pending) > self.reorderWindow:  # give up on the missing
+            oldest = min(pending)
+            self.lostDatagrams += oldest - self.__expected
+            self.__expected = oldest
+        while self.__expected in pending:
+            self.__deliver(pending.pop(self.__expected), out)
+            self.__expected += 1
+        return out
+
+    def receive(self, timeout=None):
+        """
+        wait up to timeout seconds (None = forever) for datagrams and
+        return the samples that became available, in order
+        """
+        self.socket.settimeout(timeout)
+        out = []
+        try:
+            data = self.socket.recv(65536)
+            self.socket.setblocking(False)
+            while True:  # also take everything else already waiting
+                out.extend(self.feed(data))
+                data = self.socket.recv(65536)
+        except (socket.timeout, BlockingIOError):
+            pass
+        return out
+
+    def close(self):
+        self.socket.close()
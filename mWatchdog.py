@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Fly-by-Pi Controller
+
+Load limit watchdog: a safety thread, independent of the control loop,
+that watches the sample stream of the load cell and stops the motor
+before a hard load limit is exceeded. Every new sample is converted to a
+load and a straight line is fitted through the samples of the last window
+seconds; the motor is locked out (cMotorDriver.lockOut) once the newest
+load reaches the limit or the fitted load, extrapolated horizon seconds
+ahead along its slope, would. The horizon covers the reaction time of the
+watchdog and the coasting of the actuator after the driver is disabled,
+so a fast rise is stopped at the limit instead of overshooting it. The
+motor is also locked out if no new sample arrives for sampleTimeout
+seconds (the load is unknown) or, with a loopTimeout, if the control loop
+stops calling kick().
+
+The thread polls latest() at rate Hz with cLoopScheduler, optionally at
+a SCHED_FIFO priority above the control loop and pinned to a CPU core
+(Linux, requires root). A Python thread still needs the GIL: it runs at
+the latest one switch interval (sys.getswitchinterval(), 5 ms by
+default) after becoming runnable. A trip is latched: the motor stays
+disabled until reset().
+
+The detection latency of every sample (from its acquisition until the
+watchdog has checked it) is recorded in a histogram, and the reaction
+latency of a trip (from the sample or deadline that triggered it until
+the driver is disabled) in reaction.
+
+    watchdog = cLoadWatchdog(motor, stream.latest, calibration.lookup, 90)
+    watchdog.start()
+    while watchdog.tripped is None:
+        ...
+        watchdog.kick()
+    watchdog.stop()
+
+Open Source License: Creative Commons Attribution-ShareAlike
+"""
+
+from __future__ import absolute_import, division, print_function, \
+                                                    unicode_literals
+import collections
+import threading
+import time
+
+from mScheduler import cLatencyHistogram, cLoopScheduler
+
+
+# Watchdog statistics; times in seconds, reaction None until a trip
+WatchdogStats = collections.namedtuple('WatchdogStats', [
+    'samples', 'missed', 'peak', 'detection_p50', 'detection_p99',
+    'detection_max', 'reaction', 'tripped'])
+
+
+class cLoadWatchdog:
+    def __init__(self, motor, latest, convert, limit, horizon=0.2,
+                 window=0.25, sampleTimeout=0.3, loopTimeout=None, rate=200,
+                 ramp=None, priority=None, cpu=None, clock=time,
+                 onTrip=None):
+        self.motor = motor
+        self.latest = latest    # returns the newest (sequence, time, count)
+        self.convert = convert  # converts a count to the load (kg)
+        self.limit = limit      # hard load limit (kg)
+        self.horizon = horizon  # extrapolation of the load (sec); 0 disables it
+        self.window = window    # span of the samples fitted (sec)
+        self.sampleTimeout = sampleTimeout  # longest gap between samples (sec)
+        self.loopTimeout = loopTimeout  # longest gap between kick()s (sec) or None
+        self.ramp = ramp        # braked on a trip, if given
+        self.clock = clock
+        self.onTrip = onTrip    # called with the reason of a trip
+        self.scheduler = cLoopScheduler(rate, clock, priority, cpu)
+        self.detection = cLatencyHistogram()  # sample age when checked (us)
+        self.samples = 0        # samples checked
+        self.missed = 0         # samples replaced before they were checked
+        self.load = None        # newest load (kg)
+        self.slope = 0.0        # fitted load rate (kg/s)
+        self.peak = None        # highest load seen (kg)
+        self.tripped = None     # reason of the trip or None
+        self.reaction = None    # reaction latency of the trip (sec)
+        self.__history = collections.deque()  # (time, load) within window
+        self.__sequence = None
+        self.__tSample = None
+        self.__tKick = None
+        self.__running = False
+        self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def __run(self):
+        scheduler = self.scheduler
+        scheduler.start()  # the real-time settings apply to this thread
+        while self.__running and self.tripped is None:
+            scheduler.wait()
+            self.check()
+
+    def start(self):
+        """
+        start the watchdog thread; the timeouts run from now
+        """
+        if self.__running:
+            return
+        self.__tSample = self.__tKick = self.clock.monotonic()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="Watchdog")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        stop the watchdog thread; a trip stays latched
+        """
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def kick(self):  # called by the control loop on every tick (loopTimeout)
+        self.__tKick = self.clock.monotonic()
+
+    def reset(self):
+        """
+        clear a trip and allow the motor to be enabled again
+        """
+        self.__history.clear()
+        self.__tSample = self.__tKick = self.clock.monotonic()
+        self.tripped = None
+        self.reaction = None
+        self.motor.unlock()
+
+    def __fit(self):
+        # least squares line through the history: (load at the newest sample, slope)
+        history = self.__history
+        tLast, load = history[-1]
+        n = len(history)
+        if n < 3:
+            return load, 0.0
+        st = sl = stt = stl = 0.0
+        for t, value in history:
+            t -= tLast
+            st += t
+            sl += value
+            stt += t * t
+            stl += t * value
+        d = n * stt - st * st
+        if d <= 0.0:
+            return load, 0.0
+        slope = (n * stl - st * sl) / d
+        return (sl - slope * st) / n, slope
+
+    def check(self):
+        """
+        check the newest sample and the timeouts once (called by the
+        thread, or directly from a single-threaded loop); returns the
+        reason of the trip or None
+        """
+        if self.tripped is not None:
+            return self.tripped
+        if self.__tSample is None:  # checked without start()
+            self.__tSample = self.__tKick = self.clock.monotonic()
+        sample = self.latest()
+        now = self.clock.monotonic()
+        if sample is not None and sample[0] != self.__sequence:
+            sequence, t, count = sample
+            if self.__sequence is not None and sequence > self.__sequence + 1:
+                self.missed += sequence - self.__sequence - 1
+            self.__sequence = sequence
+            self.__tSample = t
+            self.samples += 1
+            self.detection.record((now - t) * 1e6)
+            load = self.convert(count)
+            self.load = load
+            if self.peak is None or load > self.peak:
+                self.peak = load
+            history = self.__history
+            history.append((t, load))
+            while history[0][0] < t - self.window:
+                history.popleft()
+            fitted, self.slope = self.__fit()
+            if load >= self.limit:
+                return self.__trip("load %.2f kg at the limit of %g kg"
+                                   % (load, self.limit), t)
+            if self.slope > 0.0 and \
+                    fitted + self.slope * self.horizon >= self.limit:
+                return self.__trip("load %.2f kg rising at %.1f kg/s towards"
+                                   " the limit of %g kg"
+                                   % (load, self.slope, self.limit), t)
+        if now - self.__tSample > self.sampleTimeout:
+            return self.__trip("no sample for %.2f sec" % self.sampleTimeout,
+                               self.__tSample + self.sampleTimeout)
+        if self.loopTimeout is not None and \
+                now - self.__tKick > self.loopTimeout:
+            return self.__trip("control loop stalled for %.2f sec"
+                               % self.loopTimeout,
+                               self.__tKick + self.loopTimeout)
+        return None
+
+    def __trip(self, reason, tEvent):
+        # cut the driver first, then stop the ramp from driving it again
+        self.motor.lockOut()
+        self.reaction = max(0.0, self.clock.monotonic() - tEvent)
+        if self.ramp is not None:
+            self.ramp.brake()
+        self.tripped = reason
+        if self.onTrip is not None:
+            self.onTrip(reason)
+        return reason
+
+    def stats(self):
+        """
+        returns WatchdogStats for the samples so far
+        """
+        detection = self.detection
+        return WatchdogStats(
+            self.samples, self.missed, self.peak,
+            detection.percentile(50) / 1e6, detection.percentile(99) / 1e6,
+            detection.max / 1e6, self.reaction, self.tripped)